@@ -8,6 +8,66 @@ Config = ConfigObj("/etc/faforever/faforever.conf")
 LOBBY_IP = Config.get('lobby_ip', '127.0.0.1')
 LOBBY_UDP_PORT = Config.get('lobby_udp_port', 30351)
 
+# Longest time a game list update is held back to be coalesced with others,
+# and the number of pending game updates that forces an early flush.
+GAME_LIST_MAX_LATENCY = float(Config.get('game_list_max_latency', 0.25))
+GAME_LIST_MAX_PENDING = int(Config.get('game_list_max_pending', 50))
+
+# Lobby server implementation: 'qt' (QTcpServer) or 'asyncio'
+LOBBY_SERVER = Config.get('lobby_server', 'qt')
+
+# Seconds between reloads of the featured mod file versions sent with game_info
+FEATURED_MOD_VERSION_REFRESH = int(Config.get('featured_mod_version_refresh', 300))
+
+# Number of game and player changes remembered for clients resuming their session
+LOBBY_EVENT_HISTORY = int(Config.get('lobby_event_history', 10000))
+
+# Number of sessions of players that left kept for them to resume, the oldest go first
+LOBBY_CLOSED_SESSIONS = int(Config.get('lobby_closed_sessions', 10000))
+
+# Seconds between reloads of the map catalogue, for maps not uploaded through the lobby
+MAP_CATALOGUE_REFRESH = int(Config.get('map_catalogue_refresh', 3600))
+
+# Sim mods whose name and ranked flag are kept, and for how many seconds
+MOD_CACHE_SIZE = int(Config.get('mod_cache_size', 2000))
+MOD_CACHE_TTL = int(Config.get('mod_cache_ttl', 3600))
+
+# Seconds between writes of the statistics counters (downloads, times played...)
+COUNTER_FLUSH_INTERVAL = int(Config.get('counter_flush_interval', 30))
+
+# Processes rating the games that ended, 0 to rate them on a thread, and
+# the times storing a game's results is tried.
+POST_GAME_WORKERS = int(Config.get('post_game_workers', 0))
+POST_GAME_RETRIES = int(Config.get('post_game_retries', 3))
+
+# Seconds a game may stay idle before its lobby opens, the longest a game
+# may last, and the seconds between two runs of the game expiry.
+GAME_IDLE_TIMEOUT = int(Config.get('game_idle_timeout', 60))
+GAME_MAX_DURATION = int(Config.get('game_max_duration', 8 * 60 * 60))
+GAME_EXPIRY_TICK = int(Config.get('game_expiry_tick', 5))
+
+# Database connections queries run on off the event loop, 0 to run them
+# on the event loop, and the seconds a query may take.
+DB_POOL_SIZE = int(Config.get('db_pool_size', 8))
+DB_QUERY_TIMEOUT = float(Config.get('db_query_timeout', 10))
+
+# Seconds a reverse DNS lookup may take, how long its result is kept, and
+# the number of addresses kept.
+RESOLVER_TIMEOUT = float(Config.get('resolver_timeout', 2))
+RESOLVER_TTL = int(Config.get('resolver_ttl', 3600))
+RESOLVER_CACHE_SIZE = int(Config.get('resolver_cache_size', 10000))
+
+# Bytes a lobby connection may have pending in its socket before further
+# messages are queued, and the most a slow client may have queued before
+# it gets disconnected.
+LOBBY_SOCKET_BUFFER = int(Config.get('lobby_socket_buffer', 256 * 1024))
+LOBBY_CLIENT_BUDGET = int(Config.get('lobby_client_budget', 4 * 1024 * 1024))
+
+# Seconds an update or replay vault client may send nothing before it gets
+# disconnected, 0 to keep them connected.
+UPDATER_IDLE_TIMEOUT = int(Config.get('updater_idle_timeout', 300))
+REPLAY_IDLE_TIMEOUT = int(Config.get('replay_idle_timeout', 300))
+
 LOG_PATH = Config.get('logpath', './logs/')
 LOG_LEVEL = eval('logging.{}'.format(Config.get('loglevel', 'DEBUG')))
 logging.info("Setting default log level {}".format(LOG_LEVEL))
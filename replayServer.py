@@ -19,8 +19,10 @@
 #-------------------------------------------------------------------------------
 
 
+import asyncio
 from logging import handlers
 
+from quamash import QEventLoop
 from PySide.QtCore import QObject
 from configobj import ConfigObj
 
@@ -76,8 +78,10 @@ if __name__ == '__main__':
     try:
         
         app = QtCore.QCoreApplication(sys.argv)
+        loop = QEventLoop(app)
+        asyncio.set_event_loop(loop)
         server = start()
-        app.exec_()
+        loop.run_forever()
     
     except Exception as ex:
         
@@ -21,6 +21,7 @@ import logging
 from PySide import QtNetwork
 from PySide.QtSql import *
 
+import config
 
 UNIT16 = 8
 
@@ -53,9 +54,9 @@ class replayServer(QtNetwork.QTcpServer):
 
     def incomingConnection(self, socketId):
         self.logger.debug("Incoming replay Connection")
-        self.replayVault.append(replayServerThread.replayServerThread(socketId, self))    
+        self.replayVault.append(replayServerThread.replayServerThread(socketId, self,
+                                                                      idle_timeout=config.REPLAY_IDLE_TIMEOUT or None))
     
     def removeUpdater(self, updater):
         if updater in self.replayVault:
             self.replayVault.remove(updater)
-            updater.deleteLater()    
@@ -19,63 +19,38 @@
 
 from functools import reduce
 
-from PySide.QtCore import QObject
-from PySide.QtCore import QByteArray, QDataStream, QIODevice, QFile, QCoreApplication
 from PySide import QtNetwork
 from PySide.QtSql import *
 from configobj import ConfigObj
 
+from src.framed_connection import FramedConnection
+
 config = ConfigObj("/etc/faforever/faforever.conf")
 
 import os
 import logging
-import json
 import urllib.request, urllib.error, urllib.parse
 import datetime
 
-class replayServerThread(QObject):
+class replayServerThread(FramedConnection):
     """
     FA server thread spawned upon every incoming connection to
     prevent collisions.
     """
     
     
-    def __init__(self, socketId, parent=None):
-        super(replayServerThread, self).__init__(parent)
+    def __init__(self, socketId, parent=None, idle_timeout=None):
+        socket = QtNetwork.QTcpSocket()
+        socket.setSocketDescriptor(socketId)
+        FramedConnection.__init__(self, socket, parent, prefix='replay', idle_timeout=idle_timeout)
 
         self.logger = logging.getLogger(__name__)
 
         self.season = "ladder_season_5"
-        self.socket = QtNetwork.QTcpSocket(self)
-        self.socket.setSocketDescriptor(socketId)
-        self.parent = parent
         
         if self.socket.state() == 3 and self.socket.isValid() :
-            
-            self.nextBlockSize = 0
-    
-            self.blockSize = 0   
-
-            self.socket.readyRead.connect(self.readDatas)
-            self.socket.disconnected.connect(self.disconnection)
-            self.socket.error.connect(self.displayError)
             self.parent.db.open()   
 
-        
-
-            
-    def lock(self):
-        pass
-#        query = QSqlQuery(self.parent.db)
-#        query.prepare("SET SESSION TRANSACTION ISOLATION LEVEL READ UNCOMMITTED ;")
-#        query.exec_()
-        
-    def unlock(self):
-        pass
-#        query = QSqlQuery(self.parent.db)
-#        query.prepare("SET SESSION TRANSACTION ISOLATION LEVEL REPEATABLE READ ;")
-#        query.exec_()        
-            
 
     def command_modvault_search(self, message):
         """that function is used by the mod vault to search for mods!"""
@@ -699,129 +674,8 @@ AND (-1 = ? OR mapId = ?) \n"
             self.sendJSON(dict(command = "replay_vault", action = "info_replay", uid = uid, players = players))
         
     
-    def handleAction(self, action, stream):
-        self.receiveJSON(action, stream)
-        return 1
-
-
-
-    def readDatas(self):
-        if self.socket is not None:
-            if self.socket.isValid() :
-                ins = QDataStream(self.socket)
-                ins.setVersion(QDataStream.Qt_4_2)
-                loop = 0
-                while not ins.atEnd():
-                    QCoreApplication.processEvents()
-                    loop += 1
-                    if self.socket is not None:
-                        if self.socket.isValid() :
-                            if self.blockSize == 0:
-                                if self.socket.isValid() :
-                                    if self.socket.bytesAvailable() < 4:
-                                        return
-                                    self.blockSize = ins.readUInt32()
-                                else :
-                                    return
-                            if self.socket.isValid() :
-                                if self.socket.bytesAvailable() < self.blockSize:
-                                    bytesReceived = str(self.socket.bytesAvailable())
-                                    return
-                                bytesReceived = str(self.socket.bytesAvailable())
-                            else :
-                                return  
-                            action = ins.readQString()
-                            self.handleAction(action, ins)
-                            self.blockSize = 0
-                        else : 
-                            return    
-                    else :
-                        return
-                return
-
-    def disconnection(self):
-        self.done()
-
-    def sendJSON(self, data_dictionary):
-        """
-        Simply dumps a dictionary into a string and feeds it into the QTCPSocket
-        """
-        data_string = ""
-        try :
-            data_string = json.dumps(data_dictionary)
-        except :
-
-            return
-
-        self.sendReply(data_string)
-
-    def receiveJSON(self, data_string, stream):
-        """
-        A fairly pythonic way to process received strings as JSON messages.
-        """
-        message = json.loads(data_string)
-        cmd = "command_" + message['command']
-        self.logger.debug("handling command : " + cmd)
-        if hasattr(self, cmd):
-            
-            self.lock()
-            getattr(self, cmd)(message)
-            self.unlock()  
-
-
-    def sendReply(self, action, *args, **kwargs) :
-        
-        try :
-            
-            if hasattr(self, "socket"):
-
-                reply = QByteArray()
-                stream = QDataStream(reply, QIODevice.WriteOnly)
-                stream.setVersion(QDataStream.Qt_4_2)
-                stream.writeUInt32(0)
-                
-                stream.writeQString(action)
-
-    
-                for arg in args :
-                    if type(arg) is LongType :
-                        stream.writeQString(str(arg))
-                    if type(arg) is IntType:
-                        stream.writeInt(int(arg))
-                    elif type(arg) is StringType  :
-                        stream.writeQString(arg)
-                    elif isinstance(arg, str):                       
-                        stream.writeQString(arg) 
-                    elif type(arg) is FloatType:
-                        stream.writeFloat(arg)
-                    elif type(arg) is ListType:
-                        stream.writeQString(str(arg))                        
-                    elif type(arg) is QFile :
-                        arg.open(QIODevice.ReadOnly)
-                        fileDatas = QByteArray(arg.readAll())
-                        stream.writeInt32(fileDatas.size())
-                        stream.writeRawData(fileDatas.data())
-                        arg.close()                        
-                #stream << action << options
-                stream.device().seek(0)
-                
-                stream.writeUInt32(reply.size() - 4)
-                self.socket.write(reply)
-
-
-        except :
-                self.logger.exception("Something awful happened when sending reply !")  
-  
     def done(self) :
-        if self.socket is not None:
-            #self.parent.addSocketToDelete(self.socket)
-            self.socket.readyRead.disconnect(self.readDatas)
-            self.socket.disconnected.disconnect(self.disconnection)
-            self.socket.error.disconnect(self.displayError)
-            self.socket.close()
-            #self.socket.deleteLater()
-            self.socket = None
-        
+        self.closeSocket()
         self.parent.removeUpdater(self)
         
         
@@ -29,6 +29,8 @@ from PySide.QtCore import QTimer
 
 from passwords import PRIVATE_KEY, DB_SERVER, DB_PORT, DB_LOGIN, DB_PASSWORD, DB_TABLE
 from src.FaLobbyServer import FALobbyServer
+from src.asyncio_lobby_server import AsyncioLobbyServer
+from src.db_pool import DatabasePool
 from src.FaGamesServer import FAServer
 from src.games_service import GamesService
 from src.players import *
@@ -69,20 +71,30 @@ if __name__ == '__main__':
                 self.logger.error(self.db.lastError().text())
                 sys.exit(1)
 
-            self.dirtyGameList = []
-            self.games = GamesService(self.players_online, self.db)
+            self.db_pool = DatabasePool(self.db, size=config.DB_POOL_SIZE, timeout=config.DB_QUERY_TIMEOUT, loop=loop)
+            self.games = GamesService(self.players_online, self.db, self.db_pool)
+            self.games.map_catalogue.load(self.db)
+            self.games.counters.start(config.COUNTER_FLUSH_INTERVAL)
 
-            self.FALobby = FALobbyServer(self.players_online, self.games, self.db, self)
+            if config.LOBBY_SERVER == 'asyncio':
+                self.FALobby = AsyncioLobbyServer(self.players_online, self.games, self.db, self, loop=loop)
+            else:
+                self.FALobby = FALobbyServer(self.players_online, self.games, self.db, self, loop=loop)
             self.FAGames = FAServer(loop, self.players_online, self.games, self.db, self)
 
             # Make sure we can shutdown gracefully
-            signal.signal(signal.SIGTERM, self.signal_handler)
-            signal.signal(signal.SIGINT, self.signal_handler)
-            def poll_signal():
-                pass
-            timer = QTimer(self)
-            timer.timeout.connect(poll_signal)
-            timer.start(200)
+            try:
+                for signum in (signal.SIGTERM, signal.SIGINT):
+                    loop.add_signal_handler(signum, self.signal_handler, signum, None)
+            except NotImplementedError:
+                # the Qt event loop has to wake up now and then for the signal handlers to run
+                signal.signal(signal.SIGTERM, self.signal_handler)
+                signal.signal(signal.SIGINT, self.signal_handler)
+                def poll_signal():
+                    pass
+                timer = QTimer(self)
+                timer.timeout.connect(poll_signal)
+                timer.start(200)
 
 
             if not self.FAGames.run(QtNetwork.QHostAddress.Any):
@@ -92,18 +104,30 @@ if __name__ == '__main__':
                 self.logger.info ("starting the game server on  %s:%i" % (self.FAGames.serverAddress().toString(),self.FAGames.serverPort()))
 
 
-            if not self.FALobby.listen(QtNetwork.QHostAddress.Any, 8001):
+            if config.LOBBY_SERVER == 'asyncio':
+                listening = asyncio.ensure_future(self.FALobby.listen('', 8001), loop=loop)
+                listening.add_done_callback(self.lobby_listening)
+            elif not self.FALobby.listen(QtNetwork.QHostAddress.Any, 8001):
                 self.logger.error("Unable to start the server {}".format(self.FALobby.serverError()))
                 print("Unable to start the server {}".format(self.FALobby.serverError()))
                 raise Exception("Unable to start the lobby server")
             else:
                 self.logger.info ("starting the Lobby server on  %s:%i" % (self.FALobby.serverAddress().toString(),self.FALobby.serverPort()))
 
+        def lobby_listening(self, listening):
+            if listening.exception() is not None:
+                self.logger.error("Unable to start the lobby server: {}".format(listening.exception()))
+                self.set_exception(listening.exception())
+
         def signal_handler(self, signal, frame):
             self.logger.info("Received signal, shutting down")
             self.set_result(0)
             self.FALobby.close()
+            self.FALobby.resolver.close()
             self.FAGames.close()
+            self.games.counters.close(self.db)
+            self.games.post_game.close()
+            self.db_pool.close()
             self._loop.stop()
 
         def jsonPlayer(self, player):
@@ -19,9 +19,12 @@
 #-------------------------------------------------------------------------------
 
 
+import asyncio
 from logging import handlers
+import signal
 
-from PySide.QtCore import QObject
+from quamash import QEventLoop
+from PySide.QtCore import QObject, QTimer
 
 from passwords import DB_SERVER, DB_PORT, DB_LOGIN, DB_PASSWORD, DB_TABLE
 import config
@@ -69,9 +72,30 @@ class start(QObject):
                 return
             else:
                 self.logger.info("Starting the update server on  %s:%i" % (self.updater.serverAddress().toString(),self.updater.serverPort()))
+
+            # Make sure we can shutdown gracefully, with the download counts written
+            loop = asyncio.get_event_loop()
+            try:
+                for signum in (signal.SIGTERM, signal.SIGINT):
+                    loop.add_signal_handler(signum, self.signal_handler, signum, None)
+            except NotImplementedError:
+                # the Qt event loop has to wake up now and then for the signal handlers to run
+                signal.signal(signal.SIGTERM, self.signal_handler)
+                signal.signal(signal.SIGINT, self.signal_handler)
+                def poll_signal():
+                    pass
+                timer = QTimer(self)
+                timer.timeout.connect(poll_signal)
+                timer.start(200)
         except Exception as e:
             self.logger.exception("Error: %r" % e)
 
+    def signal_handler(self, signal, frame):
+        self.logger.info("Received signal, shutting down")
+        self.updater.close()
+        self.updater.counters.close(self.db)
+        asyncio.get_event_loop().stop()
+
 if __name__ == '__main__':
     logger = logging.getLogger(__name__)
     import sys
@@ -79,8 +103,10 @@ if __name__ == '__main__':
     try:
 
         app = QtCore.QCoreApplication(sys.argv)
+        loop = QEventLoop(app)
+        asyncio.set_event_loop(loop)
         server = start()
-        app.exec_()
+        loop.run_forever()
 
     except Exception as e:
 
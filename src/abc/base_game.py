@@ -24,6 +24,10 @@ class BaseGame():
         pass  # pragma: no cover
 
     def rate_game(self):
+        """
+        The rating to rate the game by once it ended, None not to rate it
+        :rtype str
+        """
         pass  # pragma: no cover
 
     @property
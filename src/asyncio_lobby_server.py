@@ -0,0 +1,169 @@
+import asyncio
+from collections import namedtuple
+
+from src import lobbyconnection
+from src.decorators import with_logger
+from src.games_service import GamesService
+from src.lobby_server import BaseLobbyServer
+import config
+
+# QAbstractSocket.SocketState values LobbyConnection checks for
+UNCONNECTED_STATE = 0
+CONNECTED_STATE = 3
+
+
+class Signal():
+    """
+    Stand-in for a Qt signal: slots are called in the order they were connected
+    """
+    def __init__(self):
+        self._slots = []
+
+    def connect(self, slot):
+        self._slots.append(slot)
+
+    def disconnect(self, slot):
+        if slot in self._slots:
+            self._slots.remove(slot)
+
+    def emit(self, *args):
+        for slot in list(self._slots):
+            slot(*args)
+
+    def __bool__(self):
+        return bool(self._slots)
+
+
+class PeerAddress(namedtuple('PeerAddress', 'host')):
+    def toString(self):
+        return self.host
+
+
+@with_logger
+class LobbySocket(asyncio.Protocol):
+    """
+    A lobby client socket on asyncio
+
+    Provides the parts of the QTcpSocket interface that LobbyConnection
+    uses. Received data is handed straight to the connection while it
+    listens to readyRead, rather than buffered until it calls readAll.
+    Writes past LOBBY_SOCKET_BUFFER pause the transport, and
+    bytesWritten fires once it drained, like with a QTcpSocket.
+    """
+    def __init__(self, server):
+        self.server = server
+        self.connection = None
+        self.transport = None
+        # closed or lost, transports only tell from Python 3.5.1 on
+        self._closing = False
+        self._state = UNCONNECTED_STATE
+        self._error = ''
+        self._peer = ('', 0)
+
+        self.readyRead = Signal()
+        self.bytesWritten = Signal()
+        self.disconnected = Signal()
+        self.error = Signal()
+        self.stateChanged = Signal()
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self._peer = transport.get_extra_info('peername') or ('', 0)
+        transport.set_write_buffer_limits(high=config.LOBBY_SOCKET_BUFFER)
+        self._set_state(CONNECTED_STATE)
+        self.connection = lobbyconnection.LobbyConnection(self, self.server)
+        self.server.recorders.add(self.connection)
+
+    def data_received(self, data):
+        if self.readyRead:
+            self.connection.receiveData(data)
+
+    def pause_writing(self):
+        pass
+
+    def resume_writing(self):
+        self.bytesWritten.emit(0)
+
+    def connection_lost(self, exc):
+        self._closing = True
+        self._set_state(UNCONNECTED_STATE)
+        if exc is not None:
+            self._error = str(exc)
+            self.error.emit(exc)
+        self.disconnected.emit()
+
+    def _set_state(self, state):
+        if state != self._state:
+            self._state = state
+            self.stateChanged.emit(state)
+
+    def state(self):
+        return self._state
+
+    def isValid(self):
+        return self.transport is not None and not self._closing
+
+    def write(self, data):
+        if not self.isValid():
+            return -1
+        self.transport.write(data)
+        return len(data)
+
+    def bytesToWrite(self):
+        if self.transport is None:
+            return 0
+        return self.transport.get_write_buffer_size()
+
+    def abort(self):
+        if self.transport is not None:
+            self._closing = True
+            self.transport.abort()
+
+    def close(self):
+        if self.transport is not None:
+            self._closing = True
+            self.transport.close()
+
+    def peerAddress(self):
+        return PeerAddress(self._peer[0])
+
+    def peerPort(self):
+        return self._peer[1]
+
+    def peerName(self):
+        return ''
+
+    def errorString(self):
+        return self._error
+
+    def deleteLater(self):
+        pass
+
+
+@with_logger
+class AsyncioLobbyServer(BaseLobbyServer):
+    """
+    The lobby server on asyncio, without QTcpServer and QTcpSockets
+
+    Runs on a standard asyncio event loop as well as on quamash's.
+    """
+    def __init__(self, listUsers, games: GamesService, db, parent=None, loop=None):
+        BaseLobbyServer.__init__(self, listUsers, games, db, parent, loop)
+        self._server = None
+
+    @asyncio.coroutine
+    def listen(self, host, port):
+        """
+        Start accepting clients
+        :return: asyncio.Server
+        """
+        self._server = yield from self.loop.create_server(lambda: LobbySocket(self), host, port)
+        self._logger.info("Lobby server listening on {}:{}".format(host, port))
+        return self._server
+
+    def close(self):
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+        for connection in self.recorders:
+            connection.socket.abort()
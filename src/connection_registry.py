@@ -0,0 +1,58 @@
+from collections import OrderedDict
+from enum import Enum
+
+
+class ConnectionState(Enum):
+    OPEN = 0
+    CLOSING = 1
+
+
+class ConnectionRegistry():
+    """
+    Keeps track of the connections accepted by a server.
+
+    Membership tests, liveness checks and removal are O(1), since they are
+    done on every message sent. Iterating yields a snapshot, so connections
+    may be added or removed while a broadcast is in progress.
+    """
+    def __init__(self):
+        self._connections = OrderedDict()
+
+    def add(self, connection):
+        self._connections[connection] = ConnectionState.OPEN
+
+    def remove(self, connection):
+        """
+        Forget about a connection
+        :return: bool whether the connection was registered
+        """
+        return self._connections.pop(connection, None) is not None
+
+    def mark_closing(self, connection):
+        """
+        Flag a connection as going away, nothing should be sent to it anymore
+        :return: None
+        """
+        if connection in self._connections:
+            self._connections[connection] = ConnectionState.CLOSING
+
+    def is_alive(self, connection):
+        return self._connections.get(connection) is ConnectionState.OPEN
+
+    def alive(self):
+        """
+        Snapshot of the connections that are still open
+        :return: list
+        """
+        return [connection
+                for connection, state in list(self._connections.items())
+                if state is ConnectionState.OPEN]
+
+    def __contains__(self, connection):
+        return connection in self._connections
+
+    def __len__(self):
+        return len(self._connections)
+
+    def __iter__(self):
+        return iter(list(self._connections))
@@ -0,0 +1,125 @@
+import asyncio
+from collections import namedtuple
+
+from src import metrics
+from src.db_pool import execute, in_lists, run_in_transaction
+from src.decorators import with_logger
+from src.timer import Timer
+
+Column = namedtuple('Column', ['table', 'column', 'key'])
+
+MOD_PLAYED = Column('table_mod', 'played', 'uid')
+MOD_DOWNLOADS = Column('table_mod', 'downloads', 'uid')
+MAP_TIMES_PLAYED = Column('table_map_features', 'times_played', 'map_id')
+MAP_DRAWS = Column('table_map_features', 'num_draws', 'map_id')
+LADDER_CANCELLED = Column('login', 'ladderCancelled', 'id')
+
+
+@with_logger
+class CounterAggregator():
+    """
+    Write-behind for the statistics that only ever get incremented
+
+    Increments add up in memory and are written every interval seconds,
+    with one UPDATE per column and amount for all the rows at once, in a
+    single transaction. If the write fails, they are kept for the next one.
+    Until they are written, reads wanting the current value add pending().
+
+        counters.incr(MOD_DOWNLOADS, uid)
+    """
+    def __init__(self, db_pool, loop=None):
+        self.db_pool = db_pool
+        self._loop = loop
+        self._timer = None
+        # Column -> key -> amount
+        self._pending = {}
+        # what the flush in progress is writing
+        self._flushing = {}
+
+    def start(self, interval):
+        """
+        Flush every interval seconds
+        """
+        self._timer = Timer(lambda: self.db_pool.spawn(self.flush()), loop=self._loop)
+        self._timer.start(interval * 1000)
+
+    def incr(self, column, key, amount=1):
+        by_key = self._pending.setdefault(column, {})
+        by_key[key] = by_key.get(key, 0) + amount
+
+    def pending(self, column, key):
+        """
+        :return: how much is yet to be added to the column of that row
+        """
+        return (self._pending.get(column, {}).get(key, 0)
+                + self._flushing.get(column, {}).get(key, 0))
+
+    @classmethod
+    def statements(cls, deltas):
+        """
+        :return: list of (sql, params) adding the deltas
+        """
+        statements = []
+        for column, by_key in sorted(deltas.items()):
+            by_amount = {}
+            for key, amount in by_key.items():
+                if amount:
+                    by_amount.setdefault(amount, []).append(key)
+            for amount, keys in sorted(by_amount.items()):
+                # the key lists are padded, so that only a few statements get prepared
+                for batch in in_lists(keys):
+                    sql = "UPDATE `{0.table}` SET `{0.column}` = `{0.column}` + ? WHERE `{0.key}` IN ({1})".format(
+                        column, ", ".join("?" * len(batch)))
+                    statements.append((sql, [amount] + batch))
+        return statements
+
+    @staticmethod
+    def write(db, statements):
+        """
+        Run the statements in one transaction, on any thread
+        """
+        def work(db):
+            for sql, params in statements:
+                execute(db, sql, *params)
+        run_in_transaction(db, work)
+
+    def _merge(self, deltas):
+        for column, by_key in deltas.items():
+            for key, amount in by_key.items():
+                self.incr(column, key, amount)
+
+    @asyncio.coroutine
+    def flush(self):
+        """
+        Write what's pending, keeping it for the next flush if that fails
+        """
+        if not self._pending or self._flushing:
+            return
+        deltas, self._pending = self._pending, {}
+        self._flushing = deltas
+        statements = self.statements(deltas)
+        try:
+            yield from self.db_pool.run(self.write, statements)
+            metrics.incr('counters.flushes')
+            metrics.incr('counters.statements', len(statements))
+        except Exception:
+            self._logger.exception("Failed to write {} counter updates, keeping them".format(len(statements)))
+            self._merge(deltas)
+        finally:
+            self._flushing = {}
+
+    def close(self, db=None):
+        """
+        Stop flushing and write what's pending, straight away on db if given
+        """
+        if self._timer is not None:
+            self._timer.stop()
+            self._timer = None
+        if db is None:
+            self.db_pool.spawn(self.flush())
+            return
+        deltas, self._pending = self._pending, {}
+        try:
+            self.write(db, self.statements(deltas))
+        except Exception:
+            self._logger.exception("Failed to write the counter updates on shutdown")
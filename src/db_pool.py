@@ -0,0 +1,357 @@
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+from PySide.QtSql import QSqlDatabase, QSqlQuery
+
+from src import metrics
+from src.decorators import with_logger
+
+
+class QueryError(Exception):
+    pass
+
+
+class QueryTimeout(QueryError):
+    pass
+
+
+class StatementCache():
+    """
+    Prepared statements of one connection, by their SQL text
+
+    Preparing costs a round trip to the database, so hot queries are
+    prepared once and then only bound and executed. Only statements whose
+    text doesn't change belong in here: values go in as bound parameters,
+    not into the text. The least recently used statements are dropped once
+    there are more than size of them.
+    """
+    def __init__(self, db, size=128):
+        self.db = db
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._queries = OrderedDict()
+
+    def prepare(self, sql):
+        """
+        :return: QSqlQuery prepared with sql, done with its previous results
+        :raises QueryError: if the statement can't be prepared
+        """
+        query = self._queries.get(sql)
+        if query is not None:
+            self.hits += 1
+            metrics.incr('db.statements.hits')
+            self._queries.move_to_end(sql)
+            query.finish()
+            return query
+
+        self.misses += 1
+        metrics.incr('db.statements.misses')
+        query = QSqlQuery(self.db)
+        query.setForwardOnly(True)
+        if not query.prepare(sql):
+            raise QueryError("{}: {}".format(query.lastError().text(), sql))
+        self._queries[sql] = query
+        if len(self._queries) > self.size:
+            self._queries.popitem(last=False)
+        return query
+
+    def clear(self):
+        self._queries.clear()
+
+    def __len__(self):
+        return len(self._queries)
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def statements(db):
+    """
+    The StatementCache of a connection
+
+    Like the connection itself, its statements must only be used from the
+    thread that opened it.
+    """
+    name = db.connectionName()
+    with _caches_lock:
+        cache = _caches.get(name)
+        # a connection that was removed and opened again under the same name
+        if cache is None or cache.db is not db:
+            cache = _caches[name] = StatementCache(db)
+        return cache
+
+
+def forget_statements(name):
+    with _caches_lock:
+        cache = _caches.pop(name, None)
+    if cache is not None:
+        cache.clear()
+
+
+def _exec(db, sql, params):
+    query = statements(db).prepare(sql)
+    for i, param in enumerate(params):
+        query.bindValue(i, param)
+    if not query.exec_():
+        raise QueryError("{}: {}".format(query.lastError().text(), sql))
+    return query
+
+
+def fetch_rows(db, sql, *params):
+    """
+    Run a query on the given connection
+    :return: list of tuples
+    """
+    query = _exec(db, sql, params)
+    columns = query.record().count()
+    rows = []
+    while query.next():
+        rows.append(tuple(query.value(i) for i in range(columns)))
+    query.finish()
+    return rows
+
+
+def execute(db, sql, *params):
+    """
+    Run a statement on the given connection
+    :return: number of rows affected
+    """
+    return _exec(db, sql, params).numRowsAffected()
+
+
+def execute_batch(db, sql, *columns):
+    """
+    Run a statement once per row, the rows given as one list per parameter
+    """
+    query = statements(db).prepare(sql)
+    for i, column in enumerate(columns):
+        query.bindValue(i, list(column))
+    if not query.execBatch():
+        raise QueryError("{}: {}".format(query.lastError().text(), sql))
+
+
+# lengths IN lists are padded to, so that a query with one only ever takes that many statements
+IN_LIST_SIZES = (1, 8, 32, 128)
+
+
+def in_list_statements(sql):
+    """
+    A statement with an IN list, for each of IN_LIST_SIZES
+    :param sql: with {0} where the placeholders of the list go
+    :return: dict of list length -> SQL
+    """
+    return {size: sql.format(", ".join("?" * size)) for size in IN_LIST_SIZES}
+
+
+def in_lists(values):
+    """
+    Split values into IN lists of the IN_LIST_SIZES, padded by repeating their last value
+    :return: list of lists
+    """
+    values = list(values)
+    largest = IN_LIST_SIZES[-1]
+    chunks = []
+    for start in range(0, len(values), largest):
+        chunk = values[start:start + largest]
+        size = next(size for size in IN_LIST_SIZES if size >= len(chunk))
+        chunks.append(chunk + chunk[-1:] * (size - len(chunk)))
+    return chunks
+
+
+def run_in_transaction(db, work, *args):
+    """
+    Run work(db, *args) in one transaction on the given connection, rolled back if it raises
+    :return: what work returned
+    :raises QueryError: if the commit fails
+    """
+    db.transaction()
+    try:
+        result = work(db, *args)
+    except Exception:
+        db.rollback()
+        raise
+    if not db.commit():
+        raise QueryError("Commit failed: {}".format(db.lastError().text()))
+    return result
+
+
+@with_logger
+class DatabasePool():
+    """
+    Runs queries on a pool of worker threads, so they don't hold up the event loop
+
+    Each worker opens its own clone of the given database the first time it
+    runs something: a Qt connection may only be used by the thread that
+    opened it. At most size queries run at once, the others wait for a free
+    worker. A query that isn't done within its timeout raises QueryTimeout,
+    although the worker only becomes free again once the database replied.
+
+    Queries are prepared once per connection, see StatementCache.
+
+    Coroutines get rows with
+
+        rows = yield from pool.fetch("SELECT ... WHERE id = ?", id)
+
+    and anything more involved, like a batch, goes into a function run with
+    pool.run(work), called with the worker's connection.
+
+    With size=0 the pool is synchronous: everything runs straight away on
+    the given connection, and coroutines using nothing but the pool
+    complete without an event loop, see spawn. That's what the tests use.
+    """
+    def __init__(self, db, size=0, timeout=None, loop=None):
+        """
+        :param db: QSqlDatabase to clone for the workers
+        :param size: number of workers, 0 to run everything synchronously
+        :param timeout: default seconds to wait for a query, None to wait forever
+        """
+        self.db = db
+        self.size = size
+        self.timeout = timeout
+        self._loop = loop
+        self._executor = None
+        self._semaphore = None
+        if size > 0:
+            self._loop = loop or asyncio.get_event_loop()
+            self._executor = ThreadPoolExecutor(size)
+            self._semaphore = asyncio.Semaphore(size)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+
+    @property
+    def synchronous(self):
+        return self._executor is None
+
+    def _connection(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            with self._lock:
+                name = 'pool-{}'.format(len(self._connections))
+                self._connections.append(name)
+            db = QSqlDatabase.cloneDatabase(self.db, name)
+            if not db.open():
+                raise QueryError("Unable to open {}: {}".format(name, db.lastError().text()))
+            self._local.db = db
+        return db
+
+    def _work(self, work, args):
+        start = time.perf_counter()
+        try:
+            return work(self._connection(), *args)
+        finally:
+            metrics.incr('db.seconds', time.perf_counter() - start)
+
+    def _release(self, future):
+        self._semaphore.release()
+        if not future.cancelled():
+            # nobody may be waiting for it anymore, if it timed out
+            future.exception()
+
+    @asyncio.coroutine
+    def run(self, work, *args, timeout=None):
+        """
+        Call work(db, *args) with a connection of the pool
+        :param timeout: seconds, instead of the pool's default
+        :return: what work returned
+        :raises QueryTimeout: if it took longer than the timeout
+        """
+        metrics.incr('db.queries')
+        if self.synchronous:
+            return work(self.db, *args)
+
+        if timeout is None:
+            timeout = self.timeout
+        deadline = None if timeout is None else self._loop.time() + timeout
+        try:
+            yield from asyncio.wait_for(self._semaphore.acquire(), timeout)
+        except asyncio.TimeoutError:
+            metrics.incr('db.timeouts')
+            raise QueryTimeout("No database connection free within {}s".format(timeout))
+
+        future = self._loop.run_in_executor(self._executor, self._work, work, args)
+        future.add_done_callback(self._release)
+        try:
+            remaining = None if deadline is None else max(deadline - self._loop.time(), 0)
+            return (yield from asyncio.wait_for(asyncio.shield(future), remaining))
+        except asyncio.TimeoutError:
+            metrics.incr('db.timeouts')
+            raise QueryTimeout("No reply from the database within {}s".format(timeout))
+
+    @asyncio.coroutine
+    def fetch(self, sql, *params, timeout=None):
+        """
+        :return: list of tuples
+        """
+        return (yield from self.run(fetch_rows, sql, *params, timeout=timeout))
+
+    @asyncio.coroutine
+    def fetch_one(self, sql, *params, timeout=None):
+        """
+        :return: the first row, None if there isn't any
+        """
+        rows = yield from self.fetch(sql, *params, timeout=timeout)
+        return rows[0] if rows else None
+
+    @asyncio.coroutine
+    def execute(self, sql, *params, timeout=None):
+        """
+        :return: number of rows affected
+        """
+        return (yield from self.run(execute, sql, *params, timeout=timeout))
+
+    @asyncio.coroutine
+    def gather(self, *coros):
+        """
+        Run coroutines using the pool concurrently
+        In synchronous mode they run one after the other.
+        :return: list of their results, in order
+        """
+        if self.synchronous:
+            results = []
+            for coro in coros:
+                results.append((yield from coro))
+            return results
+        return (yield from asyncio.gather(*[asyncio.ensure_future(coro, loop=self._loop) for coro in coros]))
+
+    def spawn(self, coro):
+        """
+        Run a coroutine in the background, logging what it raises
+
+        In synchronous mode it runs to completion before spawn returns,
+        and must not wait on anything else than the pool.
+        :return: asyncio.Task, None in synchronous mode
+        """
+        if not self.synchronous:
+            return asyncio.ensure_future(self._logged(coro), loop=self._loop)
+
+        try:
+            coro.send(None)
+        except StopIteration:
+            return None
+        except Exception:
+            self._logger.exception("Failed to run {}".format(coro))
+            return None
+        coro.close()
+        raise RuntimeError("{} waited on something else than the database".format(coro))
+
+    @asyncio.coroutine
+    def _logged(self, coro):
+        try:
+            return (yield from coro)
+        except Exception:
+            self._logger.exception("Failed to run {}".format(coro))
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        for name in self._connections:
+            forget_statements(name)
+            QSqlDatabase.removeDatabase(name)
+        self._connections = []
@@ -0,0 +1,130 @@
+from collections import namedtuple, deque
+import random
+
+
+class Update(namedtuple('Update', 'key seq prev message changed removed')):
+    """
+    State of a game or player as last broadcast, and what changed since the one before
+
+    :param key: (kind, key), e.g. ('game_info', uid)
+    :param seq: sequence number of this state
+    :param prev: sequence number of the state the change applies to, None if this is the first one
+    """
+    @property
+    def modified(self):
+        return bool(self.changed or self.removed)
+
+    def full(self):
+        """
+        The whole message, with its sequence number
+        :return: dict
+        """
+        return dict(self.message, seq=self.seq)
+
+    def delta(self):
+        """
+        Only what changed since prev
+        :return: dict
+        """
+        kind, key = self.key
+        return {"command": "delta",
+                "kind": kind,
+                "key": key,
+                "seq": self.seq,
+                "prev": self.prev,
+                "changed": self.changed,
+                "removed": self.removed}
+
+
+class DeltaTracker():
+    """
+    Remembers the last broadcast state of each game and player, to send only what changed.
+
+    Every change gets the next number of a single, increasing sequence.
+    A delta names the sequence number of the state it applies to, so a
+    client holding another state knows it missed something and asks for
+    a full snapshot instead.
+
+    The most recent changes are kept in a ring buffer, so a client coming
+    back with the last number it saw can be sent just what it missed.
+    Sequence numbers restart with the server, the epoch tells them apart.
+    :param history: number of changes to remember
+    """
+    def __init__(self, history=10000):
+        self.seq = 0
+        self.epoch = random.getrandbits(32)
+        self._states = {}
+        self._history = deque(maxlen=history)
+        # newest change that fell out of the history
+        self._forgotten_seq = 0
+
+    def _record(self, key):
+        if len(self._history) == self._history.maxlen:
+            self._forgotten_seq = self._history[0][0]
+        self._history.append((self.seq, key))
+
+    def update(self, key, message):
+        """
+        Record the state about to be broadcast
+        :param key: (kind, key), e.g. ('game_info', uid)
+        :param message: the full message
+        :return: Update
+        """
+        previous = self._states.get(key)
+        if previous is None:
+            self.seq += 1
+            update = Update(key, self.seq, None, message, dict(message), [])
+            self._record(key)
+        else:
+            old = previous.message
+            changed = {field: value for field, value in message.items()
+                       if field not in old or old[field] != value}
+            removed = [field for field in old if field not in message]
+            if not (changed or removed):
+                return Update(key, previous.seq, previous.seq, message, {}, [])
+            self.seq += 1
+            update = Update(key, self.seq, previous.seq, message, changed, removed)
+            self._record(key)
+
+        self._states[key] = update
+        return update
+
+    def snapshot(self, key):
+        """
+        Last broadcast state
+        :return: Update or None if it was never broadcast
+        """
+        return self._states.get(key)
+
+    def forget(self, key):
+        if self._states.pop(key, None) is not None:
+            self.seq += 1
+            self._record(key)
+
+    def changed_since(self, epoch, seq):
+        """
+        What changed after the given sequence number
+        :return: list of keys, or None if that is too far back to tell
+        """
+        if epoch != self.epoch or not isinstance(seq, int) or seq < self._forgotten_seq or seq > self.seq:
+            return None
+
+        keys = []
+        seen = set()
+        for event_seq, key in reversed(self._history):
+            if event_seq <= seq:
+                break
+            if key not in seen:
+                seen.add(key)
+                keys.append(key)
+        keys.reverse()
+        return keys
+
+    def keys(self):
+        return list(self._states)
+
+    def __contains__(self, key):
+        return key in self._states
+
+    def __len__(self):
+        return len(self._states)
@@ -0,0 +1,81 @@
+import heapq
+import itertools
+import time
+
+
+class ExpiryScheduler():
+    """
+    Deadlines for a set of keys, kept in a heap.
+
+    Each key has at most one deadline. Moving it earlier leaves the old heap
+    entry behind, to be skipped when it comes up. A run only looks at the
+    deadlines that are due, so it costs as much as the number of keys that
+    are due, however many are tracked.
+    """
+    def __init__(self, review):
+        """
+        :param review: callable(key, now) for a key that is due, returning its
+                       next deadline, or None to stop tracking it
+        """
+        self._review = review
+        self._heap = []
+        self._deadlines = {}
+        # tells apart entries with the same deadline, keys need not be comparable
+        self._counter = itertools.count()
+
+    def schedule(self, key, deadline):
+        """
+        Review the key at the given time, unless it is already due earlier
+        """
+        current = self._deadlines.get(key)
+        if current is not None and current <= deadline:
+            return
+        self._deadlines[key] = deadline
+        heapq.heappush(self._heap, (deadline, next(self._counter), key))
+        if len(self._heap) > 2 * len(self._deadlines) + 64:
+            self._compact()
+
+    def discard(self, key):
+        self._deadlines.pop(key, None)
+
+    def deadline(self, key):
+        """
+        :return: time the key is due, None if it is not tracked
+        """
+        return self._deadlines.get(key)
+
+    def run(self, now=None):
+        """
+        Review every key that is due
+        :return: list of the keys no longer tracked
+        """
+        if now is None:
+            now = time.time()
+        dropped = []
+        rescheduled = []
+        while self._heap and self._heap[0][0] <= now:
+            deadline, _, key = heapq.heappop(self._heap)
+            if self._deadlines.get(key) != deadline:
+                # moved or discarded since
+                continue
+            del self._deadlines[key]
+            next_deadline = self._review(key, now)
+            if next_deadline is None:
+                dropped.append(key)
+            else:
+                rescheduled.append((key, next_deadline))
+
+        # not before the loop is done, a deadline in the past would come right back up
+        for key, next_deadline in rescheduled:
+            self.schedule(key, next_deadline)
+        return dropped
+
+    def _compact(self):
+        self._heap = [(deadline, next(self._counter), key) for key, deadline in self._deadlines.items()]
+        heapq.heapify(self._heap)
+
+    def __contains__(self, key):
+        return key in self._deadlines
+
+    def __len__(self):
+        return len(self._deadlines)
@@ -0,0 +1,254 @@
+import asyncio
+from collections import deque
+import json
+import time
+
+from src import metrics
+from src.decorators import with_logger, timed
+from src.protocol.lobby import LEGACY, FrameReader, LegacyStream, FramingError
+from src.timer import Timer
+
+
+@with_logger
+class FramedConnection():
+    """
+    A client of one of our length framed servers: lobby, update, replay or tournament
+
+    Takes care of what they all do the same way:
+
+    - Received data goes through a FrameReader, each complete frame is
+      handed to handleFrame as a view of the received data, without copies.
+    - By default frames are legacy framed: handleAction gets the action
+      they start with and a LegacyStream over the rest. Unless overridden,
+      the action is a JSON message, dispatched to command_<command>.
+      Handlers may be coroutines, e.g. to wait for the database: the
+      frames arriving meanwhile, JSON or not, are handled once they're
+      done, in order.
+    - sendReply, sendJSON and sendArray frame replies and write them.
+    - With an idle_timeout, a client that sent nothing for that many
+      seconds is disconnected.
+    - Frames and bytes in and out, and the time spent handling frames, are
+      counted in src.metrics under the given prefix.
+
+    The socket is a QTcpSocket, or anything with the same interface, see
+    src.asyncio_lobby_server.LobbySocket.
+    """
+    def __init__(self, socket, parent=None, prefix='server', idle_timeout=None, loop=None):
+        """
+        :param socket: connected socket
+        :param parent: the server
+        :param prefix: prefix of the metrics of this connection
+        :param idle_timeout: seconds without data before the client is dropped, None to wait forever
+        :param loop: event loop for the idle timer and coroutine handlers
+        """
+        self.socket = socket
+        self.parent = parent
+        self.loop = loop
+        self.metricsPrefix = prefix
+        self.framing = LEGACY
+        self.reader = FrameReader()
+        self.noSocket = False
+
+        # the coroutine handling a message, and the frames waiting for it
+        self.commandTask = None
+        self.commandBacklog = deque()
+
+        self.lastRead = time.time()
+        self.idleTimeout = idle_timeout
+        self.idleTimer = None
+        if idle_timeout is not None:
+            self.idleTimer = Timer(self.checkIdle, loop=loop)
+            self.idleTimer.start(idle_timeout * 1000)
+
+        self.socket.readyRead.connect(self.readData)
+        self.socket.disconnected.connect(self.disconnection)
+        self.socket.error.connect(self.displayError)
+
+    def readData(self):
+        if self.noSocket or not self.socket.isValid():
+            return
+
+        if self.socket.bytesAvailable() == 0:
+            self.socket.abort()
+            return
+
+        self.receiveData(self.socket.readAll().data())
+
+    @timed()
+    def receiveData(self, data):
+        """
+        Handle bytes read from the socket, whole frames or not
+        """
+        if self.noSocket:
+            return
+
+        self.reader.feed(data)
+        self.lastRead = time.time()
+        metrics.incr(self.metricsPrefix + '.bytes_in', len(data))
+
+        if not self.checkData():
+            return
+
+        start = time.perf_counter()
+        count = 0
+        try:
+            for frame in self.reader.frames():
+                count += 1
+                self.handleFrame(frame)
+                if self.noSocket:
+                    break
+        except FramingError as ex:
+            self.invalidFrame(ex)
+        finally:
+            metrics.incr(self.metricsPrefix + '.frames_in', count)
+            metrics.incr(self.metricsPrefix + '.handle_seconds', time.perf_counter() - start)
+
+    def invalidFrame(self, ex):
+        self._logger.warning("Invalid frame from {}: {}".format(self.socket.peerAddress().toString(), ex))
+        self.commandBacklog.clear()
+        self.abort()
+
+    def checkData(self):
+        """
+        Look at what was received before it is parsed
+        :return: bool whether to go on with the frames
+        """
+        return True
+
+    def handleFrame(self, frame):
+        if self.commandTask is not None:
+            # the frame is a view of data that is let go of after this read
+            self.commandBacklog.append(bytes(frame))
+            return
+        self.dispatchFrame(frame)
+
+    def dispatchFrame(self, frame):
+        stream = LegacyStream(frame)
+        self.handleAction(stream.readQString(), stream)
+
+    def handleAction(self, action, stream):
+        """
+        A legacy frame, its action is a JSON message unless overridden
+        :param stream: LegacyStream over the rest of the frame
+        """
+        self.receiveJSON(action, stream)
+
+    def receiveJSON(self, data_string, stream):
+        """
+        A fairly pythonic way to process received strings as JSON messages.
+        """
+        try:
+            message = json.loads(data_string)
+            cmd = message['command']
+            if not isinstance(cmd, str):
+                raise ValueError("Command is not a string")
+        except (KeyError, TypeError, ValueError):
+            self._logger.warning("Garbage input from client: {}".format(data_string))
+            return
+
+        self.runCommand(message)
+
+    def runCommand(self, message):
+        handler = getattr(self, 'command_{}'.format(message['command']), None)
+        if handler is None:
+            self._logger.debug("Unknown command: {}".format(message['command']))
+            return
+
+        try:
+            result = handler(message)
+        except Exception:
+            self._logger.exception("Failed to handle {}".format(message))
+            return
+
+        if asyncio.iscoroutine(result):
+            self.commandTask = asyncio.ensure_future(self.awaitCommand(message, result), loop=self.loop)
+
+    @asyncio.coroutine
+    def awaitCommand(self, message, coro):
+        try:
+            yield from coro
+        except Exception:
+            self._logger.exception("Failed to handle {}".format(message))
+        finally:
+            self.commandTask = None
+
+        while self.commandBacklog and self.commandTask is None and not self.noSocket:
+            try:
+                self.dispatchFrame(self.commandBacklog.popleft())
+            except FramingError as ex:
+                self.invalidFrame(ex)
+            except Exception:
+                self._logger.exception("Failed to handle a queued frame")
+
+    def canSend(self):
+        return not self.noSocket
+
+    def sendArray(self, array, key=None):
+        """
+        Send one or more frames
+        :param key: what they are about, see writeFrame
+        """
+        if self.canSend():
+            self.writeFrame(array, key)
+
+    def sendReply(self, action, *args, **kwargs):
+        if self.canSend():
+            self.writeFrame(self.framing.pack(action, *args), kwargs.get('key'))
+
+    def sendJSON(self, data_dictionary):
+        self.sendArray(self.framing.pack_message(data_dictionary))
+
+    def writeFrame(self, frame, key=None):
+        """
+        Write a frame, subclasses may hold it back
+        :param key: what the frame is about, e.g. ('game_info', uid)
+        """
+        self.writeToSocket(frame)
+
+    def writeToSocket(self, data):
+        if self.socket.write(data) == -1:
+            self._logger.debug("error socket write")
+            self.abort()
+            return False
+        metrics.incr(self.metricsPrefix + '.bytes_out', len(data))
+        metrics.incr(self.metricsPrefix + '.writes')
+        return True
+
+    def checkIdle(self):
+        if time.time() - self.lastRead >= self.idleTimeout:
+            self._logger.debug("No data for {}s, disconnecting".format(self.idleTimeout))
+            metrics.incr(self.metricsPrefix + '.idle_disconnects')
+            self.abort()
+
+    def abort(self):
+        self.noSocket = True
+        self.socket.abort()
+
+    def disconnection(self):
+        self.noSocket = True
+        self.done()
+
+    def done(self):
+        self.closeSocket()
+
+    def closeSocket(self):
+        """
+        Stop listening to the socket and close it
+        """
+        self.noSocket = True
+        self.commandBacklog.clear()
+        if self.idleTimer is not None:
+            self.idleTimer.stop()
+        for signal, slot in ((self.socket.readyRead, self.readData),
+                             (self.socket.disconnected, self.disconnection),
+                             (self.socket.error, self.displayError)):
+            try:
+                signal.disconnect(slot)
+            except (RuntimeError, TypeError):
+                # was not connected
+                pass
+        self.socket.close()
+        self.socket.deleteLater()
+
+    def displayError(self, socketError):
+        self._logger.debug("Socket error: {}".format(self.socket.errorString()))
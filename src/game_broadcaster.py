@@ -0,0 +1,51 @@
+import asyncio
+
+from src.decorators import with_logger
+
+
+@with_logger
+class GameListBroadcaster():
+    """
+    Pushes game list updates to the lobby, coalescing bursts of changes.
+
+    The GamesService collects dirty game ids in a set, so a game changed
+    several times within one window is sent once, in its latest state. This
+    includes games created and closed within the same window, which are
+    sent once as closed.
+
+    A flush happens at most `max_latency` seconds after the first game was
+    marked dirty, or straight away once `max_pending` games are waiting.
+    """
+    def __init__(self, games, send, loop=None, max_latency=0.25, max_pending=50):
+        """
+        :param games: GamesService to take dirty games from
+        :param send: callable receiving the set of dirty game ids on flush
+        :param loop: event loop used to schedule flushes
+        :param max_latency: seconds an update may be held back
+        :param max_pending: number of dirty games that triggers a flush
+        """
+        self.games = games
+        self._send = send
+        self._loop = loop or asyncio.get_event_loop()
+        self.max_latency = max_latency
+        self.max_pending = max_pending
+        self._scheduled = None
+
+    def handle_DirtyGame(self, arguments):
+        if len(self.games.dirty_games) >= self.max_pending:
+            self.flush()
+        elif self._scheduled is None:
+            self._scheduled = self._loop.call_later(self.max_latency, self.flush)
+
+    def flush(self):
+        if self._scheduled is not None:
+            self._scheduled.cancel()
+            self._scheduled = None
+
+        dirty = self.games.pop_dirty()
+        if not dirty:
+            return
+        try:
+            self._send(dirty)
+        except Exception:
+            self._logger.exception("Failed to broadcast {} dirty games".format(len(dirty)))
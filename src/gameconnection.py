@@ -31,6 +31,7 @@ from src.abc.base_game import GameConnectionState
 from src.connectivity import TestPeer, Connectivity
 from src.games.game import Game, GameState, Victory
 from src.decorators import with_logger, timed
+from src.counter_aggregator import MOD_PLAYED
 from src.games_service import GamesService
 from src.protocol.gpgnet import GpgNetServerProtocol
 from src.subscribable import Subscribable
@@ -413,17 +414,11 @@ class GameConnection(Subscribable, GpgNetServerProtocol):
                         self.game.mods = {}
 
                 if values[0] == "uids":
-                    self.game.mods = {}
-                    query = QSqlQuery(self.db)
-                    for uid in values[1].split():
-                        query.prepare("SELECT name FROM table_mod WHERE uid = ?")
-                        query.addBindValue(uid)
-                        query.exec_()
-                        if query.size() > 0:
-                            query.first()
-                            self.game.mods[uid] = str(query.value(0))
-                        else:
-                            self.game.mods[uid] = "Unknown sim mod"
+                    uids = values[1].split()
+                    infos = yield from self.games.mod_cache.resolve(self.games.db_pool, uids)
+                    # assigned at once, so the game notices the change
+                    self.game.mods = {uid: infos[uid].name if infos[uid] is not None else "Unknown sim mod"
+                                      for uid in uids}
 
             elif key == 'PlayerOption':
                 if self.player.getAction() == "HOST":
@@ -455,20 +450,14 @@ class GameConnection(Subscribable, GpgNetServerProtocol):
                 pass
 
             elif key == 'OperationComplete':
-                mission = -1
+                mission = None
                 if int(values[0]) == 1:
                     self.log.debug(self.logGame + "Operation really Complete!")
-                    query = QSqlQuery(self.db)
-                    query.prepare(
-                        "SELECT id FROM coop_map WHERE filename LIKE '%/" + self.game.mapName + ".%'")
-                    query.exec_()
-                    if query.size() > 0:
-                        query.first()
-                        mission = int(query.value(0))
-                    else:
+                    mission = self.games.map_catalogue.coop_mission(self.game.mapName)
+                    if mission is None:
                         self.log.debug(self.logGame + "can't find coop map " + self.game.mapName)
-                if mission != -1:
-
+                if mission is not None:
+                    query = QSqlQuery(self.db)
                     query.prepare(
                         "INSERT INTO `coop_leaderboard`(`mission`, `gameuid`, `secondary`, `time`) VALUES (?,?,?,?);")
                     query.addBindValue(mission)
@@ -531,8 +520,10 @@ class GameConnection(Subscribable, GpgNetServerProtocol):
                 self.sendGameInfo()
 
                 if len(self.game.mods) > 0:
-                    for uid in self.game.mods:
-                        if not self.isModRanked(uid):
+                    uids = list(self.game.mods)
+                    infos = yield from self.games.mod_cache.resolve(self.games.db_pool, uids)
+                    for uid in uids:
+                        if infos[uid] is None or not infos[uid].ranked:
                             if uid == "e7846e9b-23a4-4b95-ae3a-fb69b289a585":
                                 if not "scca_coop_e02" in self.game.mapName.lower():
                                     self.game.setInvalid("Sim mods are not ranked")
@@ -540,10 +531,7 @@ class GameConnection(Subscribable, GpgNetServerProtocol):
                             else:
                                 self.game.setInvalid("Sim mods are not ranked")
 
-                        query = QSqlQuery(self.db)
-                        query.prepare("UPDATE `table_mod` SET `played`= `played`+1  WHERE uid = ?")
-                        query.addBindValue(uid)
-                        query.exec_()
+                        self.games.counters.incr(MOD_PLAYED, uid)
 
                 for player in self.game.players:
                     if player.global_rating.mu < -1000 or \
@@ -628,21 +616,6 @@ class GameConnection(Subscribable, GpgNetServerProtocol):
         value = int(options[length - 1])
         return atype, name, place, value
 
-    def isModRanked(self, uidmod):
-        query = QSqlQuery(self.parent.db)
-        query.prepare("SELECT ranked FROM table_mod WHERE uid LIKE ?")
-        query.addBindValue(uidmod)
-
-        if not query.exec_():
-            self.log.debug("error isModRanked: ")
-            self.log.debug(query.lastError())
-
-        if query.size() != 0:
-            query.first()
-            if query.value(0) == 1:
-                return True
-        return False
-
     def fillAIStats(self, AIs):
         pass
 
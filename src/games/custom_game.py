@@ -36,5 +36,4 @@ class CustomGame(Game):
         if time.time() - self.createDate < limit:
             self.setInvalid("Score are invalid: Play time was not long enough (under %i seconds)" % limit)
         if self.valid:
-            new_ratings = self.compute_rating()
-            self.persist_rating_change_stats(new_ratings, rating='global')
+            return 'global'
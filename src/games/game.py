@@ -15,18 +15,29 @@
 # MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
 # GNU General Public License for more details.
 #-------------------------------------------------------------------------------
+import asyncio
 from enum import Enum, IntEnum
 import string
 import logging
 import time
 
-from PySide.QtSql import QSqlQuery
 import functools
 import trueskill
 from src.abc.base_game import GameConnectionState, BaseGame, InitMode
+from src.counter_aggregator import MAP_TIMES_PLAYED
+from src.db_pool import QueryError, execute_batch
+from src.post_game import GameOutcome, rate
 from src.players import Player
 
 
+# the player attribute holding each rating
+RATING_ATTRIBUTES = {
+    'global': 'global_rating',
+    'ladder': 'ladder_rating',
+    'ladder1v1': 'ladder_rating',
+}
+
+
 class GameState(IntEnum):
     INITIALIZING = 0
     LOBBY = 1
@@ -57,12 +68,51 @@ class GameError(Exception):
         super().__init__(*args, **kwargs)
 
 
+class GameInfoField():
+    """
+    Attribute of a Game that lobby clients see in its game_info
+
+    Setting it bumps the version of the game, which drops the cached
+    game_info frames.
+    """
+    def __init__(self, name):
+        self.attribute = '_' + name
+
+    def __get__(self, game, owner):
+        if game is None:
+            return self
+        return getattr(game, self.attribute)
+
+    def __set__(self, game, value):
+        setattr(game, self.attribute, value)
+        game.bump_version()
+
+
+# state as the lobby clients know it
+LOBBY_STATES = {
+    GameState.INITIALIZING: 'Idle',
+    GameState.LOBBY: 'open',
+    GameState.LIVE: 'playing',
+    GameState.ENDED: 'closed'
+}
+
+
 class Game(BaseGame):
     """
     Object that lasts for the lifetime of a game on FAF.
     """
     init_mode = InitMode.NORMAL_LOBBY
 
+    access = GameInfoField('access')
+    name = GameInfoField('name')
+    mapName = GameInfoField('mapName')
+    hostPlayer = GameInfoField('hostPlayer')
+    maxPlayer = GameInfoField('maxPlayer')
+    gameType = GameInfoField('gameType')
+    mods = GameInfoField('mods')
+    options = GameInfoField('options')
+    state = GameInfoField('state')
+
     def __init__(self, uuid, parent, host=None, hostId=0, hostIp=None, hostLocalIp=None, hostPort=6112,
                  hostLocalPort=6112, name='None', map='SCMP_007', mode=0, minPlayer=1):
         """
@@ -81,12 +131,20 @@ class Game(BaseGame):
         :type minPlayer: int
         :return: Game
         """
+        self.version = 0
+        self._game_info_frames = {}
         self._results = {}
         self.db = parent.db
+        self.db_pool = parent.db_pool
+        self.map_catalogue = parent.map_catalogue
+        self.counters = parent.counters
+        self.post_game = parent.post_game
+        self.ratings = parent.ratings
         self.parent = parent
         self._player_options = {}
         self._army_options = {}
         self.createDate = time.time()
+        self.endDate = None
         self.receiveUdpHost = False
         self._logger = logging.getLogger("{}.{}".format(self.__class__.__qualname__, uuid))
         self.uuid = uuid
@@ -124,6 +182,8 @@ class Game(BaseGame):
         self.playerColor = {}
         self.state = GameState.INITIALIZING
         self._connections = {}
+        # the launch's database work, the end's waits for it
+        self._launch_record = None
         self.gameOptions = {'FogOfWar': 'explored',
                             'GameSpeed': 'normal',
                             'Victory': 'demoralization',
@@ -147,11 +207,11 @@ class Game(BaseGame):
 
         Depending on the state, it is either:
           - (LOBBY) The currently connected players
-          - (LIVE) Players who participated in the game
+          - (LIVE, ENDED) Players who participated in the game
           - Empty list
         :return: frozenset
         """
-        if self.state == GameState.LIVE:
+        if self.state == GameState.LIVE or self.state == GameState.ENDED:
             result = self._players
         elif self.state == GameState.LOBBY:
             result = self._connections.keys()
@@ -163,6 +223,57 @@ class Game(BaseGame):
     def id(self):
         return self.uuid
 
+    @property
+    def lobbyState(self):
+        return LOBBY_STATES[self.state]
+
+    def bump_version(self):
+        """
+        Note that the game changed in a way lobby clients should see
+        :return: None
+        """
+        self.version += 1
+        self._game_info_frames.clear()
+
+    def to_dict(self):
+        """
+        The game_info message lobby clients get for this game
+        :return: dict
+        """
+        return {
+            "command": "game_info",
+            "access": self.access,
+            "uid": self.uuid,
+            "title": self.name,
+            "state": self.lobbyState,
+            "featured_mod": self.getGamemod(),
+            "featured_mod_versions": self.getGamemodVersion(),
+            "sim_mods": self.mods,
+            "mapname": self.mapName.lower(),
+            "host": self.hostPlayer,
+            "num_players": len(self.players),
+            "game_type": self.gameType,
+            "game_time": self.created_at,
+            "options": self.options,
+            "max_players": self.maxPlayer,
+            "teams": {team: players for team, players in self.teamAssign.items() if len(players) != 0}
+        }
+
+    def game_info_frame(self, framing):
+        """
+        The game_info message, framed for the given framing
+
+        Kept until the game changes, so the game list can be sent to any
+        number of clients without building it again.
+        :param framing: src.protocol.lobby framing
+        :return: bytes
+        """
+        frame = self._game_info_frames.get(framing.name)
+        if frame is None:
+            frame = framing.pack_message(self.to_dict())
+            self._game_info_frames[framing.name] = frame
+        return frame
+
     @property
     def teams(self):
         return frozenset({self.get_player_option(player.id, 'Team')
@@ -193,6 +304,7 @@ class Game(BaseGame):
             raise GameError("Invalid GameState: {state}".format(state=self.state))
         self._logger.info("Added game connection {}".format(game_connection))
         self._connections[game_connection.player] = game_connection
+        self.bump_version()
 
     def remove_game_connection(self, game_connection):
         """
@@ -206,90 +318,55 @@ class Game(BaseGame):
         assert game_connection in self._connections.values()
         del self._connections[game_connection.player]
         self._logger.info("Removed game connection {}".format(game_connection))
+        self.bump_version()
+        self.parent.checkGame(self)
         if len(self._connections) == 0:
             self.on_game_end()
 
     def on_game_end(self):
         self.state = GameState.ENDED
+        self.endDate = time.time()
         self._logger.info("Game ended")
         if self.desyncs > 20:
             self.setInvalid("Too many desyncs")
 
-        query = QSqlQuery(self.db)
-        query.prepare("UPDATE game_stats set `EndTime` = NOW() where `id` = ?")
-        query.addBindValue(self.id)
-        query.exec_()
+        self.db_pool.spawn(self.record_end())
+
+    @asyncio.coroutine
+    def record_end(self):
+        """
+        Hand the results over to be rated and stored
+        """
+        if self._launch_record is not None:
+            # the results update the rows it inserts
+            yield from self._launch_record
 
-        self.persist_results()
-        self.rate_game()
+        rating = self.rate_game()
+        try:
+            outcome = self.outcome(rating)
+        except GameError as e:
+            self._logger.warning("Not rating the game: {}".format(e))
+            outcome = self.outcome()
+        yield from self.post_game.process(outcome)
 
-    def persist_results(self):
+    def outcome(self, rating=None):
         """
-        Persist game results (score) into the game_player_stats table
-        :return:
+        Snapshot of the results, as the post-game queue takes them
+        :param rating: 'global' or 'ladder1v1' to rate the game by, None not to rate it
+        :rtype: GameOutcome
         """
-        self._logger.info("Saving game scores")
-        results = {}
+        scores = []
         for player in self.players:
             army = self.get_player_option(player.id, 'Army')
             try:
-                results[player] = self.get_army_result(army)
+                scores.append((player.id, self.get_army_result(army)))
             except KeyError:
                 # Default to -1 if there is no result
-                results[player] = -1
-        query = QSqlQuery(self.db)
-        query.prepare("INSERT INTO game_player_stats (gameId, playerId, score, scoreTime) "
-                      "VALUES (?, ?, ?, NOW())")
-        game_ids = []
-        player_ids = []
-        scores = []
-        for player, result in results.items():
-            game_ids.append(self.id)
-            player_ids.append(player.id)
-            scores.append(result)
-        query.addBindValue(game_ids)
-        query.addBindValue(player_ids)
-        query.addBindValue(scores)
-        if not query.execBatch():
-            self._logger.critical("Error persisting scores to database: {}".format(query.lastError()))
-
-    def persist_rating_change_stats(self, rating_groups, rating='global'):
-        """
-        Persist computed ratings to the respective players' selected rating
-        :param rating_groups: of the form returned by Game.compute_rating
-        :return: None
-        """
-        self._logger.info("Saving rating change stats")
-        new_ratings = {
-            player: new_rating
-            for team in rating_groups
-            for player, new_rating in team.items()
-        }
-        game_stats_query = QSqlQuery(self.db)
-        game_stats_query.prepare("UPDATE game_player_stats "
-                                 "SET after_mean = ?, after_deviation = ?, scoreTime = NOW() "
-                                 "WHERE gameId = ? AND playerId = ?")
-        rating_query = QSqlQuery(self.db)
-        rating_query.prepare("UPDATE {}_rating "
-                             "SET mean = ?, deviation = ?, numGames = (numGames + 1) "
-                             "WHERE id = ?".format(rating))
-        results = [[], [], [], []]
-        for player, new_rating in new_ratings.items():
-            results[0] += [new_rating.mu]
-            results[1] += [new_rating.sigma]
-            results[2] += [self.id]
-            results[3] += [player.id]
-        for col in results:
-            game_stats_query.addBindValue(col)
-
-        for col in [results[0], results[1], results[3]]:
-            rating_query.addBindValue(col)
-
-        if not game_stats_query.execBatch():
-            self._logger.critical("Error persisting ratings to game_player_stats: {}".format(game_stats_query.lastError()))
-
-        if not rating_query.execBatch():
-            self._logger.critical("Error persisting ratings to {}_rating: {}".format(rating, game_stats_query.lastError()))
+                scores.append((player.id, -1))
+        teams, ranks = (), ()
+        if rating is not None:
+            teams, ranks = self.rating_groups(rating)
+        return GameOutcome(self.id, rating, tuple(scores), teams, ranks, self.endDate or time.time())
 
     def set_player_option(self, id, key, value):
         """
@@ -304,6 +381,7 @@ class Game(BaseGame):
         if id not in self._player_options:
             self._player_options[id] = {}
         self._player_options[id][key] = value
+        self.bump_version()
 
     def get_player_option(self, id, key):
         """
@@ -382,62 +460,48 @@ class Game(BaseGame):
         self.on_game_launched()
 
     def on_game_launched(self):
-        self.update_ratings()
-        self.update_game_stats()
-        self.update_game_player_stats()
+        self._launch_record = self.db_pool.spawn(self.record_launch())
 
-    def update_game_stats(self):
-        mapId = 0
-        modId = 0
+    @asyncio.coroutine
+    def record_launch(self):
+        """
+        Store the start of the game and who is playing
+        """
+        yield from self.update_ratings()
+        yield from self.update_game_stats()
+        yield from self.update_game_player_stats()
 
+    @asyncio.coroutine
+    def update_game_stats(self):
         # What the actual fucking fuck?
         if "thermo" in self.mapName.lower():
             self.setInvalid("This map is not ranked.")
 
-        query = QSqlQuery(self.parent.db)
-        # Everyone loves table sacns!
-        queryStr = ("SELECT id FROM table_map WHERE filename LIKE '%/" + self.mapName + ".%'")
-        query.exec_(queryStr)
-        if query.size() > 0:
-            query.first()
-            mapId = query.value(0)
-
-        if mapId != 0:
-            query.prepare("SELECT * FROM table_map_unranked WHERE id = ?")
-            query.addBindValue(mapId)
-            query.exec_()
-            if query.size() > 0:
+        map_info = yield from self.map_catalogue.lookup(self.db_pool, self.mapName)
+        mapId = 0
+        if map_info is not None:
+            mapId = map_info.id
+            if not map_info.ranked:
                 self.setInvalid("This map is not ranked.")
 
-        # Why can't this be rephrased to use equality?
-        queryStr = ("SELECT id FROM game_featuredMods WHERE gamemod LIKE '%s'" % self.getGamemod())
-        query.exec_(queryStr)
-
-        if query.size() == 1:
-            query.first()
-            modId = query.value(0)
-        query = QSqlQuery(self.parent.db)
-        query.prepare("UPDATE game_stats set `startTime` = NOW(),"
-                      "gameType = ?,"
-                      "gameMod = ?,"
-                      "mapId = ?,"
-                      "gameName = ? "
-                      "WHERE id = ?")
-        query.addBindValue(str(self.gameType))
-        query.addBindValue(modId)
-        query.addBindValue(mapId)
-        query.addBindValue(self.name)
-        query.addBindValue(self.uuid)
-        if not query.exec_():
-            self._logger.debug("Error updating game_stats:")
-            self._logger.debug(query.lastError())
-            self._logger.debug(self.mapName.lower())
-
-        queryStr = ("UPDATE table_map_features set times_played = (times_played +1) WHERE map_id LIKE " + str(mapId))
-        query.exec_(queryStr)
+        mod_row = yield from self.db_pool.fetch_one(
+            "SELECT id FROM game_featuredMods WHERE gamemod = ?", self.getGamemod())
+        modId = mod_row[0] if mod_row is not None else 0
 
+        yield from self.db_pool.execute("UPDATE game_stats set `startTime` = NOW(),"
+                                        "gameType = ?,"
+                                        "gameMod = ?,"
+                                        "mapId = ?,"
+                                        "gameName = ? "
+                                        "WHERE id = ?",
+                                        str(self.gameType), modId, mapId, self.name, self.uuid)
+
+        if mapId != 0:
+            self.counters.incr(MAP_TIMES_PLAYED, mapId)
+
+    @asyncio.coroutine
     def update_game_player_stats(self):
-        queryStr = ""
+        rows = [[], [], [], [], [], [], [], []]
         for player in self.players:
             player_option = functools.partial(self.get_player_option, player.id)
             team, place, color, faction = [player_option(value)
@@ -447,22 +511,25 @@ class Game(BaseGame):
                 if color is None or faction is None:
                     self._logger.error("wrong faction or color for place {}, {} for player {}".format(color, place, faction))
                 if self.getGamemod() == 'ladder1v1':
-                    mean, dev = player.ladder_rating.mu, player.ladder_rating.sigma
+                    mean, dev = self._mu_sigma(player.ladder_rating)
                 else:
-                    mean, dev = player.global_rating.mu, player.global_rating.sigma
-                queryStr += ("INSERT INTO `game_player_stats` "
-                             "(`gameId`, `playerId`, `faction`, `color`, `team`, `place`, `mean`, `deviation`) "
-                             "VALUES (%s, %s, %s, %s, %s, %i, %f, %f);"
-                             .format(str(self.id), str(player.id), faction, color, team, place, mean, dev))
-
-        if queryStr != "":
-            query = QSqlQuery(self.parent.db)
-            if not query.exec_(queryStr):
-                self._logger.error("player staterror")
-                self._logger.error(query.lastError())
-                self._logger.error(queryStr)
-        else:
+                    mean, dev = self._mu_sigma(player.global_rating)
+                for column, value in zip(rows, [self.id, player.id, faction, color, team, place, mean, dev]):
+                    column.append(value)
+
+        if not rows[0]:
             self._logger.error("No player stat :(")
+            return
+
+        try:
+            yield from self.db_pool.run(execute_batch,
+                                        "INSERT INTO `game_player_stats` "
+                                        "(`gameId`, `playerId`, `faction`, `color`, `team`, `place`, `mean`, `deviation`) "
+                                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                        *rows)
+        except QueryError as e:
+            self._logger.error("player staterror")
+            self._logger.error(e)
 
     def setAccess(self, access):
         self.access = access
@@ -507,15 +574,14 @@ class Game(BaseGame):
             score = max(score, result[2])
         return score
 
-    def compute_rating(self, rating='global'):
+    def rating_groups(self, rating='global'):
         """
-        Compute new ratings
+        Teams and their results, as trueskill rates them
         :param rating: 'global' or 'ladder'
-        :return: rating groups of the form:
-        >>> p1,p2,p3,p4 = Player()
-        >>> [{p1: p1.rating, p2: p2.rating}, {p3: p3.rating, p4: p4.rating}]
+        :return: (teams, ranks) of the form GameOutcome holds them
         """
         assert self.state == GameState.LIVE or self.state == GameState.ENDED
+        attribute = RATING_ATTRIBUTES[rating]
         team_scores = {}
         for player in self.players:
             team = self.get_player_option(player.id, 'Team')
@@ -530,29 +596,43 @@ class Game(BaseGame):
                 team_scores[team] += [0]
                 self._logger.info("Missing game result for {army}: {player}".format(army=army,
                                                                                     player=player))
-        ranks = [score for team, score in sorted(team_scores.items())]
-        rating_groups = []
+        ranks = tuple(tuple(score) for team, score in sorted(team_scores.items()))
+        teams = []
         for team in sorted(self.teams):
-            rating_groups += [{player: getattr(player, '{}_rating'.format(rating))
+            teams += [tuple((player.id,) + self._mu_sigma(getattr(player, attribute))
                             for player in self.players if
-                            self.get_player_option(player.id, 'Team') == team}]
-        return trueskill.rate(rating_groups, ranks)
+                            self.get_player_option(player.id, 'Team') == team)]
+        return tuple(teams), ranks
+
+    @staticmethod
+    def _mu_sigma(rating):
+        if isinstance(rating, trueskill.Rating):
+            return rating.mu, rating.sigma
+        return tuple(rating)
+
+    def compute_rating(self, rating='global'):
+        """
+        Compute new ratings
+        :param rating: 'global' or 'ladder'
+        :return: rating groups of the form:
+        >>> p1,p2,p3,p4 = Player()
+        >>> [{p1: p1.rating, p2: p2.rating}, {p3: p3.rating, p4: p4.rating}]
+        """
+        teams, ranks = self.rating_groups(rating)
+        new_ratings = rate(teams, ranks)
+        players = {player.id: player for player in self.players}
+        return [{players[player_id]: trueskill.Rating(*new_ratings[player_id]) for player_id, _, _ in team}
+                for team in teams]
 
+    @asyncio.coroutine
     def update_ratings(self):
-        """ Update all scores from the DB before updating the results"""
+        """ Take the players' ratings from the rating store before updating the results"""
         self._logger.debug("updating ratings")
-        for player in self.players:
-            query = QSqlQuery(self.db)
-            query.prepare(
-                "SELECT mean, deviation FROM global_rating WHERE id = ?")
-            query.addBindValue(player.id)
-            query.exec_()
-            if query.size() > 0:
-                query.first()
-                player.global_rating = (query.value(0), query.value(1))
-            else:
-                self._logger.debug("error updating a player")
-                self._logger.debug(player.id)
+        players = list(self.players)
+        # only players who aren't online anymore need reading
+        ratings = yield from self.ratings.read(self.db_pool, [player.id for player in players])
+        for player in players:
+            self.ratings.apply(player, ratings[player.id])
 
     @property
     def created_at(self):
@@ -16,11 +16,15 @@
 # GNU General Public License for more details.
 #-------------------------------------------------------------------------------
 
-import time
 import logging
 
 from PySide import QtSql
 
+from src.counter_aggregator import CounterAggregator
+from src.post_game import PostGameQueue
+from src.rating_store import RatingStore
+from src.db_pool import DatabasePool
+from src.map_catalogue import MapCatalogue
 from src.games.game import Game, GameState
 
 
@@ -34,7 +38,8 @@ class GamesContainer(object):
 
         self.log.debug("initializing " + self.__class__.__name__)
         
-        self.games = []
+        # uuid -> Game
+        self.games = {}
 
         self.host = True
         self.live = True
@@ -51,13 +56,24 @@ class GamesContainer(object):
         self.options = []
 
         self.db = db
+        self.db_pool = parent.db_pool if parent is not None else DatabasePool(db)
+        self.map_catalogue = parent.map_catalogue if parent is not None else MapCatalogue()
+        self.counters = parent.counters if parent is not None else CounterAggregator(self.db_pool)
+        self.post_game = parent.post_game if parent is not None else PostGameQueue(self.db_pool)
+        self.ratings = parent.ratings if parent is not None else RatingStore()
         
         query = self.db.exec_("SELECT description FROM game_featuredMods WHERE gamemod = '%s'" % self.gameTypeName)
         if query.size() > 0:
             query.first()
             self.desc = query.value(0)  
 
-    def getGamemodVersion(self):
+        self.gamemodVersion = self.loadGamemodVersion()
+
+    def loadGamemodVersion(self):
+        """
+        Latest version of each file of the featured mod, from the database
+        :return: dict file id -> version
+        """
         tableMod = "updates_" + self.gameTypeName
         tableModFiles = tableMod + "_files"
         value = {}
@@ -70,10 +86,36 @@ class GamesContainer(object):
         
         return value
 
-    def createUuid(self, playerId):
-        query = QtSql.QSqlQuery(self.db)
-        queryStr = ("INSERT INTO game_stats (`host`) VALUE ( %i )" % playerId)
-        query.exec_(queryStr)      
+    def getGamemodVersion(self):
+        """
+        Cached featured mod file versions, see refreshGamemodVersion
+        :return: dict file id -> version
+        """
+        return self.gamemodVersion
+
+    def refreshGamemodVersion(self):
+        """
+        Reload the featured mod file versions
+
+        If they changed, the games of this container are sent again.
+        :return: bool whether they changed
+        """
+        value = self.loadGamemodVersion()
+        if value == self.gamemodVersion:
+            return False
+
+        self.log.info("featured mod versions of {} changed".format(self.gameTypeName))
+        self.gamemodVersion = value
+        for game in self.games.values():
+            game.bump_version()
+            self.addDirtyGame(game.uuid)
+        return True
+
+    def createUuid(self, playerId, db=None):
+        query = QtSql.QSqlQuery(self.db if db is None else db)
+        query.prepare("INSERT INTO game_stats (`host`) VALUE (?)")
+        query.addBindValue(playerId)
+        query.exec_()
         uuid = query.lastInsertId()
         
         
@@ -81,17 +123,16 @@ class GamesContainer(object):
 
     def findGameByUuid(self, uuid):
         """Find a game by the uuid"""
-        for game in self.games:
-            if game.uuid == uuid :
-                return game
-        return None
+        return self.games.get(uuid)
 
     def addGame(self, game):
         """Add a game to the list"""
-        if not game in self.games :
-            self.games.append(game)
-            return 1
-        return 0
+        if game.uuid in self.games:
+            return 0
+        self.games[game.uuid] = game
+        if self.parent is not None:
+            self.parent.register_game(game, self)
+        return 1
 
     def addBasicGame(self, player, name, gamePort):
         playerLogin = player.getLogin()
@@ -112,53 +153,26 @@ class GamesContainer(object):
         ngame.setGameHostPort(gamePort)
         ngame.setGameHostLocalPort(gamePort)
         ngame.name = name
-        self.games.append(ngame)
+        self.addGame(ngame)
         return ngame
 
     def removeGame(self, gameToRemove):
         """Remove a game from the list"""
 
-        for game in reversed(self.games):
-            if game == gameToRemove :
-                game.state = GameState.ENDED
-                self.addDirtyGame(game.uuid)
-                self.games.remove(game)
+        if self.games.get(gameToRemove.uuid) is not gameToRemove:
+            return False
 
-                return True
+        del self.games[gameToRemove.uuid]
+        if self.parent is not None:
+            self.parent.unregister_game(gameToRemove)
+        gameToRemove.state = GameState.ENDED
+        self.addDirtyGame(gameToRemove.uuid)
+        return True
 
     def addDirtyGame(self, game):
-        if not game in self.parent.dirtyGameList : 
-            self.parent.dirtyGameList.append(game)           
-            
-    def removeOldGames(self):
-        """Remove old games (invalids and not started)"""
-
-        now = time.time()
-
-        ''' Returns true if a game should be kept alive, false if it should die '''
-        def validateGame(game):
-            diff = now - game.created_at
-            if game.lobbyState == 'open':
-                if len(game.players) == 0:
-                    return False
-
-                hostPlayer = self.parent.players.findByName(game.hostPlayer)
-
-                if hostPlayer == 0:
-                    return False
-                else:
-                    if hostPlayer.getAction() != "HOST":
-                        return False
-
-            if game.lobbyState == 'Idle' and diff > 60:
-                return False
-
-            if game.lobbyState == 'playing' and diff > 60 * 60 * 8 : #if the game is playing for more than 8 hours
-                return False
-
-        for game in reversed(self.games):
+        self.parent.mark_dirty(game)
 
-            if not validateGame(game):
-                game.state = GameState.ENDED
-                self.addDirtyGame(game.uuid)
-                self.removeGame(game)
+    def checkGame(self, game):
+        """Have the game looked at by the next expiry, it may be stale"""
+        if self.parent is not None:
+            self.parent.check_game(game.uuid)
@@ -16,8 +16,10 @@
 # GNU General Public License for more details.
 #-------------------------------------------------------------------------------
 
+import asyncio
 import logging
 from src.abc.base_game import InitMode
+from src.counter_aggregator import MAP_DRAWS
 
 logger = logging.getLogger(__name__)
 
@@ -78,8 +80,7 @@ class ladder1V1Game(Game):
 
     def rate_game(self):
         if self.valid:
-            new_ratings = self.compute_rating()
-            self.persist_rating_change_stats(new_ratings, rating='ladder1v1')
+            return 'ladder1v1'
 
     def is_winner(self, player):
         return self.get_army_result(self.get_player_option(player.id, 'Army')) > 0
@@ -88,16 +89,16 @@ class ladder1V1Game(Game):
         super().on_game_end()
         if not self.valid:
             return
+        self.db_pool.spawn(self.record_ladder_scores())
+
+    @asyncio.coroutine
+    def record_ladder_scores(self):
+        """
+        Count the draw, or move the players' ladder scores and leagues
+        """
         if self.isDraw():
-            query = QSqlQuery(self.db)
-            queryStr = ("SELECT id FROM table_map WHERE filename LIKE '%" + self.mapName + "%'")
-            query.exec_(queryStr)
-            while query.next():
-                mapId = query.value(0)
-
-                queryStr = ("UPDATE table_map_features set num_draws = (num_draws +1) WHERE map_id LIKE " + str(mapId))
-                query = QSqlQuery(self.db)
-                query.exec_(queryStr)
+            for info in self.map_catalogue.versions(self.mapName):
+                self.counters.incr(MAP_DRAWS, info.id)
             return
 
         # And for the ladder !
@@ -106,7 +107,7 @@ class ladder1V1Game(Game):
         if len(set(self.leagues.values())) != 1:
             evenLeague = False
 
-        query = QSqlQuery(self.db)
+        changes = []
         for player in self.players:
             if self.is_winner(player):
                 # if not even league:
@@ -116,13 +117,7 @@ class ladder1V1Game(Game):
                         scoreToAdd = 0.5
                     else :
                         scoreToAdd = 1.5
-
-                query.prepare("UPDATE %s SET score = (score + ?) "
-                              "WHERE `idUser` = ?" % self.parent.season)
-                query.addBindValue(scoreToAdd)
-                query.addBindValue(player.id)
-                query.exec_()
-                self._logger.debug(query.executedQuery())
+                changes.append((player, scoreToAdd))
             else:
                 # if not even league:
                 scoreToRemove = 0.5
@@ -131,13 +126,33 @@ class ladder1V1Game(Game):
                         scoreToRemove = 1
                     else :
                         scoreToRemove = 0
+                changes.append((player, -scoreToRemove))
+
+        divisions = yield from self.db_pool.run(self.updateLadderScores, changes)
+        for p, (league, division) in divisions.items():
+            p.setLeague(league)
+            p.division = division
 
+    def updateLadderScores(self, db, changes):
+        """
+        Runs on a worker of the database pool
+        :param changes: list of (player, score to add, negative to remove)
+        :return: dict of player -> (league, division) after the changes
+        """
+        divisions = {}
+        query = QSqlQuery(db)
+        for player, score in changes:
+            if score >= 0:
+                query.prepare("UPDATE %s SET score = (score + ?) "
+                              "WHERE `idUser` = ?" % self.parent.season)
+                query.addBindValue(score)
+            else:
                 query.prepare("UPDATE %s SET score = GREATEST(0,(score - ?))"
                               "WHERE `idUser` = ?" % self.parent.season)
-                query.addBindValue(scoreToRemove)
-                query.addBindValue(player.id)
-                query.exec_()
-                self._logger.debug(query.executedQuery())
+                query.addBindValue(-score)
+            query.addBindValue(player.id)
+            query.exec_()
+            self._logger.debug(query.executedQuery())
 
             #check if the user must be promoted
             query.prepare("SELECT league, score FROM %s"
@@ -174,8 +189,8 @@ class ladder1V1Game(Game):
                         query.exec_()
                         if query.size() > 0:
                             query.first()
-                            p.setLeague(league)
-                            p.division = str(query.value(0))
+                            divisions[p] = (league, str(query.value(0)))
+        return divisions
 
     def addPlayerToJoin(self, player):
         self.playerToJoin = player
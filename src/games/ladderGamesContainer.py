@@ -17,6 +17,7 @@
 #-------------------------------------------------------------------------------
 
 
+import asyncio
 import random
 
 from PySide.QtSql import QSqlQuery
@@ -95,8 +96,8 @@ class Ladder1V1GamesContainer(GamesContainer):
         calculator = FactorGraphTrueSkillCalculator()
         return calculator.calculateMatchQuality(gameInfo, matchup)
 
-    def getSelectedLadderMaps(self, playerId):
-        query = QSqlQuery(self.db)
+    def getSelectedLadderMaps(self, playerId, db=None):
+        query = QSqlQuery(self.db if db is None else db)
         query.prepare("SELECT idMap FROM ladder_map_selection WHERE idUser = ?")
         query.addBindValue(playerId)
         query.exec_()
@@ -106,8 +107,8 @@ class Ladder1V1GamesContainer(GamesContainer):
                 maps.append(int(query.value(0)))
         return maps
 
-    def getPopularLadderMaps(self, count):
-        query = QSqlQuery()
+    def getPopularLadderMaps(self, count, db=None):
+        query = QSqlQuery(self.db if db is None else db)
         query.prepare("SELECT `idMap` FROM `ladder_map_selection` GROUP BY `idMap` ORDER BY count(`idUser`) DESC LIMIT %i" % count)
         query.exec_()
         maps = []
@@ -116,8 +117,12 @@ class Ladder1V1GamesContainer(GamesContainer):
                 maps.append(int(query.value(0)))
         return maps
 
-    def getMapName(self, mapId):
-        query = QSqlQuery(self.db)
+    def getMapName(self, mapId, db=None):
+        info = self.map_catalogue.get(mapId)
+        if info is not None:
+            return info.filename.split("/")[1].replace(".zip", "")
+
+        query = QSqlQuery(self.db if db is None else db)
         query.prepare("SELECT filename FROM table_map WHERE id = ?")
         query.addBindValue(mapId)
         query.exec_()
@@ -127,10 +132,10 @@ class Ladder1V1GamesContainer(GamesContainer):
         else:
             return None
 
-    def choose_ladder_map_pool(self, player1, player2):
+    def choose_ladder_map_pool(self, player1, player2, db=None):
         player_maps = [
-            self.getSelectedLadderMaps(player1.id),
-            self.getSelectedLadderMaps(player2.id)
+            self.getSelectedLadderMaps(player1.id, db=db),
+            self.getSelectedLadderMaps(player2.id, db=db)
         ]
 
         common_maps = list(set(player_maps[0]).intersection(set(player_maps[1])))
@@ -145,22 +150,35 @@ class Ladder1V1GamesContainer(GamesContainer):
 
         if len(common_maps) < 15:
             missing_maps = 15 - len(common_maps)
-            common_maps = common_maps + self.getPopularLadderMaps(missing_maps)[:missing_maps]
+            common_maps = common_maps + self.getPopularLadderMaps(missing_maps, db=db)[:missing_maps]
 
         return common_maps
 
+    def prepareGame(self, db, player1, player2):
+        """
+        Runs on a worker of the database pool
+        :return: (game id, map name)
+        """
+        gameUuid = self.createUuid(player1.id, db=db)
+        map_pool = self.choose_ladder_map_pool(player1, player2, db=db)
+        mapChosen = random.choice(map_pool)
+        return gameUuid, self.getMapName(mapChosen, db=db)
+
     def startGame(self, player1, player2):
-        gameName = str(player1.getLogin() + " Vs " + player2.getLogin())
-        
+        """
+        Match two players, the game starts once its id and map are picked on the database pool
+        """
         player1.setAction("HOST")
-        gameUuid = self.createUuid(player1.id)
         player2.setAction("JOIN")
         player1.wantToConnectToGame = True
 
-        map_pool = self.choose_ladder_map_pool(player1, player2)
+        return self.db_pool.spawn(self.createLadderGame(player1, player2))
 
-        mapChosen = random.choice(map_pool)
-        map = self.getMapName(mapChosen)
+    @asyncio.coroutine
+    def createLadderGame(self, player1, player2):
+        gameName = str(player1.getLogin() + " Vs " + player2.getLogin())
+
+        gameUuid, map = yield from self.db_pool.run(self.prepareGame, player1, player2)
 
         ngame = ladder1V1Game(gameUuid, self)
 
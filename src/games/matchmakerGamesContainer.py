@@ -373,7 +373,7 @@ class MatchmakerGamesContainer(GamesContainer):
             return
 
         #first clean old games that didnt start.
-        for game in self.games :
+        for game in list(self.games.values()) :
             if game.lobbyState == 'Idle' :
                 for player in game.players :
                     for p in players1 + players2:
@@ -17,29 +17,75 @@
 #-------------------------------------------------------------------------------
 
 import logging
+import time
 
+import config
+from src.counter_aggregator import CounterAggregator
+from src.post_game import PostGameQueue
+from src.rating_store import RatingStore
+from src.db_pool import DatabasePool
+from src.expiry_scheduler import ExpiryScheduler
 from src.games import Game
+from src.games.game import GameState
+from src.map_catalogue import MapCatalogue
+from src.mod_cache import ModCache
+from src.subscribable import Subscribable
 
 
-class GamesService(object):
+class GamesService(Subscribable):
     """
     Utility class for maintaining lifecycle of games
+
+    Emits a DirtyGame message whenever a game changed in a way
+    the lobby clients should hear about.
+
+    Stale games are removed by expire_games, which only looks at the games
+    whose deadline passed or that were flagged with check_game.
+
+    The games and the lobby run their queries on db_pool, a synchronous one
+    on db unless given. Maps are looked up in map_catalogue, which is empty
+    until loaded, and sim mods in mod_cache. Statistics that only get
+    incremented go through counters, written every now and then once
+    started. Games that ended are rated and stored by post_game, and the
+    ratings of the players online are kept in ratings.
     """
-    def __init__(self, players, db):
-        self._dirty_games = []
+    def __init__(self, players, db, db_pool=None):
+        Subscribable.__init__(self)
+        self._dirty_games = set()
         self.players = players
         self.db = db
+        self.db_pool = db_pool or DatabasePool(db)
+        self.map_catalogue = MapCatalogue()
+        self.mod_cache = ModCache(size=config.MOD_CACHE_SIZE, ttl=config.MOD_CACHE_TTL)
+        self.counters = CounterAggregator(self.db_pool)
+        self.post_game = PostGameQueue(self.db_pool, workers=config.POST_GAME_WORKERS,
+                                       retries=config.POST_GAME_RETRIES)
+        self.ratings = RatingStore(players)
+        self.post_game.subscribe(self.ratings, ['GameRecorded'])
         
         self.log = logging.getLogger(__name__)
 
         self.gamesContainer = {}
+        # game id -> (Game, GamesContainer), kept up to date by the containers
+        self._games = {}
+        self.expiry = ExpiryScheduler(self._review_game)
+        self.idle_timeout = config.GAME_IDLE_TIMEOUT
+        self.max_duration = config.GAME_MAX_DURATION
 
     @property
     def dirty_games(self):
         return self._dirty_games
 
     def clear_dirty(self):
-        self._dirty_games = []
+        self._dirty_games = set()
+
+    def pop_dirty(self):
+        """
+        Take the ids of all games changed since the last call
+        :return: set
+        """
+        dirty, self._dirty_games = self._dirty_games, set()
+        return dirty
 
     def addContainer(self, name, container):
         """ add a game container class named <name>"""
@@ -68,21 +114,25 @@ class GamesService(object):
         return None
 
     def mark_dirty(self, game_id):
-        self._dirty_games.append(game_id)
+        self._dirty_games.add(game_id)
+        self.notify({
+            'command_id': 'DirtyGame',
+            'arguments': [game_id]
+        })
 
     def sendGamesList(self):
         games = []
-        for key, container in self.gamesContainer :
+        for key, container in self.gamesContainer.items() :
             
             if container.listable :
 
-                for game in container.games :
+                for game in container.games.values() :
                     if game.lobbyState == "open" :
                         
                         json = {
                             "command": "game_info",
                             "uid": game.uuid,
-                            "title": game.gameName,
+                            "title": game.name,
                             "state": game.lobbyState,
                             "featured_mod": game.getGamemod(),
                             "mapname": game.mapName.lower(),
@@ -104,33 +154,125 @@ class GamesService(object):
 
         return games
     
-    def removeOldGames(self):
-        for container in self.gamesContainer :
-            self.gamesContainer[container].removeOldGames()
-        return True
+    def refresh_featured_mod_versions(self, name=None):
+        """
+        Reload the cached featured mod file versions
+        :param name: only this featured mod, or all of them if None
+        :return: list of the names of the featured mods that changed
+        """
+        changed = []
+        for container_name, container in self.gamesContainer.items():
+            if name is None or name == container_name:
+                if container.refreshGamemodVersion():
+                    changed.append(container_name)
+        return changed
+
+    def reload_map_catalogue(self):
+        """
+        Pick up the maps added to the vault other than through the lobby
+        """
+        self.db_pool.spawn(self.map_catalogue.reload(self.db_pool))
+
+    def check_game(self, game_id):
+        """
+        Have the next expire_games look at the game, e.g. because its host left
+        """
+        key = self._game_key(game_id)
+        if key in self._games:
+            self.expiry.schedule(key, time.time())
+
+    def expire_games(self, now=None):
+        """
+        Remove the games that are due and stale
+        :return: list of the ids of the removed games
+        """
+        return self.expiry.run(now)
+
+    def _host_in_lobby(self, game):
+        if len(game.players) == 0:
+            return False
+        host = self.players.findByName(game.hostPlayer)
+        if host == 0:
+            return False
+        return host.getAction() == "HOST" and host.getGame() == str(game.uuid)
+
+    def _review_game(self, key, now):
+        """
+        Remove the game if it is stale
+        :return: when to look at it again, or None if it was removed
+        """
+        entry = self._games.get(key)
+        if entry is None:
+            return None
+        game, container = entry
+
+        age = now - game.created_at
+        if game.state == GameState.INITIALIZING:
+            if age <= self.idle_timeout:
+                return game.created_at + self.idle_timeout
+        elif game.state == GameState.LOBBY:
+            if self._host_in_lobby(game):
+                # an old lobby is kept for as long as its host stays, look again once in a while
+                return max(game.created_at + self.max_duration, now + self.idle_timeout)
+        elif game.state == GameState.LIVE:
+            if age <= self.max_duration:
+                return game.created_at + self.max_duration
+
+        self.log.debug("Removing stale {} ({})".format(game, game.lobbyState))
+        container.removeGame(game)
+        return None
 
     def getContainer(self, name):
         if name in self.gamesContainer :
             return self.gamesContainer[name]
         return None
 
+    @staticmethod
+    def _game_key(uuid):
+        # ids come in as ints from the database and as strings from clients
+        try:
+            return int(uuid)
+        except (TypeError, ValueError):
+            return uuid
+
+    def register_game(self, game, container):
+        """
+        Called by a container when it adds a game
+        """
+        key = self._game_key(game.uuid)
+        self._games[key] = (game, container)
+        self.expiry.schedule(key, game.created_at + self.idle_timeout)
+
+    def unregister_game(self, game):
+        """
+        Called by a container when it removes a game
+        """
+        key = self._game_key(game.uuid)
+        entry = self._games.get(key)
+        if entry is not None and entry[0] is game:
+            del self._games[key]
+            self.expiry.discard(key)
+
     def getGameContainer(self, game):
-        for container in self.gamesContainer :
-            if game in self.gamesContainer[container].getGames() :
-                return self.gamesContainer[container]
-        return True        
+        """
+        :return: the container holding the game, or None
+        """
+        entry = self._games.get(self._game_key(game.uuid))
+        if entry is not None and entry[0] is game:
+            return entry[1]
+        return None
 
     def removeGame(self, game):
-        for container in self.gamesContainer :
-            self.gamesContainer[container].removeGame(game)
+        container = self.getGameContainer(game)
+        if container is not None:
+            container.removeGame(game)
         return True
 
     def find_by_id(self, uuid):
         """
         :rtype: Game
         """
-        for container in self.gamesContainer:
-            game = self.gamesContainer[container].findGameByUuid(str(uuid))
-            if game is not None:
-                return game
-        return None    
+        entry = self._games.get(self._game_key(uuid))
+        if entry is not None:
+            return entry[0]
+        return None
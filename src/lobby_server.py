@@ -0,0 +1,213 @@
+import asyncio
+from collections import OrderedDict
+
+from src.connection_registry import ConnectionRegistry
+from src.decorators import with_logger, timed
+from src.delta_tracker import DeltaTracker
+from src.game_broadcaster import GameListBroadcaster
+from src.games_service import GamesService
+from src.resolver import ReverseResolver
+from src.timer import Timer
+import config
+
+import teams
+
+
+@with_logger
+class BaseLobbyServer():
+    """
+    State and broadcasts of the lobby server, shared by its Qt and asyncio implementations
+
+    Subclasses accept the client sockets and hand each to a LobbyConnection,
+    registering it in `recorders`.
+    """
+    def __init__(self, listUsers, games: GamesService, db, parent=None, loop=None):
+        self.parent = parent
+        self.loop = loop or asyncio.get_event_loop()
+        self._logger.debug("Starting lobby server")
+
+        self.teams = teams.Teams(self)
+
+        self.listUsers = listUsers
+        self.games = games
+
+        self.db = db
+        # queries of the lobby connections, see src.db_pool
+        self.db_pool = games.db_pool
+
+        self.recorders = ConnectionRegistry()
+        # host names of the players, for whatever wants them. Never on the login path.
+        self.resolver = ReverseResolver(loop=self.loop,
+                                        timeout=config.RESOLVER_TIMEOUT,
+                                        ttl=config.RESOLVER_TTL,
+                                        size=config.RESOLVER_CACHE_SIZE)
+        self.socketToDelete = []
+
+        # last state sent of each game and player, for the clients taking deltas.
+        self.deltas = DeltaTracker(history=config.LOBBY_EVENT_HISTORY)
+        # uid -> session of the last connection of each player that left, oldest first
+        self.closedSessions = OrderedDict()
+        self.closedSessionsLimit = config.LOBBY_CLOSED_SESSIONS
+
+        # push game list changes to the players as they happen, coalesced.
+        self.gameBroadcaster = GameListBroadcaster(self.games,
+                                                   self.sendDirtyGames,
+                                                   loop=self.loop,
+                                                   max_latency=config.GAME_LIST_MAX_LATENCY,
+                                                   max_pending=config.GAME_LIST_MAX_PENDING)
+        self.games.subscribe(self.gameBroadcaster, ['DirtyGame'])
+
+        # new ratings go out as soon as a game is rated, the rating store has them by then.
+        self.games.post_game.subscribe(self, ['GameRecorded'])
+
+        # featured mod versions are cached on the game containers, pick up new patches now and then.
+        self.modVersionTimer = Timer(self.games.refresh_featured_mod_versions, loop=self.loop)
+        self.modVersionTimer.start(config.FEATURED_MOD_VERSION_REFRESH * 1000)
+
+        # maps added to the vault behind our back
+        self.mapCatalogueTimer = Timer(self.games.reload_map_catalogue, loop=self.loop)
+        self.mapCatalogueTimer.start(config.MAP_CATALOGUE_REFRESH * 1000)
+
+        # stale games are removed as their deadlines pass, or once flagged when their host left.
+        self.expiryTimer = Timer(self.games.expire_games, loop=self.loop)
+        self.expiryTimer.start(config.GAME_EXPIRY_TICK * 1000)
+
+    @timed()
+    def removeRecorder(self, recorder):
+        self.recorders.remove(recorder)
+
+    def rememberSession(self, uid, session):
+        """
+        Keep the session of a player that left, for them to resume it
+        """
+        self.closedSessions.pop(uid, None)
+        self.closedSessions[uid] = session
+        while len(self.closedSessions) > self.closedSessionsLimit:
+            self.closedSessions.popitem(last=False)
+
+    def removePlayer(self, player):
+        """
+        Take a player off the list of players online, and forget their last broadcast state
+        :return: 1 if the player was removed, 0 if another one signed in with the same login since
+        """
+        if not self.listUsers.removeUser(player):
+            return 0
+        # resuming clients are told the player left
+        self.deltas.forget(("player_info", player.getLogin()))
+        return 1
+
+    @timed()
+    def jsonGame(self, game):
+        return game.to_dict()
+
+
+    @staticmethod
+    def closedGameInfo(uid):
+        """
+        Bogus game_info for a game that is gone, to ensure client state updates
+        """
+        return {"command": "game_info",
+                "uid": uid,
+                "title": "unknown",
+                "state": "closed",
+                "featured_mod": "unknown",
+                "featured_mod_versions": {},
+                "sim_mods": [],
+                "mapname": "unknown",
+                "host": "unknown",
+                "num_players": 0,
+                "game_type": "unknown",
+                "game_time": 0,
+                "max_players": 0,
+                "teams": {},
+                "options": []}
+
+    @staticmethod
+    def departedPlayerInfo(login):
+        """
+        player_info for a player that is gone, for the clients that missed them leaving
+        """
+        return {"command": "player_info",
+                "login": login,
+                "state": "offline"}
+
+    def encodeUpdate(self, cache, connection, update, full=False):
+        """
+        Frame an update for a connection
+
+        Clients taking deltas get one, unless they have no state to apply it
+        to, or a queued message about the same thing could supersede it.
+        :param cache: dict of frames already encoded during this broadcast
+        :param full: send the whole state even to clients taking deltas
+        :return: bytes
+        """
+        framing = connection.framing
+        if not connection.deltaUpdates:
+            form, build = 'plain', lambda: update.message
+        elif full or update.prev is None or update.key in connection.outbound:
+            form, build = 'full', update.full
+        else:
+            form, build = 'delta', update.delta
+
+        cache_key = (framing.name, form, update.key)
+        if cache_key not in cache:
+            cache[cache_key] = framing.pack_message(build())
+        return cache[cache_key]
+
+    @timed
+    def sendDirtyGames(self, game_ids):
+        games = []
+        updates = []
+        closed = []
+
+        for uid in game_ids:
+            key = ("game_info", uid)
+            game = self.games.find_by_id(uid)
+            if game is not None:
+                games.append(game)
+                update = self.deltas.update(key, game.to_dict())
+                if update.modified:
+                    updates.append(update)
+            else:
+                self.deltas.forget(key)
+                closed.append((key, self.closedGameInfo(uid)))
+
+        # one frame per game, so that clients that are behind only get the latest state of each.
+        # Frames are encoded once for each framing in use, games keep theirs until they change.
+        frames = {}
+        for connection in self.recorders.alive():
+            framing = connection.framing
+            if connection.deltaUpdates:
+                for update in updates:
+                    connection.sendArray(self.encodeUpdate(frames, connection, update), update.key)
+            else:
+                for game in games:
+                    connection.sendArray(game.game_info_frame(framing), ("game_info", game.uuid))
+
+            for key, message in closed:
+                if (framing.name, key) not in frames:
+                    frames[(framing.name, key)] = framing.pack_message(message)
+                connection.sendArray(frames[(framing.name, key)], key)
+
+    def handle_GameRecorded(self, arguments):
+        _, new_ratings = arguments
+        for player_id in new_ratings:
+            player = self.listUsers.findById(player_id)
+            if player is not None:
+                self.sendPlayerInfo(player)
+
+    @timed
+    def sendPlayerInfo(self, player, full=False):
+        """
+        Tell the other players about a player, only what changed to those taking deltas
+        :param full: the whole state to everyone, e.g. when the player just logged in
+        """
+        update = self.deltas.update(("player_info", player.getLogin()), self.parent.jsonPlayer(player))
+        if not (full or update.modified):
+            return
+
+        frames = {}
+        for user in self.listUsers:
+            lobby = user.lobbyThread
+            if lobby is not None and user.getLogin() != player.getLogin():
+                lobby.sendArray(self.encodeUpdate(frames, lobby, update, full), update.key)
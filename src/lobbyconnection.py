@@ -15,10 +15,10 @@
 # MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
 # GNU General Public License for more details.
 #-------------------------------------------------------------------------------
+import asyncio
 import hashlib
 import zlib
 import cgi
-import socket
 import base64
 import json
 import urllib.parse
@@ -34,18 +34,25 @@ import smtplib
 from email.mime.text import MIMEText
 import email.utils
 
-from PySide.QtCore import QTimer
-from PySide.QtCore import QByteArray, QDataStream, QIODevice, QFile, QObject
+from PySide.QtCore import QIODevice, QFile
 from PySide import QtNetwork
 from PySide.QtSql import QSqlQuery
 import pygeoip
 import trueskill
 from trueskill import Rating
 
+from src import metrics
+from src.counter_aggregator import LADDER_CANCELLED, MOD_DOWNLOADS, MOD_PLAYED
+from src.db_pool import QueryError, statements
 from src.decorators import timed
+from src.framed_connection import FramedConnection
+from src.outbound_queue import OutboundQueue
+from src.protocol.lobby import LEGACY, V2, V2_ZLIB, FramingError, StreamDeflater
 from src.players import *
+from src.timer import Timer
 from passwords import PW_SALT, STEAM_APIKEY, PRIVATE_KEY, decodeUniqueId, MAIL_ADDRESS
 from config import Config
+import config
 
 
 gi = pygeoip.GeoIP('GeoIP.dat', pygeoip.MEMORY_CACHE)
@@ -68,11 +75,16 @@ TIMEOUT_SECONDS = 300
 logger = logging.getLogger(__name__)
 
 
-class LobbyConnection(QObject):
+class LobbyConnection(FramedConnection):
+    """
+    A client of the lobby server
+
+    The socket is either a QTcpSocket, or anything providing the parts of
+    its interface used here, see src.asyncio_lobby_server.LobbySocket.
+    """
     @timed()
     def __init__(self, socket, parent=None):
-        super(LobbyConnection, self).__init__(parent)
-        self.parent = parent
+        FramedConnection.__init__(self, socket, parent, prefix='lobby', loop=parent.loop)
 
         self.log = logging.getLogger(__name__)
 
@@ -80,10 +92,6 @@ class LobbyConnection(QObject):
 
         self.season = LADDER_SEASON
 
-        self.socket = socket
-
-        self.socket.disconnected.connect(self.disconnection)
-        self.socket.error.connect(self.displayError)
         self.socket.stateChanged.connect(self.stateChange)
 
         self.ladderPotentialPlayers = []
@@ -91,14 +99,12 @@ class LobbyConnection(QObject):
 
         self.loginDone = False
 
-        self.initTimer = QTimer(self)
-        self.initTimer.timeout.connect(self.initNotDone)
+        self.initTimer = Timer(self.initNotDone, loop=self.parent.loop)
         self.initTimer.start(2000)
 
         if self.socket is not None and self.socket.state() == 3 and self.socket.isValid():
             self.privkey = PRIVATE_KEY
 
-            self.noSocket = False
             self.readingSocket = False
 
             self.addGameModes()
@@ -113,10 +119,6 @@ class LobbyConnection(QObject):
 
             self.missedPing = 0
 
-            self.nextBlockSize = 0
-
-            self.blockSize = 0
-
             self.friendList = []
             self.foeList = []
             self.ladderMapList = []
@@ -130,7 +132,15 @@ class LobbyConnection(QObject):
             self.port = self.socket.peerPort()
             self.peerName = self.socket.peerName()
 
-            self.socket.readyRead.connect(self.readData)
+            # framing and ACKs are negotiated in hello
+            self.acks = True
+            self.batches = False
+            self.deltaUpdates = False
+            self.deflater = None
+
+            # frames held back while the client is not keeping up
+            self.outbound = OutboundQueue()
+            self.socket.bytesWritten.connect(self.flushOutbound)
 
             self.pingTimer = None
 
@@ -253,13 +263,15 @@ class LobbyConnection(QObject):
 
     @timed()
     def checkOldGamesFromPlayer(self):
-        pass
+        # the player is leaving the game it was in, which may be left without a host
+        if self.player is not None and self.player.getGame():
+            self.parent.games.check_game(self.player.getGame())
 
 
     @timed()
     def joinGame(self, uuid, gamePort, password=None):
+        self.parent.games.expire_games()
         self.checkOldGamesFromPlayer()
-        self.parent.games.removeOldGames()
 
         if gamePort == '' or gamePort == 0 or gamePort is None:
             gamePort = 6112
@@ -312,8 +324,8 @@ class LobbyConnection(QObject):
     def hostGame(self, access, gameName, gamePort, version, mod="faf", map='SCMP_007', password=None, rating=1,
                  options=[]):
         mod = mod.lower()
+        self.parent.games.expire_games()
         self.checkOldGamesFromPlayer()
-        self.parent.games.removeOldGames()
 
         if not gameName:
             gameName = self.player.login
@@ -472,6 +484,8 @@ class LobbyConnection(QObject):
 
                             if not query.exec_():
                                 self.log.debug(query.lastError())
+                            # it was cached as unknown, if a game used it already
+                            self.parent.games.mod_cache.invalidate(uid)
 
                         zip.close()
 
@@ -661,6 +675,9 @@ class LobbyConnection(QObject):
                                 if not query.exec_():
                                     self.log.debug(query.lastError())
 
+                            if uuid:
+                                self.parent.games.map_catalogue.add(uuid, name, filename, ranked=not unranked)
+
                         zip.close()
 
                         self.sendJSON(dict(command="notice", style="info", text="Map correctly uploaded."))
@@ -771,82 +788,40 @@ Thanks,\n\
             self.log.exception("Something awful happened in a lobby thread !")
 
 
-    @timed()
-    def readData(self):
-        packetSize = 0
+    def checkData(self):
         if self.initTimer:
-            packetSize = self.socket.bytesAvailable()
+            # the first packet has to be exactly one small frame
+            packetSize = len(self.reader)
             if packetSize > 120:
                 self.log.warning("invalid handshake ! - Packet too big (" + str(
                     packetSize) + " ) " + self.socket.peerAddress().toString())
                 self.socket.abort()
-                return
-
-        if self.noSocket == False and self.socket.isValid():
-
-            if self.socket.bytesAvailable() == 0:
+                return False
+            if self.reader.next_size() != packetSize - 4:
+                self.log.warning(
+                    "invalid handshake ! - packet not fit ! " + self.socket.peerAddress().toString())
                 self.socket.abort()
-                return
-
-            ins = QDataStream(self.socket)
-
-            ins.setVersion(QDataStream.Qt_4_2)
-            while not ins.atEnd():
-
-                if self.noSocket == False and self.socket.isValid():
-
-                    if self.blockSize == 0:
-                        if self.noSocket == False and self.socket.isValid():
-                            if self.socket.bytesAvailable() < 4:
-                                if self.initTimer:
-                                    self.log.warning(
-                                        "invalid handshake ! - no valid packet size " + self.socket.peerAddress().toString())
-                                    self.socket.abort()
-                                    return
-
-                                return
+                return False
 
-                            self.blockSize = ins.readUInt32()
-                            if self.initTimer:
-                                if (packetSize - 4) != self.blockSize:
-                                    self.log.warning(
-                                        "invalid handshake ! - packet not fit ! " + self.socket.peerAddress().toString())
-                                    self.socket.abort()
-                                    return
-
-                        else:
-                            self.socket.abort()
-                            return
-
-                    if self.noSocket == False and self.socket.isValid():
-                        if self.socket.bytesAvailable() < self.blockSize:
-                            bytesReceived = str(self.socket.bytesAvailable())
-                            self.sendReply("ACK", bytesReceived)
-
-                            return
-
-                        bytesReceived = str(self.socket.bytesAvailable())
-                        self.sendReply("ACK", bytesReceived)
-
-
-                    else:
-                        self.socket.abort()
-                        return
-
-                    action = ins.readQString()
-                    self.handleAction(action, ins)
-
-                    self.blockSize = 0
-
-                else:
-                    self.socket.abort()
-                    return
-            return
+        if self.acks and self.framing is LEGACY:
+            # one ACK per read rather than one per packet
+            self.sendReply("ACK", str(len(self.reader)))
+        return True
 
+    def dispatchFrame(self, frame):
+        if self.framing is LEGACY:
+            FramedConnection.dispatchFrame(self, frame)
+        else:
+            try:
+                message = str(frame, 'utf-8')
+            except UnicodeDecodeError as ex:
+                raise FramingError("Invalid UTF-8: {}".format(ex))
+            self.receiveJSON(message, None)
 
     @timed()
     def disconnection(self):
         self.noSocket = True
+        self.parent.recorders.mark_closing(self)
         self.done()
 
     @timed()
@@ -866,7 +841,7 @@ Thanks,\n\
 
     @timed()
     def sendReplaySection(self):
-        reply = QByteArray()
+        messages = []
 
         query = QSqlQuery(self.parent.db)
         query.prepare("SELECT `section`,`description` FROM `tutorial_sections`")
@@ -874,7 +849,7 @@ Thanks,\n\
         if query.size() > 0:
             while query.next():
                 jsonToSend = {"command": "tutorials_info", "section": query.value(0), "description": query.value(1)}
-                reply.append(self.prepareBigJSON(jsonToSend))
+                messages.append(jsonToSend)
 
         query.prepare(
             "SELECT tutorial_sections.`section`,`name`,`url`, `tutorials`.`description`, `map` FROM `tutorials` LEFT JOIN  tutorial_sections ON tutorial_sections.id = tutorials.section ORDER BY `tutorials`.`section`, name")
@@ -884,13 +859,13 @@ Thanks,\n\
                 jsonToSend = {"command": "tutorials_info", "tutorial": query.value(1), "url": query.value(2),
                               "tutorial_section": query.value(0), "description": query.value(3),
                               "mapname": query.value(4)}
-                reply.append(self.prepareBigJSON(jsonToSend))
+                messages.append(jsonToSend)
 
-        self.sendArray(reply)
+        self.sendJSONBatch(messages)
 
     @timed()
     def sendCoopList(self):
-        reply = QByteArray()
+        messages = []
 
         query = QSqlQuery(self.parent.db)
         query.prepare("SELECT name, description, filename, type, id FROM `coop_map`")
@@ -911,13 +886,13 @@ Thanks,\n\
                 else:
                     jsonToSend["type"] = "Unknown"
                 jsonToSend["uid"] = query.value(4)
-                reply.append(self.prepareBigJSON(jsonToSend))
+                messages.append(jsonToSend)
 
-        self.sendArray(reply)
+        self.sendJSONBatch(messages)
 
     @timed()
     def sendModList(self):
-        reply = QByteArray()
+        messages = []
 
         for containerName in self.parent.games.gamesContainer:
 
@@ -935,9 +910,9 @@ Thanks,\n\
                 "options": container.options
             }
 
-            reply.append(self.prepareBigJSON(jsonToSend))
+            messages.append(jsonToSend)
 
-        self.sendArray(reply)
+        self.sendJSONBatch(messages)
 
     @timed()
     def jsonTourney(self, tourney):
@@ -955,91 +930,103 @@ Thanks,\n\
     @timed()
     def sendGameList(self):
 
-        reply = QByteArray()
+        messages = []
+        frames = []
 
         for key, container in self.parent.games.gamesContainer.items():
             self.log.debug("sending games of container " + container.gameNiceName)
             if container.listable or container.live:
-                for game in container.games:
+                for game in container.games.values():
 
                     if game.lobbyState == "open" or game.lobbyState == "playing":
-                        reply.append(self.prepareBigJSON(self.parent.jsonGame(game)))
+                        # clients taking deltas need the state they will apply to, with its number
+                        snapshot = self.parent.deltas.snapshot(("game_info", game.uuid))
+                        if self.deltaUpdates and snapshot is not None:
+                            message = snapshot.full()
+                        elif self.batches:
+                            message = game.to_dict()
+                        else:
+                            # framed once per game, for every client that takes them one by one
+                            frames.append(game.game_info_frame(self.framing))
+                            continue
+
+                        if self.batches:
+                            messages.append(message)
+                        else:
+                            frames.append(self.framing.pack_message(message))
 
             self.log.debug("done")
 
-        self.sendArray(reply)
+        if self.batches:
+            self.sendJSONBatch(messages)
+        elif frames:
+            self.sendArray(b''.join(frames))
 
+    @staticmethod
     @timed()
-    def preparePacket(self, action, *args, **kwargs):
-
-        reply = QByteArray()
-        stream = QDataStream(reply, QIODevice.WriteOnly)
-        stream.setVersion(QDataStream.Qt_4_2)
-        stream.writeUInt32(0)
-
-        stream.writeQString(action)
+    def preparePacket(action, *args, **kwargs):
+        return LEGACY.pack(action, *args)
 
-        for arg in args:
-            if isinstance(arg, int):
-                stream.writeInt32(arg)
-            elif isinstance(arg, float):
-                stream.writeQString(str(arg))
-            elif isinstance(arg, str):
-                stream.writeFloat(arg)
+    def canSend(self):
+        return self.parent.recorders.is_alive(self) and not self.noSocket
 
-        stream.device().seek(0)
-
-        stream.writeUInt32(reply.size() - 4)
-
-        return reply
-
-    @timed()
-    def sendArray(self, array):
-
-        if self in self.parent.recorders:
-            if not self.noSocket:
-                if self.socket.bytesToWrite() > 16 * 1024 * 1024:
-                    return
-
-            if self.socket.isValid() and self.socket.state() == 3:
-
-                if self.socket.write(array) == -1:
-                    self.noSocket = True
-                    self.socket.abort()
-            else:
-                self.socket.abort()
-
-
-    @timed()
-    def sendReply(self, action, *args, **kwargs):
-        if self in self.parent.recorders:
-            if not self.noSocket:
+    def writeFrame(self, frame, key=None):
+        """
+        Write a frame to the socket, or queue it while the client is not keeping up
 
-                reply = QByteArray()
-                stream = QDataStream(reply, QIODevice.WriteOnly)
-                stream.setVersion(QDataStream.Qt_4_2)
-                stream.writeUInt32(0)
+        Queued frames with the same key are superseded by newer ones.
+        A client whose queue grows past its budget is disconnected.
+        :param frame: framed message
+        :param key: what the frame is about, e.g. ('game_info', uid)
+        :return: None
+        """
+        if not (self.socket.isValid() and self.socket.state() == 3):
+            self.parent.recorders.mark_closing(self)
+            self.socket.abort()
+            return
 
-                stream.writeQString(action)
+        if len(self.outbound) > 0 or self.socket.bytesToWrite() > config.LOBBY_SOCKET_BUFFER:
+            self.outbound.push(frame, key)
+            if self.outbound.size > config.LOBBY_CLIENT_BUDGET:
+                self.dropSlowClient()
+            return
 
-                for arg in args:
-                    if isinstance(arg, int):
-                        stream.writeInt(arg)
-                    elif isinstance(arg, str):
-                        stream.writeQString(arg)
+        self.writeToSocket(frame)
 
-                stream.device().seek(0)
+    def writeToSocket(self, frame):
+        if self.deflater is not None:
+            frame = self.deflater.compress(frame)
+        return FramedConnection.writeToSocket(self, frame)
 
-                stream.writeUInt32(reply.size() - 4)
+    def abort(self):
+        self.parent.recorders.mark_closing(self)
+        FramedConnection.abort(self)
 
-                if self.socket.isValid() and self.socket.state() == 3:
+    def flushOutbound(self, bytesWritten=None):
+        """
+        Move queued frames to the socket as its buffer drains, in a single write
+        """
+        if self.noSocket:
+            return
 
-                    if self.socket.write(reply) == -1:
-                        self.log.debug("error socket write")
-                        self.socket.abort()
-                        self.noSocket = True
-                else:
-                    self.socket.abort()
+        room = config.LOBBY_SOCKET_BUFFER - self.socket.bytesToWrite()
+        frames = []
+        while len(self.outbound) > 0 and room >= 0:
+            frame = self.outbound.pop()
+            room -= len(frame)
+            frames.append(frame)
+
+        if frames:
+            self.writeToSocket(b''.join(frames))
+
+    def dropSlowClient(self):
+        self.log.warning(self.logPrefix + "Outbound queue over budget ({} bytes in {} frames), disconnecting"
+                         .format(self.outbound.size, len(self.outbound)))
+        metrics.incr('lobby.slow_client_disconnects')
+        self.outbound.clear()
+        self.noSocket = True
+        self.parent.recorders.mark_closing(self)
+        self.socket.abort()
 
     def command_fa_state(self, message):
         state = message["state"]
@@ -1156,8 +1143,7 @@ Thanks,\n\
             if len(toAdd) > 0:
 
                 for friend in toAdd:
-                    query = QSqlQuery(self.parent.db)
-                    query.prepare(
+                    query = statements(self.parent.db).prepare(
                         "INSERT INTO friends (idUser, idFriend) values (?,(SELECT id FROM login WHERE login.login = ?))")
                     query.addBindValue(self.uid)
                     query.addBindValue(friend)
@@ -1167,8 +1153,7 @@ Thanks,\n\
 
             if len(toRemove) > 0:
                 for friend in toRemove:
-                    query = QSqlQuery(self.parent.db)
-                    query.prepare(
+                    query = statements(self.parent.db).prepare(
                         "DELETE FROM friends WHERE idFriend = (SELECT id FROM login WHERE login.login = ?) AND idUser = ?")
                     query.addBindValue(friend)
                     query.addBindValue(self.uid)
@@ -1184,8 +1169,7 @@ Thanks,\n\
             if len(toAdd) > 0:
 
                 for foe in toAdd:
-                    query = QSqlQuery(self.parent.db)
-                    query.prepare(
+                    query = statements(self.parent.db).prepare(
                         "INSERT INTO foes (idUser, idFoe) values (?,(SELECT id FROM login WHERE login.login = ?))")
                     query.addBindValue(self.uid)
                     query.addBindValue(foe)
@@ -1195,8 +1179,7 @@ Thanks,\n\
 
             if len(toRemove) > 0:
                 for foe in toRemove:
-                    query = QSqlQuery(self.parent.db)
-                    query.prepare(
+                    query = statements(self.parent.db).prepare(
                         "DELETE FROM foes WHERE idFoe = (SELECT id FROM login WHERE login.login = ?) AND idUser = ?")
                     query.addBindValue(foe)
                     query.addBindValue(self.uid)
@@ -1290,6 +1273,11 @@ Thanks,\n\
                 player.lobbyThread.sendJSON(dict(command="notice", style="kick"))
                 player.lobbyThread.socket.abort()
 
+        elif action == "refresh_featured_mods" and self.player.admin:
+            changed = self.parent.games.refresh_featured_mod_versions(message.get('mod'))
+            self.sendJSON(dict(command="notice", style="info",
+                               text="Featured mod versions reloaded, changed: {}".format(", ".join(changed) or "none")))
+
         elif action == "requestavatars" and self.player.admin:
             query = QSqlQuery(self.parent.db)
             query.prepare("SELECT url, tooltip FROM `avatars_list`")
@@ -1351,9 +1339,217 @@ Thanks,\n\
                 query.addBindValue(avatar)
                 query.exec_()
 
-    @timed()
+    def negotiateFraming(self, message):
+        """
+        Switch to the framing asked for in hello, if we support it
+
+        The confirmation is the last legacy framed message the client gets.
+        Clients that don't use the ACKs for upload progress can turn them off.
+        """
+        self.acks = bool(message.get('acks', True))
+        if self.framing is not LEGACY:
+            return
+
+        capabilities = set(message.get('capabilities', []))
+        accepted = []
+        if 'batch' in capabilities:
+            self.batches = True
+            accepted.append('batch')
+        if 'delta' in capabilities:
+            self.deltaUpdates = True
+            accepted.append('delta')
+
+        # Nothing may be queued uncompressed when the deflate stream starts
+        deflate = 'deflate' in capabilities and len(self.outbound) == 0
+        if deflate:
+            accepted.append('deflate')
+
+        framing = LEGACY
+        if message.get('framing') == V2.name:
+            framing = V2
+            if 'zlib' in capabilities and not deflate:
+                framing = V2_ZLIB
+                accepted.append('zlib')
+                self.reader.compressed = True
+
+        if framing is not LEGACY or accepted:
+            reply = LEGACY.pack_message(dict(command="framing",
+                                             framing=LEGACY.name if framing is LEGACY else V2.name,
+                                             capabilities=accepted))
+            if deflate:
+                # written straight away, as the last uncompressed bytes
+                self.writeToSocket(reply)
+                self.deflater = StreamDeflater(counters=metrics.counters, prefix='lobby.deflate')
+            else:
+                self.sendArray(reply)
+            self.framing = framing
+
+    @asyncio.coroutine
+    def checkUniqueId(self, db, uniqueId):
+        """
+        Look for the steam account or other account this computer is tied to
+        :return: (whether a steam account used it, (id, login) of another account or None)
+        """
+        steamRow, rows = yield from db.gather(
+            db.fetch_one("SELECT uniqueid FROM steam_uniqueid WHERE uniqueId = ?", uniqueId),
+            db.fetch("SELECT id, login FROM login WHERE uniqueId = ? AND id != ?", uniqueId, self.uid))
+        return steamRow is not None, rows[0] if len(rows) == 1 else None
+
+    @asyncio.coroutine
+    def recordLogin(self, db, login, password, uniqueId):
+        """
+        Store the address, unique id and session of the login, and the IRC password
+        """
+        # one write of the session, so the one stored is the one we resume
+        writes = []
+        if not self.steamChecked:
+            writes.append(db.execute("UPDATE login SET ip = ?, uniqueId = ?, session = ? WHERE id = ?",
+                                     self.ip, str(uniqueId), self.session, self.uid))
+        else:
+            writes.append(db.execute("UPDATE login SET ip = ?, session = ? WHERE id = ?",
+                                     self.ip, self.session, self.uid))
+            writes.append(self.ignoreQueryError(
+                # already known, mostly
+                db.execute("INSERT INTO `steam_uniqueid`(`uniqueid`) VALUES (?)", str(uniqueId))))
+
+        m = hashlib.md5()
+        m.update(password.encode())
+        passwordmd5 = m.hexdigest()
+        m = hashlib.md5()
+        # Since the password is hashed on the client, what we get at this point is really
+        # md5(md5(sha256(password))). This is entirely insane.
+        m.update(passwordmd5.encode())
+        writes.append(self.ignoreQueryError(
+            db.execute("UPDATE anope.anope_db_NickCore SET pass = ? WHERE display = ?",
+                       "md5:" + str(m.hexdigest()), login), log=True))
+
+        yield from db.gather(*writes)
+
+    @asyncio.coroutine
+    def ignoreQueryError(self, coro, log=False):
+        try:
+            return (yield from coro)
+        except QueryError as ex:
+            if log:
+                self.log.error(ex)
+
+    @asyncio.coroutine
+    def loadClan(self, db):
+        try:
+            row = yield from db.fetch_one(
+                "SELECT `clan_tag` FROM `fafclans`.`clan_tags` LEFT JOIN `fafclans`.players_list ON `fafclans`.players_list.player_id = `fafclans`.`clan_tags`.player_id WHERE `faf_id` = ?",
+                self.uid)
+        except QueryError as ex:
+            self.log.warning(ex)
+            return None
+        return str(row[0]) if row is not None else None
+
+    @asyncio.coroutine
+    def loadPermissionGroup(self, db):
+        """
+        :return: 2 for admins, 1 for mods, None for everybody else
+        """
+        row = yield from db.fetch_one("SELECT `group` FROM `lobby_admin` WHERE `user_id` = ?", self.uid)
+        return row[0] if row is not None else None
+
+    @asyncio.coroutine
+    def loadLeague(self, db):
+        """
+        The user's league and division, and the avatar for being at the top of one
+        :return: (score, league, division, avatar or None), None if not in the ladder
+        """
+        # Naming a column `limit` was unwise.
+        row = yield from db.fetch_one(
+        "SELECT\
+          score,\
+          ladder_division.league,\
+          ladder_division.name AS division,\
+          ladder_division.limit AS `limit`\
+        FROM\
+          %s,\
+          ladder_division\
+        WHERE\
+          %s.idUser = ? AND\
+          %s.league = ladder_division.league AND\
+          ladder_division.limit >= %s.score\
+        ORDER BY ladder_division.limit ASC\
+        LIMIT 1;" % (self.season, self.season, self.season, self.season), self.uid)
+        if row is None:
+            return None
+
+        score = float(row[0])
+        league = int(row[1])
+        division = str(row[2])
+        limit = int(row[3])
+
+        if league == 1 and score == 0:
+            return score, league, division, None
+
+        divisionTop, leagueTop = yield from db.gather(
+            db.fetch("SELECT score, idUser FROM %s WHERE score <= ? and league = ? ORDER BY score DESC LIMIT 4" % self.season,
+                     limit, league),
+            db.fetch("SELECT score, idUser FROM %s  WHERE league = ? ORDER BY score DESC LIMIT 4" % self.season,
+                     league))
+
+        avatar = None
+        # being at the top of the league beats being at the top of the division
+        for rows, icon, tooltip in ((divisionTop, "div", "in my division!"),
+                                    (leagueTop, "league", "in my League!")):
+            if len(rows) < 4:
+                continue
+            for i, (topScore, idUser) in enumerate(rows[:3], 1):
+                if int(idUser) != self.uid or float(topScore) <= 0:
+                    continue
+                avatar = {
+                    "url": str(Config['global']['content_url'] + "avatars/" + icon + str(i) + ".png"),
+                    "tooltip": ["First", "Second", "Third"][i - 1] + " " + tooltip
+                }
+                break
+
+        return score, league, division, avatar
+
+    @asyncio.coroutine
+    def loadAvatar(self, db):
+        row = yield from db.fetch_one(
+            "SELECT url, tooltip FROM `avatars` LEFT JOIN `avatars_list` ON `idAvatar` = `avatars_list`.`id` WHERE `idUser` = ? AND `selected` = 1",
+            self.uid)
+        if row is not None:
+            return {"url": str(row[0]), "tooltip": str(row[1])}
+
+    @asyncio.coroutine
+    def loadSocial(self, db):
+        """
+        :return: (friends, foes, ladder map ids)
+        """
+        friends, foes, maps = yield from db.gather(
+            db.fetch("SELECT login.login FROM friends JOIN login ON idFriend=login.id WHERE idUser = ?", self.uid),
+            db.fetch("SELECT login.login FROM foes JOIN login ON idFoe=login.id WHERE idUser = ?", self.uid),
+            db.fetch("SELECT idMap FROM ladder_map_selection WHERE idUser = ?", self.uid))
+        return ([str(friend) for friend, in friends],
+                [str(foe) for foe, in foes],
+                [int(idMap) for idMap, in maps])
+
+    @asyncio.coroutine
+    def logHostname(self):
+        hostname = yield from self.parent.resolver.resolve(self.ip)
+        self.log.debug(self.logPrefix + "connected from {}".format(hostname or self.ip))
+
+    @asyncio.coroutine
     def command_hello(self, message):
+        """
+        Log a user in
+
+        In stages, each waiting for the round trips of the previous one, and
+        each running its own queries concurrently: authenticate, check the
+        account may log in from here, then record the login while loading
+        the profile, and finally welcome the user. Stage durations go to the
+        login.* metrics.
+        """
+        db = self.parent.db_pool
+        watch = metrics.Stopwatch('login')
         try:
+            self.negotiateFraming(message)
+
             version = message['version']
             login = message['login'].strip()
             password = message['password']
@@ -1368,14 +1564,17 @@ Thanks,\n\
                     dict(command="notice", style="error", text="We are not able to log you. Try updating your lobby."))
                 self.log.info(self.logPrefix + "unable to decypher !!")
 
-            query = QSqlQuery(self.parent.db)
-            queryStr = "SELECT version, file FROM version_lobby ORDER BY id DESC LIMIT 1"
-            query.exec_(queryStr)
+            ## AUTHENTICATE
+            ## --------------------
+            # TODO: Hash passwords server-side so the hashing actually *does* something.
+            row, rows = yield from db.gather(
+                db.fetch_one("SELECT version, file FROM version_lobby ORDER BY id DESC LIMIT 1"),
+                db.fetch("SELECT id, validated, email, steamchecked, session FROM login WHERE login = ? AND password = ?",
+                         login, password))
+            watch.lap('authenticate')
 
-            if query.size() == 1:
-                query.first()
-                versionDB = query.value(0)
-                file = query.value(1)
+            if row is not None:
+                versionDB, file = row
 
                 # Version of zero represents a developer build.
                 if version < versionDB and version != 0:
@@ -1385,27 +1584,17 @@ Thanks,\n\
             self.logPrefix = login + "\t"
 
             channels = []
-            query = QSqlQuery(self.parent.db)
-
-            # TODO: Hash passwords server-side so the hashing actually *does* something.
-            query.prepare(
-                "SELECT id, validated, email, steamchecked, session FROM login WHERE login = ? AND password = ?")
-            query.addBindValue(login)
-            query.addBindValue(password)
-            query.exec_()
 
-            if query.size() != 1:
+            if len(rows) != 1:
                 self.sendJSON(dict(command="notice", style="error",
                                    text="Login not found or password incorrect. They are case sensitive."))
                 return
 
-            query.first()
-
-            self.uid = int(query.value(0))
-            validated = query.value(1)
-            self.email = str(query.value(2))
-            self.steamChecked = int(query.value(3))
-            session = int(query.value(4))
+            uid, validated, email, steamChecked, session = rows[0]
+            self.uid = int(uid)
+            self.email = str(email)
+            self.steamChecked = int(steamChecked)
+            session = int(session)
 
             if validated == 0:
                 reason = "Your account is not validated. Please visit <a href='" + Config['global'][
@@ -1418,32 +1607,27 @@ Thanks,\n\
 
             if session != 0:
                 #remove ghost
-                for p in self.parent.listUsers.players:
-                    if p.getLogin() == login:
-                        if p.lobbyThread.socket:
-                            p.lobbyThread.socket.abort()
-                        if p in self.parent.listUsers.players:
-                            self.parent.listUsers.players.remove(p)
-
-                for p in self.parent.listUsers.logins:
-                    if p == login:
-                        self.parent.listUsers.players.remove(p)
+                ghost = self.parent.listUsers.findByName(login)
+                if ghost:
+                    if ghost.lobbyThread is not None and ghost.lobbyThread.socket:
+                        ghost.lobbyThread.socket.abort()
+                    self.parent.removePlayer(ghost)
 
                 if session == oldsession:
                     self.session = oldsession
-                else:
-                    query2 = QSqlQuery(self.parent.db)
-                    query2.prepare("UPDATE login SET session = ? WHERE id = ?")
-                    query2.addBindValue(session)
-                    query2.addBindValue(int(self.uid))
-                    query2.exec_()
 
-            query.prepare("SELECT reason FROM lobby_ban WHERE idUser = ?")
-            query.addBindValue(self.uid)
-            query.exec_()
-            if query.size() == 1:
-                query.first()
-                reason = "You are banned from FAF.\n Reason :\n " + query.value(0)
+            ## CHECKS
+            ## --------------------
+            checks = [db.fetch("SELECT reason FROM lobby_ban WHERE idUser = ?", self.uid)]
+            if not self.steamChecked and uniqueId is not None:
+                # the user is not steam Checked.
+                checks.append(self.checkUniqueId(db, uniqueId))
+            results = yield from db.gather(*checks)
+            watch.lap('checks')
+
+            rows = results[0]
+            if len(rows) == 1:
+                reason = "You are banned from FAF.\n Reason :\n " + rows[0][0]
                 self.sendJSON(dict(command="notice", style="error", text=reason))
                 return
 
@@ -1454,30 +1638,19 @@ Thanks,\n\
                                             Config['global']['app_url'] + "faf/steam.php'>" + Config['global'][
                                                 'app_url'] + "faf/steam.php</a>"))
                     return
-                    # the user is not steam Checked.
-                query = QSqlQuery(self.parent.db)
-                query.prepare("SELECT uniqueid FROM steam_uniqueid WHERE uniqueId = ?")
-                query.addBindValue(uniqueId)
-                query.exec_()
-                if query.size() > 0:
+
+                usedBySteam, smurf = results[1]
+                if usedBySteam:
                     self.sendJSON(dict(command="notice", style="error",
                                        text="This computer has been used by a steam account.<br>You have to authentify your account on steam too in order to use it on this computer :<br>SteamLink: <a href='" +
                                             Config['global']['app_url'] + "faf/steam.php'>" + Config['global'][
                                                 'app_url'] + "faf/steam.php</a>"))
                     return
 
-                # check for another account using the same uniqueId as us.
-                query = QSqlQuery(self.parent.db)
-                query.prepare("SELECT id, login FROM login WHERE uniqueId = ? AND id != ?")
-                query.addBindValue(uniqueId)
-                query.addBindValue(self.uid)
-                query.exec_()
-
-                if query.size() == 1:
-                    query.first()
-
-                    idFound = int(query.value(0))
-                    otherName = str(query.value(1))
+                # another account using the same uniqueId as us.
+                if smurf is not None:
+                    idFound = int(smurf[0])
+                    otherName = str(smurf[1])
 
                     self.log.debug("%i (%s) is a smurf of %s" % (self.uid, login, otherName))
                     self.sendJSON(dict(command="notice", style="error",
@@ -1486,48 +1659,10 @@ Thanks,\n\
                                             Config['global']['app_url'] + "faf/steam.php</a>" % (
                                            otherName, otherName)))
 
-                    query2 = QSqlQuery(self.parent.db)
-                    query2.prepare("INSERT INTO `smurf_table`(`origId`, `smurfId`) VALUES (?,?)")
-                    query2.addBindValue(self.uid)
-                    query2.addBindValue(idFound)
-                    query2.exec_()
+                    yield from db.execute("INSERT INTO `smurf_table`(`origId`, `smurfId`) VALUES (?,?)",
+                                          self.uid, idFound)
                     return
 
-                query = QSqlQuery(self.parent.db)
-                query.prepare("UPDATE login SET ip = ?, uniqueId = ?, session = ? WHERE id = ?")
-                query.addBindValue(self.ip)
-                query.addBindValue(str(uniqueId))
-                query.addBindValue(self.session)
-                query.addBindValue(self.uid)
-                query.exec_()
-            else:
-                # the user is steamchecked
-                query = QSqlQuery(self.parent.db)
-                query.prepare("UPDATE login SET ip = ?, session = ? WHERE id = ?")
-                query.addBindValue(self.ip)
-                query.addBindValue(self.session)
-                query.addBindValue(self.uid)
-                query.exec_()
-
-                query = QSqlQuery(self.parent.db)
-                query.prepare("INSERT INTO `steam_uniqueid`(`uniqueid`) VALUES (?)")
-                query.addBindValue(str(uniqueId))
-                query.exec_()
-
-            query = QSqlQuery(self.parent.db)
-            query.prepare("UPDATE anope.anope_db_NickCore SET pass = ? WHERE display = ?")
-            m = hashlib.md5()
-            m.update(password.encode())
-            passwordmd5 = m.hexdigest()
-            m = hashlib.md5()
-            # Since the password is hashed on the client, what we get at this point is really
-            # md5(md5(sha256(password))). This is entirely insane.
-            m.update(passwordmd5.encode())
-            query.addBindValue("md5:" + str(m.hexdigest()))
-            query.addBindValue(login)
-            if not query.exec_():
-                self.log.error(query.lastError())
-
             self.player = Player(str(login),
                                  self.session,
                                  self.ip,
@@ -1539,42 +1674,34 @@ Thanks,\n\
 
             self.player.faction = random.randint(1, 4)
 
-            try:
-                hostname = socket.getfqdn(self.player.getIp())
-                try:
-                    socket.gethostbyname(hostname)
-                    self.player.resolvedAddress = self.player.getIp()
-                except:
-                    self.player.resolvedAddress = self.player.getIp()
-
-            except:
-                self.player.resolvedAddress = self.player.getIp()
-
-            ## Clan informations
-            query = QSqlQuery(self.parent.db)
-            query.prepare(
-                "SELECT `clan_tag` FROM `fafclans`.`clan_tags` LEFT JOIN `fafclans`.players_list ON `fafclans`.players_list.player_id = `fafclans`.`clan_tags`.player_id WHERE `faf_id` = ?")
-            query.addBindValue(self.uid)
-            if not query.exec_():
-                self.log.warning(query.lastError())
-            if query.size() > 0:
-                query.first()
-                self.player.clan = str(query.value(0))
+            ## Country
+            ## ----------
+            country = gi.country_name_by_addr(self.socket.peerAddress().toString())
+            if country is not None:
+                self.player.country = str(country)
 
+            ## PROFILE
+            ## --------------------
+            ratings = self.parent.games.ratings
+            _, _, clan, permissionGroup, leagueInfo, avatar, social = yield from db.gather(
+                self.recordLogin(db, login, password, uniqueId),
+                ratings.load(db, [self.uid]),
+                self.loadClan(db),
+                self.loadPermissionGroup(db),
+                self.loadLeague(db),
+                self.loadAvatar(db),
+                self.loadSocial(db))
+            watch.lap('profile')
+
+            ratings.apply(self.player)
+
+            if clan is not None:
+                self.player.clan = clan
 
             ## ADMIN
-            ## --------------------
             self.player.admin = False
             self.player.mod = False
-            query.prepare("SELECT `group` FROM `lobby_admin` WHERE `user_id` = ?")
-            query.addBindValue(self.uid)
-            query.exec_()
-
-            if query.size() > 0:
-                query.first()
-                # 2 for admins, 1 for mods.
-                permissionGroup = query.value(0)
-
+            if permissionGroup is not None:
                 if permissionGroup >= 2:
                     self.player.admin = True
                 if permissionGroup >= 1:
@@ -1582,140 +1709,37 @@ Thanks,\n\
 
                 self.sendJSON({"command": "social", "power": permissionGroup})
 
-            ## Country
-            ## ----------
-
-            country = gi.country_name_by_addr(self.socket.peerAddress().toString())
-            if country is not None:
-                self.player.country = str(country)
-
-
             ## LADDER LEAGUES ICONS
-            ## ----------------------
             # If a user is top of their division or league, set their avatar appropriately.
-            #
-
-            # Query to extract the user's league and divison info.
-            # Naming a column `limit` was unwise.
-            query.prepare(
-            "SELECT\
-              score,\
-              ladder_division.league,\
-              ladder_division.name AS division,\
-              ladder_division.limit AS `limit`\
-            FROM\
-              %s,\
-              ladder_division\
-            WHERE\
-              %s.idUser = ? AND\
-              %s.league = ladder_division.league AND\
-              ladder_division.limit >= %s.score\
-            ORDER BY ladder_division.limit ASC\
-            LIMIT 1;" % (self.season, self.season, self.season, self.season))
-            query.addBindValue(self.player.id)
-            query.exec_()
-            if query.size() > 0:
-                query.first()
-                score = float(query.value(0))
-                league = int(query.value(1))
+            if leagueInfo is not None:
+                score, league, division, leagueAvatar = leagueInfo
                 self.player.league = league
-                self.player.division = str(query.value(2))
-                limit = int(query.value(3))
-
-                cancontinue = True
-                if league == 1 and score == 0:
-                    cancontinue = False
-
-                if cancontinue:
-                    # check if top of the division :
-                    query.prepare(
-                        "SELECT score, idUser FROM %s WHERE score <= ? and league = ? ORDER BY score DESC" % self.season)
-                    query.addBindValue(limit)
-                    query.addBindValue(league)
-                    #query.addBindValue(self.player.getId())
-                    query.exec_()
-
-                    if query.size() >= 4:
-                        query.first()
-                        for i in range(1, 4):
-
-                            score = float(query.value(0))
-                            idUser = int(query.value(1))
-
-                            if idUser != self.player.id or score <= 0:
-                                query.next()
-                                continue
-
-                            avatar = {
-                                "url": str(Config['global']['content_url'] + "avatars/div" + str(i) + ".png")
-                            }
-                            if i == 1:
-                                avatar.tooltip = "First in my division!"
-                            elif i == 2:
-                                avatar.tooltip = "Second in my division!"
-                            elif i == 3:
-                                avatar.tooltip = "Third in my division!"
-
-                            self.player.avatar = avatar
-                            self.leagueAvatar = avatar
-
-                            break
-
-                    # check if top of the league :
-                    query.prepare(
-                        "SELECT score, idUser FROM %s  WHERE league = ? ORDER BY score DESC" % self.season)
-                    query.addBindValue(league)
-                    query.exec_()
-                    if query.size() >= 4:
-                        query.first()
-                        for i in range(1, 4):
-                            score = float(query.value(0))
-                            idUser = int(query.value(1))
-
-                            if idUser != self.player.id or score <= 0:
-                                query.next()
-                                continue
-
-                            avatar = {
-                                "url": str(Config['global']['content_url'] + "avatars/league" + str(i) + ".png")
-                            }
-                            if i == 1:
-                                avatar.tooltip = "First in my League!"
-                            elif i == 2:
-                                avatar.tooltip = "Second in my League!"
-                            elif i == 3:
-                                avatar.tooltip = "Third in my League!"
-
-                            self.player.avatar = avatar
-                            self.leagueAvatar = avatar
-                            break
-
-                    jleague = {"league": self.player.league, "division": self.player.division}
-                    self.player.leagueInfo = jleague
+                self.player.division = division
+                if leagueAvatar is not None:
+                    self.player.avatar = leagueAvatar
+                    self.leagueAvatar = leagueAvatar
+                if not (league == 1 and score == 0):
+                    self.player.leagueInfo = {"league": league, "division": division}
 
             ## AVATARS
-            ## -------------------
-            query.prepare(
-                "SELECT url, tooltip FROM `avatars` LEFT JOIN `avatars_list` ON `idAvatar` = `avatars_list`.`id` WHERE `idUser` = ? AND `selected` = 1")
-            query.addBindValue(self.uid)
-            query.exec_()
-            if query.size() > 0:
-                query.first()
-                avatar = {"url": str(query.value(0)), "tooltip": str(query.value(1))}
+            if avatar is not None:
                 self.player.avatar = avatar
 
-            for p in self.parent.listUsers.players:
-                if p.login == self.player.login:
-                    if hasattr(p, 'lobbyThread'):
-                        p.lobbyThread.command_quit_team(dict(command="quit_team"))
-                        p.lobbyThread.socket.abort()
-
-                    if p in self.parent.listUsers.players:
-                        self.parent.listUsers.players.remove(p)
+            if self.noSocket:
+                # gone while we were waiting for the database, the store
+                # keeps the ratings of the players online only
+                if self.parent.listUsers.findById(self.uid) is None:
+                    ratings.forget(self.uid)
+                return
 
-            for p in self.parent.listUsers.logins:
-                if p == self.player.getLogin():
-                    self.parent.listUsers.logins.remove(p)
+            ## WELCOME
+            ## --------------------
+            ghost = self.parent.listUsers.findByName(self.player.getLogin())
+            if ghost:
+                if ghost.lobbyThread is not None:
+                    ghost.lobbyThread.command_quit_team(dict(command="quit_team"))
+                    ghost.lobbyThread.socket.abort()
+                self.parent.removePlayer(ghost)
 
             gameSocket, lobbySocket = self.parent.listUsers.addUser(self.player)
 
@@ -1728,63 +1752,60 @@ Thanks,\n\
                 lobbySocket.abort()
 
             self.log.debug("Welcome")
-            self.sendJSON(dict(command="welcome", email=str(self.email)))
+            if self.log.isEnabledFor(logging.DEBUG):
+                # nothing else needs the host name, don't wait for it
+                asyncio.ensure_future(self.logHostname(), loop=self.loop)
+            # Clients taking deltas that were here moments ago only get what they missed
+            missed = None
+            lastSession = self.parent.closedSessions.pop(self.uid, None)
+            if self.deltaUpdates and oldsession is not None and oldsession in (self.session, lastSession):
+                resume = message.get('resume') or {}
+                missed = self.parent.deltas.changed_since(resume.get('epoch'), resume.get('seq'))
+
+            self.sendJSON(dict(command="welcome", email=str(self.email),
+                               epoch=self.parent.deltas.epoch, seq=self.parent.deltas.seq,
+                               resumed=missed is not None))
 
             tourneychannel = self.getPlayerTournament(self.player)
             if len(tourneychannel) > 0:
                 channels = channels + tourneychannel
 
-            reply = QByteArray()
-            for user in self.parent.listUsers.players:
-                reply.append(self.prepareBigJSON(self.parent.parent.jsonPlayer(user)))
+            if missed is None:
+                messages = []
+                for user in self.parent.listUsers:
+                    snapshot = self.parent.deltas.snapshot(("player_info", user.getLogin()))
+                    if self.deltaUpdates and snapshot is not None:
+                        messages.append(snapshot.full())
+                    else:
+                        messages.append(self.parent.parent.jsonPlayer(user))
 
-            self.sendArray(reply)
+                self.sendJSONBatch(messages)
 
-            query = QSqlQuery(self.parent.db)
-            query.prepare(
-                "SELECT login.login FROM friends JOIN login ON idFriend=login.id WHERE idUser = ?")
-            query.addBindValue(self.uid)
-            query.exec_()
-
-            if query.size() > 0:
-                while query.next():
-                    self.friendList.append(str(query.value(0)))
+            friends, foes, ladderMaps = social
+            if friends:
+                self.friendList.extend(friends)
 
                 jsonToSend = {"command": "social", "friends": self.friendList}
                 self.sendJSON(jsonToSend)
 
-            query = QSqlQuery(self.parent.db)
-            query.prepare("SELECT idMap FROM ladder_map_selection WHERE idUser = ?")
-            query.addBindValue(self.uid)
-            query.exec_()
-            if query.size() > 0:
-                while query.next():
-                    self.ladderMapList.append(int(query.value(0)))
+            self.ladderMapList.extend(ladderMaps)
 
-            query = QSqlQuery(self.parent.db)
-            query.prepare(
-                "SELECT login.login FROM foes JOIN login ON idFoe=login.id WHERE idUser = ?")
-            query.addBindValue(self.uid)
-            query.exec_()
-            if query.size() > 0:
-                while query.next():
-                    self.foeList.append(str(query.value(0)))
+            if foes:
+                self.foeList.extend(foes)
 
                 jsonToSend = {"command": "social", "foes": self.foeList}
                 self.sendJSON(jsonToSend)
 
-            self.sendModList()
-            self.sendGameList()
-            self.sendReplaySection()
+            if missed is None:
+                self.sendModList()
+                self.sendGameList()
+                self.sendReplaySection()
+            else:
+                self.log.debug(self.logPrefix + "resuming session, {} updates missed".format(len(missed)))
+                self.sendMissedUpdates(missed)
 
             self.log.debug("sending new player")
-            for user in self.parent.listUsers.players:
-
-                if user.getLogin() != str(login):
-
-                    lobby = user.lobbyThread
-                    if lobby is not None:
-                        lobby.sendJSON(self.parent.parent.jsonPlayer(self.player))
+            self.parent.sendPlayerInfo(self.player, full=True)
 
             if self.player.mod:
                 channels.append("#moderators")
@@ -1847,6 +1868,10 @@ Thanks,\n\
                     self.pingTimer.stop()
                     self.pingTimer.start(61000)
 
+            watch.lap('welcome')
+            total = watch.stop()
+            if total >= 0.2:
+                self.log.info(self.logPrefix + "login took {:.3f}s: {}".format(total, watch))
             self.log.debug("done")
         except Exception as ex:
             self.log.exception(ex)
@@ -1886,8 +1911,7 @@ Thanks,\n\
             self.initTimer = None
 
         if self in self.parent.recorders:
-            self.pingTimer = QTimer(self)
-            self.pingTimer.timeout.connect(self.ping)
+            self.pingTimer = Timer(self.ping, loop=self.parent.loop)
             self.pingTimer.start(31000)
 
         self.sendJSON(jsonToSend)
@@ -1952,6 +1976,7 @@ Thanks,\n\
             else:
                 self.sendJSON(dict(command="notice", style="info", text="Database updated correctly."))
 
+                self.parent.games.refresh_featured_mod_versions(mod)
                 self.sendModFiles(mod)
 
         if action == "list":
@@ -2043,8 +2068,10 @@ Thanks,\n\
 
         self.joinGame(uuid, gameport, password)
 
+    @asyncio.coroutine
     def check_cheaters(self):
         """ When someone is cancelling a ladder game on purpose..."""
+        db = self.parent.db_pool
         game = self.player.getGame()
         if game:
             realGame = self.parent.games.find_by_id(self.player.getGame())
@@ -2053,20 +2080,14 @@ Thanks,\n\
                     # player has a laddergame that isn't playing, so we suspect he is a canceller....
                     self.log.debug("Having a ladder and cancelling it...")
 
-                    query = QSqlQuery(self.parent.db)
-                    query.prepare("UPDATE `login` SET `ladderCancelled`= `ladderCancelled`+1  WHERE id = ?")
-                    query.addBindValue(self.uid)
-                    query.exec_()
+                    self.parent.games.counters.incr(LADDER_CANCELLED, self.uid)
 
             else:
                 self.log.debug("No real game found...")
 
-            query = QSqlQuery(self.parent.db)
-            query.prepare("SELECT `ladderCancelled` FROM `login` WHERE id = ?")
-            query.addBindValue(self.uid)
-            query.exec_()
-            if query.size() != 0:
-                attempts = query.value(0)
+            row = yield from db.fetch_one("SELECT `ladderCancelled` FROM `login` WHERE id = ?", self.uid)
+            if row is not None:
+                attempts = (row[0] or 0) + self.parent.games.counters.pending(LADDER_CANCELLED, self.uid)
                 if attempts:
                     if attempts >= 10:
                         return False
@@ -2076,6 +2097,7 @@ Thanks,\n\
         return True
 
     @timed
+    @asyncio.coroutine
     def command_game_matchmaking(self, message):
 
         mod = message.get('mod', 'matchmaker')
@@ -2083,21 +2105,23 @@ Thanks,\n\
 
         if mod == "ladder1v1" and state == "start":
 
-            if not self.check_cheaters():
+            allowed = yield from self.check_cheaters()
+            if not allowed:
                 self.sendJSON(dict(command="notice", style="error",
                                    text="You are banned from the matchmaker (cancelling too many times). Please contact an admin."))
                 return
 
-        query = QSqlQuery(self.parent.db)
-        query.prepare(
-            "SELECT * FROM matchmaker_ban WHERE `userid` = (SELECT `id` FROM `login` WHERE `login`.`login` = ?)")
-        query.addBindValue(self.player.getLogin())
-        query.exec_()
-        if query.size() != 0:
+        rows = yield from self.parent.db_pool.fetch(
+            "SELECT * FROM matchmaker_ban WHERE `userid` = (SELECT `id` FROM `login` WHERE `login`.`login` = ?)",
+            self.player.getLogin())
+        if rows:
             self.sendJSON(dict(command="notice", style="error",
                                text="You are banned from the matchmaker. Contact an admin to have the reason."))
             return
 
+        if self.noSocket:
+            return
+
         self.checkOldGamesFromPlayer()
 
         container = self.parent.games.getContainer(mod)
@@ -2106,14 +2130,14 @@ Thanks,\n\
 
             if mod == "ladder1v1":
                 if state == "stop":
-                    for player in self.parent.listUsers.players:
+                    for player in self.parent.listUsers:
                         player.lobbyThread.removePotentialPlayer(self.player.getLogin())
 
                 elif state == "start":
                     gameport = message['gameport']
                     faction = message['faction']
 
-                    container.removeOldGames()
+                    self.parent.games.expire_games()
                     self.player.setGamePort(gameport)
                     container.addPlayer(self.season, self.player)
                     container.searchForMatchup(self.player)
@@ -2213,7 +2237,7 @@ Thanks,\n\
             self.warned = False
 
     def warnPotentialOpponent(self):
-        for player in self.parent.listUsers.players:
+        for player in self.parent.listUsers:
             if player == self.player:
                 continue
                 #minimum game quality to start a match.
@@ -2277,6 +2301,7 @@ Thanks,\n\
 
     def command_modvault(self, message):
         type = message["type"]
+        counters = self.parent.games.counters
         if type == "start":
             query = QSqlQuery(self.parent.db)
             query.prepare("SELECT * FROM table_mod ORDER BY likes DESC LIMIT 0, 100")
@@ -2291,9 +2316,9 @@ Thanks,\n\
                     isbigmod = int(query.value(6))
                     issmallmod = int(query.value(7))
                     date = query.value(8).toTime_t()
-                    downloads = int(query.value(9))
+                    downloads = int(query.value(9)) + counters.pending(MOD_DOWNLOADS, uid)
                     likes = int(query.value(10))
-                    played = int(query.value(11))
+                    played = int(query.value(11)) + counters.pending(MOD_PLAYED, uid)
                     description = str(query.value(12))
                     comments = []
                     bugreports = []
@@ -2329,9 +2354,9 @@ Thanks,\n\
                 isbigmod = int(query.value(6))
                 issmallmod = int(query.value(7))
                 date = query.value(8).toTime_t()
-                downloads = int(query.value(9))
+                downloads = int(query.value(9)) + counters.pending(MOD_DOWNLOADS, uid)
                 likes = int(query.value(10))
-                played = int(query.value(11))
+                played = int(query.value(11)) + counters.pending(MOD_PLAYED, uid)
                 description = str(query.value(12))
                 comments = []
                 bugreports = []
@@ -2361,16 +2386,14 @@ Thanks,\n\
                     query.addBindValue(json.dumps(likers))
                     query.addBindValue(uid)
                     query.exec_()
+                    self.parent.games.mod_cache.invalidate(uid)
                     self.sendJSON(out)
 
 
 
         elif type == "download":
             uid = message["uid"]
-            query = QSqlQuery(self.parent.db)
-            query.prepare("UPDATE `table_mod` SET downloads=downloads+1 WHERE uid = ?")
-            query.addBindValue(uid)
-            query.exec_()
+            counters.incr(MOD_DOWNLOADS, uid)
             # TODO: add response message
 
         elif type == "addcomment":
@@ -2379,15 +2402,44 @@ Thanks,\n\
         else:
             raise ValueError('invalid type argument')
 
-    def prepareBigJSON(self, data_dictionary):
+    @staticmethod
+    def prepareBigJSON(data_dictionary):
         """
-        Simply dumps a dictionary into a string and feeds it into the QTCPSocket
+        Simply dumps a dictionary into a string and frames it for the QTCPSocket
         """
         try:
-            data_string = json.dumps(data_dictionary)
+            return LEGACY.pack_message(data_dictionary)
         except:
             return
-        return self.preparePacket(data_string)
+
+    @staticmethod
+    def coalesceKey(data_dictionary):
+        """
+        Key under which a queued message may be superseded by a newer one
+        :return: tuple or None
+        """
+        command = data_dictionary.get("command")
+        if command == "game_info":
+            return command, data_dictionary.get("uid")
+        elif command == "player_info":
+            return command, data_dictionary.get("login")
+        return None
+
+    @timed()
+    def sendJSONBatch(self, messages, batch_size=500):
+        """
+        Send many messages at once, as batches if the client understands them
+        :param messages: list of message dictionaries
+        :param batch_size: most messages to put in one batch
+        """
+        if not messages or self.noSocket:
+            return
+
+        if self.batches:
+            for start in range(0, len(messages), batch_size):
+                self.sendArray(self.framing.pack_batch(messages[start:start + batch_size]))
+        else:
+            self.sendArray(b''.join(self.framing.pack_message(message) for message in messages))
 
     @timed()
     def sendJSON(self, data_dictionary):
@@ -2397,48 +2449,75 @@ Thanks,\n\
         if "command" in data_dictionary:
             if data_dictionary["command"] == "game_launch":
                 # if we join a game, we are not a potential player anymore
-                for player in self.parent.listUsers.players:
+                for player in self.parent.listUsers:
                     player.lobbyThread.removePotentialPlayer(self.player.getLogin())
 
         if not self.noSocket:
             try:
-                data_string = json.dumps(data_dictionary)
-
-                if not self.noSocket:
-                    self.sendReply(data_string)
+                self.sendArray(self.framing.pack_message(data_dictionary), self.coalesceKey(data_dictionary))
             except:
                 return
 
+    def sendMissedUpdates(self, keys):
+        """
+        Current state of the games and players that changed while the client was away
+        """
+        messages = []
+        for key in keys:
+            snapshot = self.parent.deltas.snapshot(key)
+            if snapshot is not None:
+                messages.append(snapshot.full())
+            elif key[0] == "game_info":
+                messages.append(self.parent.closedGameInfo(key[1]))
+            elif key[0] == "player_info":
+                messages.append(self.parent.departedPlayerInfo(key[1]))
+        self.sendJSONBatch(messages)
+
     @timed()
-    def receiveJSON(self, data_string, stream):
+    def command_resync(self, message):
         """
-        A fairly pythonic way to process received strings as JSON messages.
+        Full state of games and players, for clients taking deltas that missed one
+
+        Without uids or logins, everything is sent again.
         """
-        try:
-            message = json.loads(data_string)
-            cmd = message['command']
-            if not isinstance(cmd, str):
-                raise ValueError("Command is not a string")
-            getattr(self, 'command_{}'.format(cmd))(message)
-        except (KeyError, ValueError) as ex:
-            self.log.warning("Garbage input from client: {}".format(data_string))
-            self.log.exception(ex)
+        keys = [("game_info", uid) for uid in message.get('uids', [])]
+        keys += [("player_info", login) for login in message.get('logins', [])]
+        if not keys:
+            keys = self.parent.deltas.keys()
+
+        snapshots = (self.parent.deltas.snapshot(key) for key in keys)
+        self.sendJSONBatch([snapshot.full() for snapshot in snapshots if snapshot is not None])
+
+    def command_ping(self, message):
+        self.sendJSON(dict(command="pong"))
+
+    def command_pong(self, message):
+        self.ponged = True
 
     def done(self):
         if self.uid:
+            # lets the client resume this session if it comes back soon
+            self.parent.rememberSession(self.uid, self.session)
+
             query = QSqlQuery(self.parent.db)
             query.prepare("UPDATE login SET session = NULL WHERE id = ?")
             query.addBindValue(self.uid)
             query.exec_()
 
         self.noSocket = True
+        self.parent.recorders.mark_closing(self)
+        self.outbound.clear()
+        if self.deflater is not None:
+            self.log.debug(self.logPrefix + "deflate: {} bytes in, {} out ({:.0%}), {:.3f}s CPU".format(
+                self.deflater.bytes_in, self.deflater.bytes_out, self.deflater.ratio, self.deflater.cpu_time))
         if self.player:
             self.command_quit_team(dict(command="quit_team"))
 
-            for player in self.parent.listUsers.players:
+            for player in self.parent.listUsers:
                 player.lobbyThread.removePotentialPlayer(self.player.getLogin())
             self.checkOldGamesFromPlayer()
-            self.parent.listUsers.removeUser(self.player)
+            if self.parent.removePlayer(self.player):
+                self.parent.games.ratings.forget(self.player.id)
 
         if self in self.parent.recorders:
             if self.pingTimer:
@@ -2446,6 +2525,7 @@ Thanks,\n\
 
             if self.socket:
                 self.socket.readyRead.disconnect(self.readData)
+                self.socket.bytesWritten.disconnect(self.flushOutbound)
                 self.socket.disconnected.disconnect(self.disconnection)
                 self.socket.error.disconnect(self.displayError)
                 self.socket.abort()
@@ -0,0 +1,150 @@
+import asyncio
+from collections import namedtuple
+import os
+
+from src import metrics
+from src.db_pool import fetch_rows
+from src.decorators import with_logger
+
+MapInfo = namedtuple('MapInfo', ['id', 'name', 'filename', 'ranked'])
+
+
+def map_keys(filename):
+    """
+    Names games know a map file by, like the '%/<name>.%' the queries used to match:
+    the file name without .zip, and without its version
+
+    >>> map_keys('maps/SCMP_007.v0003.zip')
+    ['scmp_007.v0003', 'scmp_007']
+    """
+    name = os.path.basename(filename).lower()
+    if name.endswith('.zip'):
+        name = name[:-len('.zip')]
+    unversioned = name.split('.', 1)[0]
+    return [name] if unversioned == name else [name, unversioned]
+
+
+@with_logger
+class MapCatalogue():
+    """
+    The vault's maps and coop missions, indexed by id and by name
+
+    Replaces matching filenames with LIKE, which scans table_map, whenever
+    a game needs its map. Loaded in full at startup and reloaded now and
+    then, maps uploaded through the lobby are added as they come.
+
+    Several versions of a map share their unversioned name, find gives the
+    oldest one, as the LIKE queries did. A versioned name only finds that
+    version. A name that isn't in the catalogue is looked up
+    once by lookup, then remembered as missing until the next reload.
+    """
+    def __init__(self):
+        self._by_id = {}
+        # name -> list of MapInfo, by id
+        self._by_name = {}
+        # name -> coop mission id
+        self._coop = {}
+        self._missing = set()
+        self.loaded = False
+
+    @staticmethod
+    def fetch(db):
+        """
+        Read the catalogue, on any thread
+        :return: (map rows, coop rows) to pass to index
+        """
+        maps = fetch_rows(db, "SELECT table_map.id, name, filename, table_map_unranked.id IS NULL "
+                              "FROM table_map LEFT JOIN table_map_unranked ON table_map_unranked.id = table_map.id")
+        coop = fetch_rows(db, "SELECT id, filename FROM coop_map")
+        return maps, coop
+
+    def index(self, maps, coop):
+        """
+        Replace the catalogue with rows from fetch
+        """
+        by_id = {}
+        by_name = {}
+        for id, name, filename, ranked in sorted(maps):
+            info = MapInfo(int(id), str(name), str(filename), bool(ranked))
+            by_id[info.id] = info
+            for key in map_keys(info.filename):
+                by_name.setdefault(key, []).append(info)
+        coop_missions = {}
+        for id, filename in sorted(coop, reverse=True):
+            for key in map_keys(str(filename)):
+                coop_missions[key] = int(id)
+
+        self._by_id, self._by_name, self._coop = by_id, by_name, coop_missions
+        self._missing = set()
+        self.loaded = True
+        self._logger.info("{} maps, {} coop missions".format(len(by_id), len(coop_missions)))
+
+    def load(self, db):
+        self.index(*self.fetch(db))
+
+    @asyncio.coroutine
+    def reload(self, db_pool):
+        maps, coop = yield from db_pool.run(self.fetch)
+        self.index(maps, coop)
+
+    def add(self, id, name, filename, ranked=True):
+        """
+        Add a map that was just uploaded
+        """
+        info = MapInfo(int(id), name, filename, ranked)
+        self._by_id[info.id] = info
+        for key in map_keys(filename):
+            versions = [v for v in self._by_name.get(key, []) if v.id != info.id]
+            self._by_name[key] = sorted(versions + [info])
+            self._missing.discard(key)
+        return info
+
+    def get(self, map_id):
+        """
+        :return: MapInfo, None if unknown
+        """
+        return self._by_id.get(map_id)
+
+    def find(self, mapname):
+        """
+        :return: MapInfo of the oldest version of the map, None if unknown
+        """
+        versions = self._by_name.get(mapname.lower())
+        return versions[0] if versions else None
+
+    def versions(self, mapname):
+        """
+        :return: list of MapInfo of every version of the map
+        """
+        return list(self._by_name.get(mapname.lower(), []))
+
+    def coop_mission(self, mapname):
+        """
+        :return: id of the coop mission played on the map, None if it isn't one
+        """
+        return self._coop.get(mapname.lower())
+
+    @asyncio.coroutine
+    def lookup(self, db_pool, mapname):
+        """
+        find, looking in the database for maps not in the catalogue
+        """
+        key = mapname.lower()
+        info = self.find(key)
+        if info is not None or key in self._missing:
+            metrics.incr('map_catalogue.hits')
+            return info
+
+        metrics.incr('map_catalogue.misses')
+        rows = yield from db_pool.fetch(
+            "SELECT table_map.id, name, filename, table_map_unranked.id IS NULL "
+            "FROM table_map LEFT JOIN table_map_unranked ON table_map_unranked.id = table_map.id "
+            "WHERE filename LIKE ?", "%/{}.%".format(key))
+        for id, name, filename, ranked in rows:
+            self.add(id, str(name), str(filename), bool(ranked))
+        if not rows:
+            self._missing.add(key)
+        return self.find(key)
+
+    def __len__(self):
+        return len(self._by_id)
@@ -0,0 +1,83 @@
+"""
+Process wide counters, for things we want to keep an eye on in production.
+
+>>> from src import metrics
+>>> metrics.incr('lobby.slow_client_disconnects')
+>>> metrics.counters['lobby.slow_client_disconnects']
+1
+
+Durations are kept as the most recent samples, for percentiles:
+
+>>> for ms in range(1, 101):
+...     metrics.observe('login.total', ms / 1000)
+>>> metrics.percentile('login.total', 99)
+0.099
+"""
+from collections import Counter, defaultdict, deque
+import math
+import time
+
+SAMPLES = 1000
+
+counters = Counter()
+timings = defaultdict(lambda: deque(maxlen=SAMPLES))
+
+
+def incr(name, amount=1):
+    counters[name] += amount
+
+
+def observe(name, seconds):
+    """
+    Record how long something took, also counted in <name>.seconds and <name>.count
+    """
+    timings[name].append(seconds)
+    counters[name + '.seconds'] += seconds
+    counters[name + '.count'] += 1
+
+
+def percentile(name, p):
+    """
+    :param p: 0 to 100
+    :return: the p-th percentile of the recent samples of name, None without samples
+    """
+    samples = sorted(timings.get(name, ()))
+    if not samples:
+        return None
+    return samples[max(math.ceil(len(samples) * p / 100) - 1, 0)]
+
+
+class Stopwatch():
+    """
+    Times the stages of something that happens in steps
+
+        watch = Stopwatch('login')
+        ...
+        watch.lap('authenticate')
+        ...
+        watch.stop()
+
+    records login.authenticate with the time since the watch started or
+    the previous lap, and login.total with the time since it started.
+    """
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.started = self._last = time.perf_counter()
+        self.laps = []
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        self.laps.append((stage, now - self._last))
+        observe(self.prefix + '.' + stage, now - self._last)
+        self._last = now
+
+    def stop(self):
+        """
+        :return: seconds since the watch started
+        """
+        total = time.perf_counter() - self.started
+        observe(self.prefix + '.total', total)
+        return total
+
+    def __str__(self):
+        return ', '.join('{} {:.3f}s'.format(stage, seconds) for stage, seconds in self.laps)
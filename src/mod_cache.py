@@ -0,0 +1,90 @@
+import asyncio
+from collections import namedtuple, OrderedDict
+import time
+
+from src import metrics
+from src.db_pool import in_list_statements, in_lists
+
+ModInfo = namedtuple('ModInfo', ['uid', 'name', 'ranked', 'version'])
+
+_SELECT_MODS = in_list_statements("SELECT uid, name, ranked, version FROM table_mod WHERE uid IN ({0})")
+
+
+class ModCache():
+    """
+    Sim mod metadata by uid, least recently used ones dropped beyond size
+
+    The uids a cache doesn't know are read with a single query, so a lobby
+    toggling twenty mods costs one round trip the first time and none
+    after. Uids that aren't in the vault are remembered too, as None.
+    Entries are read again after ttl seconds, and dropped straight away
+    when the lobby writes to the mod.
+    """
+    def __init__(self, size=2000, ttl=3600):
+        self.size = size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # uid -> (time read, ModInfo or None)
+        self._mods = OrderedDict()
+
+    def cached(self, uid, now=None):
+        """
+        :return: (found, ModInfo or None)
+        """
+        entry = self._mods.get(uid)
+        if entry is None:
+            return False, None
+        read, info = entry
+        if read + self.ttl <= (time.time() if now is None else now):
+            del self._mods[uid]
+            return False, None
+        self._mods.move_to_end(uid)
+        return True, info
+
+    def store(self, uid, info, now=None):
+        self._mods[uid] = (time.time() if now is None else now, info)
+        self._mods.move_to_end(uid)
+        while len(self._mods) > self.size:
+            self._mods.popitem(last=False)
+
+    @asyncio.coroutine
+    def resolve(self, db_pool, uids):
+        """
+        :return: dict of uid -> ModInfo, None for the uids not in the vault
+        """
+        mods = {}
+        missing = []
+        for uid in uids:
+            if uid in mods or uid in missing:
+                continue
+            found, info = self.cached(uid)
+            if found:
+                mods[uid] = info
+            else:
+                missing.append(uid)
+        self.hits += len(mods)
+        self.misses += len(missing)
+        metrics.incr('mod_cache.hits', len(mods))
+        metrics.incr('mod_cache.misses', len(missing))
+
+        if missing:
+            rows = []
+            for uids in in_lists(missing):
+                rows += yield from db_pool.fetch(_SELECT_MODS[len(uids)], *uids)
+            # uids compare without case in the database
+            found = {str(uid).lower(): ModInfo(str(uid), str(name), int(ranked) == 1, int(version))
+                     for uid, name, ranked, version in rows}
+            for uid in missing:
+                mods[uid] = found.get(uid.lower())
+                self.store(uid, mods[uid])
+        return mods
+
+    def invalidate(self, uid):
+        self._mods.pop(uid, None)
+
+    def clear(self):
+        self._mods.clear()
+
+    def __len__(self):
+        return len(self._mods)
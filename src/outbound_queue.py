@@ -0,0 +1,52 @@
+from collections import OrderedDict
+
+
+class OutboundQueue():
+    """
+    Frames waiting to be written to a client that is not keeping up.
+
+    Frames pushed with a key supersede any queued frame with the same key:
+    the old frame is dropped and the new one goes to the back of the queue,
+    so the client ends up with the latest state, in order relative to
+    everything else it was sent.
+    """
+    def __init__(self):
+        self._frames = OrderedDict()
+        self._next_id = 0
+        self.size = 0
+        self.coalesced = 0
+
+    def push(self, frame, key=None):
+        """
+        Queue a frame
+        :param frame: bytes-like frame, as written to the socket
+        :param key: hashable identifying what the frame is about, if it can be superseded
+        :return: None
+        """
+        if key is None:
+            key = self._next_id
+            self._next_id += 1
+        elif key in self._frames:
+            self.size -= len(self._frames.pop(key))
+            self.coalesced += 1
+        self._frames[key] = frame
+        self.size += len(frame)
+
+    def pop(self):
+        """
+        Take the oldest frame off the queue
+        :return: frame
+        """
+        _, frame = self._frames.popitem(last=False)
+        self.size -= len(frame)
+        return frame
+
+    def clear(self):
+        self._frames.clear()
+        self.size = 0
+
+    def __contains__(self, key):
+        return key in self._frames
+
+    def __len__(self):
+        return len(self._frames)
@@ -16,6 +16,8 @@
 # GNU General Public License for more details.
 #-------------------------------------------------------------------------------
 
+from collections import OrderedDict
+
 from .abc.base_player import BasePlayer
 
 
@@ -163,62 +165,94 @@ class Player(BasePlayer):
 
 
 class PlayersOnline(object):
+    """
+    Players signed in to the lobby
+
+    Indexed by login, id, session and IP, so lookups don't depend on the
+    number of players online. Iterating yields a snapshot, so players may
+    sign in or out during a broadcast.
+    """
     def __init__(self):
-        self.players = []
-        self.logins = []
+        self._by_login = OrderedDict()
+        self._by_id = {}
+        self._by_session = {}
+        # ip -> login -> player, for the players signed in from there, in the order they did
+        self._by_ip = {}
 
     def __len__(self):
-        return len(self.players)
+        return len(self._by_login)
+
+    def __iter__(self):
+        return iter(list(self._by_login.values()))
+
+    def __contains__(self, player):
+        return self._by_login.get(player.getLogin()) is player
+
+    @property
+    def players(self):
+        return list(self._by_login.values())
+
+    @property
+    def logins(self):
+        return list(self._by_login)
 
     def addUser(self, newplayer):
+        """
+        Add a player, replacing the one signed in with the same login, if any
+        :return: (game socket, lobby socket) of the replaced player, to be closed
+        """
         gamesocket = None
         lobbySocket = None
-        # login not in current active players
-        if not newplayer.getLogin() in self.logins:
-            self.logins.append(newplayer.getLogin())
-            self.players.append(newplayer)
-            return gamesocket, lobbySocket
-        else :
-            # login in current active player list !
-            
-            for player in self.players:
-                if newplayer.session == player.session :
-                    # uuid is the same, I don't know how it's possible, but we do nothing.
-                    return gamesocket, lobbySocket
-                
-                if newplayer.getLogin() == player.getLogin():
-                    # login exists, uuid not the same
-                    try :
-                        lobbyThread = player.lobbyThread
-                        if lobbyThread is not None:
-                            lobbySocket = lobbyThread.socket
-                    except :
-                        pass
-                        
-                    self.players.append(newplayer)
-                    self.logins.append(newplayer.login)
-
-                    return gamesocket, lobbySocket
 
+        current = self._by_login.get(newplayer.getLogin())
+        if current is not None:
+            if newplayer.session == current.session:
+                # uuid is the same, I don't know how it's possible, but we do nothing.
+                return gamesocket, lobbySocket
+
+            # login exists, uuid not the same
+            if current.lobbyThread is not None:
+                lobbySocket = current.lobbyThread.socket
+            self.removeUser(current)
+
+        self._by_login[newplayer.getLogin()] = newplayer
+        self._by_id[newplayer.id] = newplayer
+        self._by_session[newplayer.session] = newplayer
+        self._by_ip.setdefault(newplayer.ip, OrderedDict())[newplayer.getLogin()] = newplayer
+        return gamesocket, lobbySocket
 
     def removeUser(self, player):
-        if player.getLogin() in self.logins:
-            self.logins.remove(player.login)
-            if player in self.players :
-                self.players.remove(player)
-                #del player
-            return 1
-        else :
+        """
+        Remove a player, unless another one signed in with the same login since
+        :return: 1 if the player was removed, 0 otherwise
+        """
+        if self._by_login.get(player.getLogin()) is not player:
             return 0
 
+        del self._by_login[player.getLogin()]
+        if self._by_id.get(player.id) is player:
+            del self._by_id[player.id]
+        if self._by_session.get(player.session) is player:
+            del self._by_session[player.session]
+        same_ip = self._by_ip.get(player.ip)
+        if same_ip is not None and same_ip.get(player.getLogin()) is player:
+            del same_ip[player.getLogin()]
+            if not same_ip:
+                del self._by_ip[player.ip]
+        return 1
+
     def findByName(self, name):
-        for player in self.players:
-            if player.getLogin() == name:
-                return player
-        return 0
-    
+        return self._by_login.get(name, 0)
+
+    def findById(self, id):
+        return self._by_id.get(id)
+
+    def findBySession(self, session):
+        return self._by_session.get(session)
+
     def findByIp(self, ip):
-        for player in self.players:
-            if player.ip == ip and player.wantToConnectToGame:
+        # the first one signed in, like the list this replaced
+        for player in self._by_ip.get(ip, {}).values():
+            if player.wantToConnectToGame:
                 return player
         return None
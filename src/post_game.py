@@ -0,0 +1,169 @@
+import asyncio
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import time
+
+import trueskill
+
+from src import metrics
+from src.db_pool import QueryError, QueryTimeout, execute, execute_batch, run_in_transaction
+from src.decorators import with_logger
+from src.subscribable import Subscribable
+
+# What a game left to store once it ended, nothing in it refers to the game
+# or its players anymore. scores is a tuple of (player id, score), teams a
+# tuple of teams of (player id, mu, sigma) with ranks the teams' results,
+# both empty if the game isn't rated.
+GameOutcome = namedtuple('GameOutcome', ['game_id', 'rating', 'scores', 'teams', 'ranks', 'ended'])
+
+# the ratings a game may be rated by, and their tables
+RATING_TABLES = {
+    'global': 'global_rating',
+    'ladder1v1': 'ladder1v1_rating',
+}
+
+
+def rate(teams, ranks):
+    """
+    Rate a game, in a worker
+
+    Workers of a process pool inherit the trueskill environment config sets up.
+    :param teams: of a GameOutcome
+    :return: dict of player id -> (mu, sigma)
+    """
+    groups = [{player_id: trueskill.Rating(mu, sigma) for player_id, mu, sigma in team}
+              for team in teams]
+    return {player_id: (rating.mu, rating.sigma)
+            for group in trueskill.rate(groups, list(ranks))
+            for player_id, rating in group.items()}
+
+
+@with_logger
+class PostGameQueue(Subscribable):
+    """
+    Rates and stores the games that ended, away from the event loop
+
+    Games hand over a GameOutcome and are done with. The rating runs on a
+    pool of that many worker processes, or on the loop's executor if
+    workers is 0. The end time, scores and new ratings are then written in
+    a single transaction, tried again up to retries times if the database
+    refuses it. A write that timed out isn't, it may still go through.
+
+    Once stored, subscribers get
+
+        {'command_id': 'GameRecorded', 'arguments': [outcome, new_ratings]}
+
+    with new_ratings a dict of player id -> (mu, sigma).
+
+    Like the pool, a synchronous db_pool rates and stores on the spot.
+    """
+    def __init__(self, db_pool, workers=0, retries=3, retry_delay=1.0, loop=None):
+        Subscribable.__init__(self)
+        self.db_pool = db_pool
+        self.workers = workers
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self._loop = loop
+        self._executor = None
+        # outcomes being rated or stored
+        self.depth = 0
+
+    @staticmethod
+    def write(db, outcome, new_ratings):
+        """
+        Store the outcome and new ratings in one transaction, on any thread
+        """
+        run_in_transaction(db, PostGameQueue._write, outcome, new_ratings)
+
+    @staticmethod
+    def _write(db, outcome, new_ratings):
+        execute(db, "UPDATE game_stats set `EndTime` = NOW() where `id` = ?", outcome.game_id)
+        if outcome.scores:
+            player_ids, scores = zip(*outcome.scores)
+            # the rows were inserted at launch, by update_game_player_stats
+            execute_batch(db, "UPDATE game_player_stats SET score = ?, scoreTime = NOW() "
+                              "WHERE gameId = ? AND playerId = ?",
+                          scores, [outcome.game_id] * len(player_ids), player_ids)
+        if new_ratings:
+            player_ids = list(new_ratings)
+            means = [new_ratings[player_id][0] for player_id in player_ids]
+            deviations = [new_ratings[player_id][1] for player_id in player_ids]
+            execute_batch(db, "UPDATE game_player_stats "
+                              "SET after_mean = ?, after_deviation = ?, scoreTime = NOW() "
+                              "WHERE gameId = ? AND playerId = ?",
+                          means, deviations, [outcome.game_id] * len(player_ids), player_ids)
+            # the table can't be bound, it's one of RATING_TABLES
+            execute_batch(db, "UPDATE {} "
+                              "SET mean = ?, deviation = ?, numGames = (numGames + 1) "
+                              "WHERE id = ?".format(RATING_TABLES[outcome.rating]),
+                          means, deviations, player_ids)
+
+    @asyncio.coroutine
+    def process(self, outcome):
+        """
+        Rate and store a game
+        :return: the new ratings, None if the game couldn't be stored
+        """
+        metrics.observe('post_game.wait', max(time.time() - outcome.ended, 0))
+        self.depth += 1
+        metrics.incr('post_game.depth')
+        watch = metrics.Stopwatch('post_game')
+        try:
+            new_ratings = yield from self._rate(outcome)
+            watch.lap('rate')
+            yield from self._store(outcome, new_ratings)
+            watch.lap('store')
+        except Exception:
+            metrics.incr('post_game.failures')
+            self._logger.exception("Failed to store the end of game {}".format(outcome.game_id))
+            return None
+        finally:
+            self.depth -= 1
+            metrics.incr('post_game.depth', -1)
+        watch.stop()
+
+        self.notify({
+            'command_id': 'GameRecorded',
+            'arguments': [outcome, new_ratings]
+        })
+        return new_ratings
+
+    @asyncio.coroutine
+    def _rate(self, outcome):
+        if outcome.rating is None or not outcome.teams:
+            return {}
+        try:
+            if self.db_pool.synchronous:
+                return rate(outcome.teams, outcome.ranks)
+            loop = self._loop or asyncio.get_event_loop()
+            if self._executor is None and self.workers > 0:
+                self._executor = ProcessPoolExecutor(self.workers)
+            return (yield from loop.run_in_executor(self._executor, rate, outcome.teams, outcome.ranks))
+        except Exception:
+            # the scores are still worth storing
+            metrics.incr('post_game.rating_failures')
+            self._logger.exception("Failed to rate game {}".format(outcome.game_id))
+            return {}
+
+    @asyncio.coroutine
+    def _store(self, outcome, new_ratings):
+        attempt = 1
+        while True:
+            try:
+                yield from self.db_pool.run(self.write, outcome, new_ratings)
+                return
+            except QueryTimeout:
+                raise
+            except QueryError as e:
+                if attempt >= self.retries:
+                    raise
+                metrics.incr('post_game.retries')
+                self._logger.warning("Storing game {} failed, trying again: {}".format(outcome.game_id, e))
+            if not self.db_pool.synchronous:
+                yield from asyncio.sleep(self.retry_delay * attempt, loop=self._loop)
+            attempt += 1
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
@@ -0,0 +1,312 @@
+"""
+Framing of messages between the lobby server and its clients.
+
+Legacy framing is what QDataStream (Qt_4_2) produces: a big endian uint32
+block size, followed by QStrings, each a uint32 byte length and UTF-16BE
+text. JSON messages are a single QString, followed by the login and
+session when sent by the client.
+
+V2 framing is a big endian uint32 length followed by the message as UTF-8
+JSON. Clients ask for it by sending ``"framing": "v2"`` in their hello,
+which is always legacy framed. The server confirms with a legacy framed
+``{"command": "framing", "framing": "v2"}`` and uses v2 from then on in
+both directions; the client switches once it has seen the confirmation,
+and must not send anything else in between.
+
+Clients can also list ``"capabilities"`` in their hello:
+
+- ``batch``: many messages may arrive as one
+  ``{"command": "batch", "messages": [...]}``.
+- ``zlib``: with v2 framing, frames larger than COMPRESS_THRESHOLD are
+  deflated. The top bit of their length header is set to say so.
+
+- ``deflate``: everything the server sends after the confirmation is one
+  deflate stream (zlib format), sync flushed after every write. It
+  replaces ``zlib`` when a client asks for both.
+
+- ``delta``: game and player updates come as
+  ``{"command": "delta", "kind": ..., "key": ..., "seq": ..., "prev": ...}``
+  messages carrying only the changed and removed fields. Full
+  ``game_info`` and ``player_info`` messages carry a ``seq``. A client
+  whose state for that key is not at ``prev`` sends ``resync`` to get
+  the full state again. A game that went away is sent as a plain closed
+  ``game_info`` without a ``seq``.
+
+  The welcome carries an ``epoch`` and the current ``seq``. When a delta
+  client reconnects, it can send its old ``session`` and
+  ``"resume": {"epoch": ..., "seq": ...}`` with the last number it saw.
+  If the server still remembers everything since then, the client only
+  gets the games and players that changed, instead of the full lists,
+  and the welcome says ``"resumed": true``. A player that left meanwhile
+  comes as ``{"command": "player_info", "login": ..., "state": "offline"}``.
+
+The confirmation lists the capabilities the server accepted.
+
+Legacy framed reads are answered with a single ACK carrying the number of
+bytes buffered, which clients use for upload progress. Sending
+``"acks": false`` in the hello turns those off.
+"""
+import json
+import struct
+import time
+import zlib
+
+HEADER = struct.Struct('!I')
+_INT32 = struct.Struct('!i')
+
+COMPRESSED = 0x80000000
+COMPRESS_THRESHOLD = 1024
+
+
+class FramingError(Exception):
+    pass
+
+
+class LegacyFraming():
+    name = 'legacy'
+
+    @staticmethod
+    def _qstring(text):
+        data = text.encode('utf-16-be')
+        return HEADER.pack(len(data)) + data
+
+    def pack(self, action, *args):
+        """
+        Frame an action and its arguments the way QDataStream would
+        :param args: ints, bools written as ints, and strings
+        :return: bytes
+        :raises ValueError: for arguments of any other type
+        """
+        parts = [self._qstring(action)]
+        for arg in args:
+            if isinstance(arg, int):
+                parts.append(_INT32.pack(arg))
+            elif isinstance(arg, str):
+                parts.append(self._qstring(arg))
+            else:
+                raise ValueError("Can't write {} in a legacy frame".format(type(arg).__name__))
+        body = b''.join(parts)
+        return HEADER.pack(len(body)) + body
+
+    def pack_message(self, message):
+        return self.pack(json.dumps(message))
+
+    def pack_batch(self, messages):
+        return self.pack_message({"command": "batch", "messages": messages})
+
+
+class V2Framing():
+    """
+    :param compress_above: deflate frames larger than this many bytes, None to never compress
+    """
+    def __init__(self, name='v2', compress_above=None):
+        self.name = name
+        self.compress_above = compress_above
+
+    def pack(self, action, *args):
+        """
+        Frame one of the plain legacy actions (PING, PONG...) as a message
+        :return: bytes
+        """
+        message = {"command": action.lower()}
+        if args:
+            message["args"] = list(args)
+        return self.pack_message(message)
+
+    def pack_message(self, message):
+        data = json.dumps(message, separators=(',', ':')).encode()
+        if self.compress_above is not None and len(data) > self.compress_above:
+            data = zlib.compress(data)
+            return HEADER.pack(len(data) | COMPRESSED) + data
+        return HEADER.pack(len(data)) + data
+
+    def pack_batch(self, messages):
+        return self.pack_message({"command": "batch", "messages": messages})
+
+
+class FrameReader():
+    """
+    Incremental parser for lobby frames.
+
+    Both framings start a frame with its length as a big endian uint32, so
+    one reader serves either, and a client can switch framing between two
+    frames. Compressed frames are inflated, once the connection turned
+    compressed on after negotiating v2 with zlib; before that they are a
+    FramingError. Feed it whatever was read from the socket, then take the
+    complete frames out of it; partial frames are kept until the rest
+    arrives.
+
+    Frames are memoryviews into the received data rather than copies. Data
+    is only joined once there is enough of it for the frame at the front,
+    so a large upload arriving in many reads is copied once.
+    """
+    # map and mod uploads arrive as a single legacy frame
+    def __init__(self, max_size=64 * 1024 * 1024, compressed=False):
+        self._chunks = []
+        self._pending = 0
+        # bytes needed before the next frame can be parsed
+        self._needed = HEADER.size
+        self.max_size = max_size
+        # whether the client may send deflated frames
+        self.compressed = compressed
+
+    def feed(self, data):
+        if data:
+            self._chunks.append(bytes(data) if isinstance(data, bytearray) else data)
+            self._pending += len(data)
+
+    def _head(self, size):
+        if len(self._chunks) > 1 and len(self._chunks[0]) < size:
+            self._chunks = [b''.join(self._chunks)]
+        return self._chunks[0]
+
+    def next_size(self):
+        """
+        Size of the frame at the front of the buffer, without the compressed flag
+        :return: int or None if not even its header has arrived
+        """
+        if self._pending < HEADER.size:
+            return None
+        return HEADER.unpack_from(self._head(HEADER.size))[0] & ~COMPRESSED
+
+    def frames(self):
+        """
+        Bodies of the complete frames received so far
+        :raises FramingError: if a frame is larger than max_size, or compressed
+            while compressed isn't on
+        """
+        if self._pending < self._needed:
+            return
+
+        data = memoryview(self._head(self._pending))
+        offset = 0
+        self._needed = HEADER.size
+        try:
+            while True:
+                if len(data) - offset < HEADER.size:
+                    break
+                size, = HEADER.unpack_from(data, offset)
+                compressed = size & COMPRESSED
+                size &= ~COMPRESSED
+                if compressed and not self.compressed:
+                    raise FramingError("Compressed frame without zlib negotiated")
+                if size > self.max_size:
+                    raise FramingError("Frame of {} bytes exceeds {}".format(size, self.max_size))
+                end = offset + HEADER.size + size
+                if len(data) < end:
+                    self._needed = end - offset
+                    break
+                body = data[offset + HEADER.size:end]
+                offset = end
+                if compressed:
+                    body = self._inflate(body)
+                yield body
+        finally:
+            self._pending -= offset
+            if not self._pending:
+                self._chunks = []
+            elif offset:
+                # only the start of a frame is left, let go of the rest
+                self._chunks = [bytes(data[offset:])]
+
+    def _inflate(self, body):
+        inflater = zlib.decompressobj()
+        try:
+            data = inflater.decompress(body, self.max_size)
+        except zlib.error as ex:
+            raise FramingError("Invalid compressed frame: {}".format(ex))
+        if inflater.unconsumed_tail:
+            raise FramingError("Compressed frame inflates past {} bytes".format(self.max_size))
+        return data
+
+    def __len__(self):
+        return self._pending
+
+
+class LegacyStream():
+    """
+    Reads the fields of a legacy frame body, like the QDataStream it replaces
+
+    The body may be a memoryview, strings are decoded straight out of it.
+    """
+    def __init__(self, body):
+        self._body = body
+        self._pos = 0
+
+    def _take(self, size):
+        if self._pos + size > len(self._body):
+            raise FramingError("Read past the end of the frame")
+        data = self._body[self._pos:self._pos + size]
+        self._pos += size
+        return data
+
+    def readUInt32(self):
+        return HEADER.unpack(self._take(HEADER.size))[0]
+
+    def readInt32(self):
+        return _INT32.unpack(self._take(_INT32.size))[0]
+
+    def readQString(self):
+        size = self.readUInt32()
+        if size == 0xFFFFFFFF:
+            # null QString
+            return ''
+        try:
+            return str(self._take(size), 'utf-16-be')
+        except UnicodeDecodeError as ex:
+            raise FramingError("Invalid QString: {}".format(ex))
+
+    def readRawData(self, size):
+        return bytes(self._take(size))
+
+    def atEnd(self):
+        return self._pos >= len(self._body)
+
+
+class StreamDeflater():
+    """
+    Compresses everything written to one connection as a single deflate stream
+
+    Keeping the stream open across writes lets repeated keys and values
+    compress against earlier messages. Every write ends with a sync flush,
+    so the client can decode it straight away.
+    :param counters: collections.Counter to add bytes in/out and CPU time to
+    :param prefix: prefix for the counter names
+    """
+    def __init__(self, level=6, counters=None, prefix='deflate'):
+        self._compressor = zlib.compressobj(level)
+        self._counters = counters
+        self._prefix = prefix
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.cpu_time = 0.0
+
+    def compress(self, data):
+        start = time.process_time()
+        out = self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        elapsed = time.process_time() - start
+
+        self.bytes_in += len(data)
+        self.bytes_out += len(out)
+        self.cpu_time += elapsed
+        if self._counters is not None:
+            self._counters[self._prefix + '.bytes_in'] += len(data)
+            self._counters[self._prefix + '.bytes_out'] += len(out)
+            self._counters[self._prefix + '.cpu_seconds'] += elapsed
+        return out
+
+    @property
+    def ratio(self):
+        """
+        Compressed size over uncompressed size, so far
+        """
+        if self.bytes_in == 0:
+            return 1.0
+        return self.bytes_out / self.bytes_in
+
+
+LEGACY = LegacyFraming()
+V2 = V2Framing()
+V2_ZLIB = V2Framing('v2+zlib', compress_above=COMPRESS_THRESHOLD)
+
+FRAMINGS = {framing.name: framing for framing in (LEGACY, V2, V2_ZLIB)}
@@ -0,0 +1,136 @@
+import asyncio
+from collections import namedtuple
+
+import trueskill
+
+from src import metrics
+from src.db_pool import in_list_statements, in_lists
+from src.decorators import with_logger
+
+# ratings are (mu, sigma), num_games counts the global games
+PlayerRatings = namedtuple('PlayerRatings', ['global_rating', 'ladder_rating', 'num_games'])
+
+_SELECT_RATINGS = in_list_statements(
+    "SELECT 'global', id, mean, deviation, numGames FROM global_rating WHERE id IN ({0}) "
+    "UNION ALL "
+    "SELECT 'ladder1v1', id, mean, deviation, numGames FROM ladder1v1_rating WHERE id IN ({0})")
+
+# the rating a game is rated by -> the PlayerRatings field holding it
+RATING_FIELDS = {
+    'global': 'global_rating',
+    'ladder1v1': 'ladder_rating',
+}
+
+
+@with_logger
+class RatingStore():
+    """
+    Current global and ladder1v1 ratings of the players online
+
+    Loaded with a single query when a player logs in, so launching a game
+    only reads them from here. Rated games write the new ratings to the
+    database first, see PostGameQueue, and the store takes them from its
+    GameRecorded notifications once they are committed. The ratings are
+    copied onto the Player objects of players, the ones in player_info.
+
+    Players who aren't in the store, because they are offline, are read
+    when needed and not kept.
+    """
+    def __init__(self, players=None):
+        """
+        :param players: PlayersOnline to keep up to date
+        """
+        self.players = players
+        # player id -> PlayerRatings
+        self._ratings = {}
+
+    @staticmethod
+    def default():
+        rating = trueskill.Rating()
+        return PlayerRatings((rating.mu, rating.sigma), (rating.mu, rating.sigma), 0)
+
+    @asyncio.coroutine
+    def load(self, db_pool, player_ids):
+        """
+        Read the ratings of players coming online, and keep them
+        """
+        self._ratings.update((yield from self._fetch(db_pool, sorted(set(player_ids)))))
+
+    @asyncio.coroutine
+    def read(self, db_pool, player_ids):
+        """
+        Ratings of players, read all at once for those the store doesn't have, without keeping them
+        :return: dict of player id -> PlayerRatings
+        """
+        ratings = {player_id: self._ratings[player_id] for player_id in player_ids
+                   if player_id in self._ratings}
+        missing = sorted(set(player_ids) - set(ratings))
+        metrics.incr('ratings.hits', len(ratings))
+        if missing:
+            metrics.incr('ratings.misses', len(missing))
+            ratings.update((yield from self._fetch(db_pool, missing)))
+        return ratings
+
+    @asyncio.coroutine
+    def _fetch(self, db_pool, player_ids):
+        if not player_ids:
+            return {}
+        rows = []
+        for ids in in_lists(player_ids):
+            rows += yield from db_pool.fetch(_SELECT_RATINGS[len(ids)], *(ids + ids))
+
+        loaded = {player_id: self.default() for player_id in player_ids}
+        for rating, player_id, mean, deviation, num_games in rows:
+            player_id = int(player_id)
+            ratings = loaded[player_id]._replace(**{RATING_FIELDS[str(rating)]: (float(mean), float(deviation))})
+            if str(rating) == 'global':
+                ratings = ratings._replace(num_games=int(num_games or 0))
+            loaded[player_id] = ratings
+        return loaded
+
+    def get(self, player_id):
+        """
+        :return: PlayerRatings, None if not loaded
+        """
+        return self._ratings.get(player_id)
+
+    def apply(self, player, ratings=None):
+        """
+        Copy the stored ratings, or the ones given, onto a Player
+        :param ratings: PlayerRatings, e.g. from read
+        """
+        if ratings is None:
+            ratings = self._ratings.get(player.id)
+        if ratings is None:
+            return False
+        player.global_rating = ratings.global_rating
+        player.ladder_rating = ratings.ladder_rating
+        player.numGames = ratings.num_games
+        return True
+
+    def update(self, player_id, rating, mu_sigma):
+        """
+        Take a new rating the database already has
+        """
+        ratings = self._ratings.get(player_id)
+        if ratings is None:
+            return
+        ratings = ratings._replace(**{RATING_FIELDS[rating]: tuple(mu_sigma)})
+        if rating == 'global':
+            ratings = ratings._replace(num_games=ratings.num_games + 1)
+        self._ratings[player_id] = ratings
+
+        player = self.players.findById(player_id) if self.players is not None else None
+        if player is not None:
+            self.apply(player)
+
+    def handle_GameRecorded(self, arguments):
+        outcome, new_ratings = arguments
+        for player_id, mu_sigma in new_ratings.items():
+            self.update(player_id, outcome.rating, mu_sigma)
+
+    def forget(self, player_id):
+        self._ratings.pop(player_id, None)
+
+    def __len__(self):
+        return len(self._ratings)
@@ -0,0 +1,107 @@
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import socket
+import time
+
+from src import metrics
+from src.decorators import with_logger
+
+
+@with_logger
+class ReverseResolver():
+    """
+    Host names of IP addresses, looked up without holding up the event loop
+
+    Lookups run on threads of their own, so that the loop's executor is
+    never held up by them, and give up after timeout seconds: an address
+    without a PTR record can take much longer than that to fail. Results
+    are cached for ttl seconds, failures for negative_ttl, and the cache
+    holds the size most recently used addresses. Concurrent lookups of one
+    address share the same query, and at most max_pending run at once,
+    counting those that timed out until their thread returns: beyond that
+    resolve answers None straight away rather than queue up.
+    """
+    def __init__(self, loop=None, timeout=2.0, ttl=3600, negative_ttl=300, size=10000, max_pending=16,
+                 workers=4):
+        self._loop = loop or asyncio.get_event_loop()
+        self.timeout = timeout
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.size = size
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(workers)
+        # ip -> (expiry time, host name or None)
+        self._cache = OrderedDict()
+        # ip -> future of the lookup in progress
+        self._pending = {}
+        # lookups that timed out, their thread still blocked in getnameinfo
+        self.stuck = 0
+
+    def cached(self, ip, now=None):
+        """
+        :return: (found, host name or None), without looking anything up
+        """
+        entry = self._cache.get(ip)
+        if entry is None:
+            return False, None
+        expiry, host = entry
+        if expiry <= (time.time() if now is None else now):
+            del self._cache[ip]
+            return False, None
+        self._cache.move_to_end(ip)
+        return True, host
+
+    def _store(self, ip, host):
+        ttl = self.ttl if host is not None else self.negative_ttl
+        self._cache[ip] = (time.time() + ttl, host)
+        self._cache.move_to_end(ip)
+        while len(self._cache) > self.size:
+            self._cache.popitem(last=False)
+
+    @asyncio.coroutine
+    def resolve(self, ip):
+        """
+        :return: host name of ip, None if it has none or it took too long
+        """
+        found, host = self.cached(ip)
+        if found:
+            metrics.incr('resolver.hits')
+            return host
+        metrics.incr('resolver.misses')
+
+        lookup = self._pending.get(ip)
+        if lookup is None:
+            if len(self._pending) + self.stuck >= self.max_pending:
+                metrics.incr('resolver.dropped')
+                return None
+            lookup = self._pending[ip] = asyncio.ensure_future(self._lookup(ip), loop=self._loop)
+        return (yield from asyncio.shield(lookup))
+
+    @asyncio.coroutine
+    def _lookup(self, ip):
+        host = None
+        work = self._executor.submit(socket.getnameinfo, (ip, 0), socket.NI_NAMEREQD)
+        try:
+            host, _ = yield from asyncio.wait_for(
+                asyncio.wrap_future(work, loop=self._loop), self.timeout, loop=self._loop)
+        except asyncio.TimeoutError:
+            metrics.incr('resolver.timeouts')
+            self._logger.debug("Reverse lookup of {} timed out".format(ip))
+            self.stuck += 1
+            work.add_done_callback(lambda _: self._loop.call_soon_threadsafe(self._unstuck))
+        except (OSError, UnicodeError):
+            pass
+        finally:
+            del self._pending[ip]
+        self._store(ip, host)
+        return host
+
+    def _unstuck(self):
+        self.stuck -= 1
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+    def __len__(self):
+        return len(self._cache)
@@ -0,0 +1,40 @@
+import asyncio
+
+
+class Timer():
+    """
+    Repeating timer on the asyncio event loop, used like a QTimer
+
+    Works on any loop, including quamash's, so code using it does not need
+    the Qt event loop.
+    """
+    def __init__(self, callback, loop=None):
+        """
+        :param callback: called without arguments every time the timer fires
+        :param loop: event loop to schedule on
+        """
+        self._callback = callback
+        self._loop = loop or asyncio.get_event_loop()
+        self._interval = None
+        self._handle = None
+
+    def start(self, msec):
+        """
+        (Re)start the timer, firing every msec milliseconds
+        """
+        self.stop()
+        self._interval = msec / 1000
+        self._handle = self._loop.call_later(self._interval, self._fire)
+
+    def stop(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def isActive(self):
+        return self._handle is not None
+
+    def _fire(self):
+        # scheduled before the callback runs, so that it may stop or restart the timer
+        self._handle = self._loop.call_later(self._interval, self._fire)
+        self._callback()
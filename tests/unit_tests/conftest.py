@@ -2,11 +2,31 @@ from unittest import mock
 
 import pytest
 
+from src.counter_aggregator import CounterAggregator
+from src.db_pool import DatabasePool
 from src.gameconnection import GameConnection
 from src.lobbyconnection import LobbyConnection
+from src.map_catalogue import MapCatalogue
+from src.post_game import PostGameQueue
+from src.rating_store import RatingStore
 
 
 
+@pytest.fixture
+def mock_parent(db):
+    """
+    Games container for a Game, with what games take from it
+    """
+    parent = mock.Mock()
+    parent.db = db
+    parent.db_pool = DatabasePool(db)
+    parent.map_catalogue = MapCatalogue()
+    parent.counters = CounterAggregator(parent.db_pool)
+    parent.post_game = PostGameQueue(parent.db_pool)
+    parent.ratings = RatingStore()
+    return parent
+
+
 @pytest.fixture()
 def lobbythread():
     return mock.Mock(
@@ -1,10 +1,13 @@
-from src.games import GamesContainer
+from unittest import mock
+
+from src.games import GamesContainer, Game
+from src.games.game import GameState
 from src.games_service import GamesService
 
 
 def test_initialization(players, db):
     service = GamesService(players, db)
-    assert service.dirty_games == []
+    assert service.dirty_games == set()
 
 
 def test_create_game(players, db):
@@ -14,3 +17,97 @@ def test_create_game(players, db):
     game = service.create_game("public", 'faf', players.hosting, 'Some_game_name', 6112, 'scmp_007')
     assert game is not None
     assert game.id in service.dirty_games
+
+
+def test_mark_dirty_deduplicates(players, db):
+    service = GamesService(players, db)
+    service.mark_dirty(1)
+    service.mark_dirty(1)
+    service.mark_dirty(2)
+    assert service.pop_dirty() == {1, 2}
+    assert service.dirty_games == set()
+
+
+def test_refresh_featured_mod_versions(players, db):
+    service = GamesService(players, db)
+    container = mock.Mock()
+    container.refreshGamemodVersion = mock.Mock(return_value=True)
+    unchanged = mock.Mock()
+    unchanged.refreshGamemodVersion = mock.Mock(return_value=False)
+    service.addContainer('faf', container)
+    service.addContainer('nomads', unchanged)
+
+    assert service.refresh_featured_mod_versions() == ['faf']
+    assert service.refresh_featured_mod_versions('nomads') == []
+    assert container.refreshGamemodVersion.call_count == 1
+    assert unchanged.refreshGamemodVersion.call_count == 2
+
+
+def test_games_are_indexed_by_id(players, db):
+    service = GamesService(players, db)
+    container = GamesContainer("faf", "Forged Alliance Forever", db, service)
+    service.addContainer('faf', container)
+    game = Game(42, container)
+
+    assert container.addGame(game) == 1
+    assert container.addGame(game) == 0
+    assert service.find_by_id(42) is game
+    assert service.find_by_id('42') is game
+    assert service.getGameContainer(game) is container
+
+    service.removeGame(game)
+    assert service.find_by_id(42) is None
+    assert service.getGameContainer(game) is None
+    assert container.games == {}
+    assert 42 in service.dirty_games
+
+
+def test_expire_games(players, db):
+    service = GamesService(players, db)
+    container = GamesContainer("faf", "Forged Alliance Forever", db, service)
+    service.addContainer('faf', container)
+    idle, playing = Game(1, container), Game(2, container)
+    container.addGame(idle)
+    container.addGame(playing)
+    playing.state = GameState.LIVE
+
+    assert service.expire_games(now=idle.created_at) == []
+    assert service.expire_games(now=idle.created_at + service.idle_timeout + 1) == [1]
+    assert service.find_by_id(1) is None
+    assert service.find_by_id(2) is playing
+    assert service.expire_games(now=playing.created_at + service.max_duration + 1) == [2]
+    assert container.games == {}
+
+
+def test_check_game_removes_lobby_without_host(players, db):
+    service = GamesService(players, db)
+    container = GamesContainer("faf", "Forged Alliance Forever", db, service)
+    service.addContainer('faf', container)
+    game = Game(1, container)
+    container.addGame(game)
+    game.state = GameState.LOBBY
+
+    service.check_game('1')
+    assert service.expire_games() == [1]
+
+
+def test_old_hosted_lobby_is_not_reviewed_every_tick(players, db):
+    service = GamesService(players, db)
+    container = GamesContainer("faf", "Forged Alliance Forever", db, service)
+    service.addContainer('faf', container)
+    game = Game(1, container)
+    container.addGame(game)
+    game.state = GameState.LOBBY
+    game.hostPlayer = players.hosting.login
+    game._connections = {players.hosting: mock.Mock()}
+    players.hosting.getGame.return_value = '1'
+    players.findByName = mock.Mock(return_value=players.hosting)
+
+    now = game.created_at + service.max_duration + 100
+    assert service.expire_games(now=now) == []
+    assert service.find_by_id(1) is game
+    assert players.findByName.call_count == 1
+
+    assert service.expire_games(now=now + 1) == []
+    assert players.findByName.call_count == 1
+    assert service.expiry.deadline(1) >= now + service.idle_timeout
@@ -0,0 +1,80 @@
+from unittest import mock
+
+import pytest
+
+from src.asyncio_lobby_server import LobbySocket, CONNECTED_STATE, UNCONNECTED_STATE
+
+
+@pytest.fixture
+def transport():
+    transport = mock.Mock()
+    transport.get_extra_info = mock.Mock(return_value=('127.0.0.1', 50123))
+    transport.get_write_buffer_size = mock.Mock(return_value=42)
+    return transport
+
+
+@pytest.fixture
+def lobby_socket(transport):
+    server = mock.Mock()
+    with mock.patch('src.asyncio_lobby_server.lobbyconnection.LobbyConnection') as connection_class:
+        sock = LobbySocket(server)
+        sock.connection_made(transport)
+    server.recorders.add.assert_called_once_with(connection_class.return_value)
+    return sock
+
+
+def test_socket_looks_connected(lobby_socket):
+    assert lobby_socket.state() == CONNECTED_STATE
+    assert lobby_socket.isValid()
+    assert lobby_socket.peerAddress().toString() == '127.0.0.1'
+    assert lobby_socket.peerPort() == 50123
+    assert lobby_socket.bytesToWrite() == 42
+
+
+def test_data_goes_to_connection_while_it_reads(lobby_socket):
+    readData = mock.Mock()
+    lobby_socket.readyRead.connect(readData)
+    lobby_socket.data_received(b'\x00\x00\x00\x02ab')
+    lobby_socket.connection.receiveData.assert_called_once_with(b'\x00\x00\x00\x02ab')
+
+    lobby_socket.readyRead.disconnect(readData)
+    lobby_socket.data_received(b'more')
+    assert lobby_socket.connection.receiveData.call_count == 1
+
+
+def test_write(lobby_socket, transport):
+    assert lobby_socket.write(b'frame') == 5
+    transport.write.assert_called_once_with(b'frame')
+
+    lobby_socket.connection_lost(None)
+    assert lobby_socket.write(b'frame') == -1
+    assert transport.write.call_count == 1
+
+
+def test_drained_buffer_fires_bytes_written(lobby_socket):
+    flush = mock.Mock()
+    lobby_socket.bytesWritten.connect(flush)
+    lobby_socket.pause_writing()
+    lobby_socket.resume_writing()
+    flush.assert_called_once_with(0)
+
+
+def test_connection_lost(lobby_socket):
+    disconnected, error = mock.Mock(), mock.Mock()
+    lobby_socket.disconnected.connect(disconnected)
+    lobby_socket.error.connect(error)
+
+    lobby_socket.connection_lost(ConnectionResetError('reset by peer'))
+
+    assert lobby_socket.state() == UNCONNECTED_STATE
+    assert lobby_socket.errorString() == 'reset by peer'
+    assert error.call_count == 1
+    disconnected.assert_called_once_with()
+
+
+def test_no_writes_once_closed(lobby_socket, transport):
+    lobby_socket.close()
+
+    assert not lobby_socket.isValid()
+    assert lobby_socket.write(b'frame') == -1
+    transport.write.assert_not_called()
@@ -0,0 +1,38 @@
+from unittest import mock
+
+from src.connection_registry import ConnectionRegistry
+
+
+def test_add_remove():
+    registry = ConnectionRegistry()
+    conn = mock.Mock()
+    registry.add(conn)
+    assert conn in registry
+    assert registry.is_alive(conn)
+    assert registry.remove(conn)
+    assert conn not in registry
+    assert not registry.remove(conn)
+
+
+def test_mark_closing():
+    registry = ConnectionRegistry()
+    conn, other = mock.Mock(), mock.Mock()
+    registry.add(conn)
+    registry.add(other)
+    registry.mark_closing(conn)
+    assert conn in registry
+    assert not registry.is_alive(conn)
+    assert registry.alive() == [other]
+
+
+def test_remove_while_iterating():
+    registry = ConnectionRegistry()
+    conns = [mock.Mock() for _ in range(5)]
+    for conn in conns:
+        registry.add(conn)
+    seen = []
+    for conn in registry:
+        seen.append(conn)
+        registry.remove(conn)
+    assert seen == conns
+    assert len(registry) == 0
@@ -0,0 +1,52 @@
+from unittest import mock
+
+import pytest
+
+from src.counter_aggregator import CounterAggregator, MOD_DOWNLOADS, MAP_TIMES_PLAYED
+from src.db_pool import DatabasePool, QueryError
+
+
+@pytest.fixture
+def counters():
+    return CounterAggregator(DatabasePool(mock.Mock()))
+
+
+def test_increments_add_up(counters):
+    counters.incr(MOD_DOWNLOADS, 'a')
+    counters.incr(MOD_DOWNLOADS, 'a')
+    counters.incr(MAP_TIMES_PLAYED, 'a', 3)
+    assert counters.pending(MOD_DOWNLOADS, 'a') == 2
+    assert counters.pending(MAP_TIMES_PLAYED, 'a') == 3
+    assert counters.pending(MOD_DOWNLOADS, 'b') == 0
+
+
+def test_one_statement_per_column_and_amount(counters):
+    for uid in ['a', 'b', 'c', 'c']:
+        counters.incr(MOD_DOWNLOADS, uid)
+    counters.incr(MAP_TIMES_PLAYED, 7)
+
+    statements = counters.statements(counters._pending)
+    assert len(statements) == 3
+    # padded to one of the IN list lengths
+    assert ("UPDATE `table_mod` SET `downloads` = `downloads` + ? WHERE `uid` IN ({})".format(", ".join("?" * 8)),
+            [1, 'a', 'b'] + ['b'] * 6) in statements
+    assert ("UPDATE `table_mod` SET `downloads` = `downloads` + ? WHERE `uid` IN (?)", [2, 'c']) in statements
+
+
+def test_flush_writes_in_one_transaction(counters):
+    counters.incr(MOD_DOWNLOADS, 'a')
+    with mock.patch('src.counter_aggregator.execute') as execute:
+        counters.db_pool.spawn(counters.flush())
+
+    execute.assert_called_once_with(counters.db_pool.db, mock.ANY, 1, 'a')
+    counters.db_pool.db.commit.assert_called_once_with()
+    assert counters.pending(MOD_DOWNLOADS, 'a') == 0
+
+
+def test_failed_flush_is_kept(counters):
+    counters.incr(MOD_DOWNLOADS, 'a')
+    with mock.patch('src.counter_aggregator.execute', side_effect=QueryError("gone")):
+        counters.db_pool.spawn(counters.flush())
+
+    counters.db_pool.db.rollback.assert_called_once_with()
+    assert counters.pending(MOD_DOWNLOADS, 'a') == 1
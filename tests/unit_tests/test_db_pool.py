@@ -0,0 +1,137 @@
+import asyncio
+import threading
+import time
+from unittest import mock
+
+import pytest
+
+from src.db_pool import DatabasePool, QueryError, QueryTimeout, StatementCache, in_list_statements, in_lists, \
+    run_in_transaction
+
+
+@pytest.fixture
+def query():
+    with mock.patch('src.db_pool.QSqlQuery') as QSqlQuery:
+        query = QSqlQuery.return_value
+        query.prepare.return_value = True
+        query.exec_.return_value = True
+        query.record.return_value.count.return_value = 2
+        query.next.side_effect = [True, True, False]
+        query.value.side_effect = lambda i: i
+        yield query
+
+
+def test_synchronous_fetch(query):
+    pool = DatabasePool(mock.Mock())
+    results = []
+
+    @asyncio.coroutine
+    def work():
+        rows = yield from pool.fetch("SELECT a, b FROM t WHERE id = ?", 42)
+        results.append(rows)
+
+    assert pool.spawn(work()) is None
+    assert results == [[(0, 1), (0, 1)]]
+    query.bindValue.assert_called_once_with(0, 42)
+
+
+def test_statements_are_prepared_once(query):
+    cache = StatementCache(mock.Mock(), size=2)
+    first = cache.prepare("SELECT 1")
+    assert cache.prepare("SELECT 1") is first
+    assert (cache.hits, cache.misses) == (1, 1)
+    query.prepare.assert_called_once_with("SELECT 1")
+
+
+def test_least_recently_used_statement_is_dropped(query):
+    cache = StatementCache(mock.Mock(), size=2)
+    for sql in ["SELECT 1", "SELECT 2", "SELECT 1", "SELECT 3", "SELECT 1"]:
+        cache.prepare(sql)
+    assert len(cache) == 2
+    assert (cache.hits, cache.misses) == (2, 3)
+
+
+def test_in_lists_are_padded_to_a_few_lengths():
+    assert in_lists([]) == []
+    assert in_lists([1]) == [[1]]
+    assert in_lists([1, 2, 3]) == [[1, 2, 3, 3, 3, 3, 3, 3]]
+    chunks = in_lists(range(130))
+    assert [len(chunk) for chunk in chunks] == [128, 8]
+    assert chunks[1] == [128, 129] + [129] * 6
+    assert in_list_statements("SELECT a FROM t WHERE id IN ({0})")[8].count('?') == 8
+
+
+def test_run_in_transaction():
+    db = mock.Mock()
+    assert run_in_transaction(db, lambda db, n: n + 1, 41) == 42
+    db.transaction.assert_called_once_with()
+    db.commit.assert_called_once_with()
+
+    db = mock.Mock()
+    db.commit.return_value = False
+    with pytest.raises(QueryError):
+        run_in_transaction(db, lambda db: None)
+
+
+def test_run_in_transaction_rolls_back_failed_work():
+    db = mock.Mock()
+    with pytest.raises(RuntimeError):
+        run_in_transaction(db, mock.Mock(side_effect=RuntimeError))
+    db.rollback.assert_called_once_with()
+    assert not db.commit.called
+
+
+def test_spawn_logs_failures():
+    pool = DatabasePool(mock.Mock())
+    pool._logger = mock.Mock()
+
+    @asyncio.coroutine
+    def work():
+        yield from pool.run(lambda db: 1 / 0)
+
+    pool.spawn(work())
+    assert pool._logger.exception.called
+
+
+@pytest.fixture
+def pool(loop):
+    pool = DatabasePool(mock.Mock(), size=2, timeout=0.5, loop=loop)
+    pool._connection = mock.Mock()
+    yield pool
+    pool._executor.shutdown(wait=True)
+
+
+@asyncio.coroutine
+def test_work_runs_off_the_loop(pool):
+    thread = yield from pool.run(lambda db: threading.current_thread())
+    assert thread is not threading.current_thread()
+
+
+@asyncio.coroutine
+def test_slow_query_times_out(pool):
+    with pytest.raises(QueryTimeout):
+        yield from pool.run(lambda db: time.sleep(1), timeout=0.1)
+
+
+@asyncio.coroutine
+def test_concurrency_is_bounded(pool):
+    running = []
+    most = []
+
+    def work(db):
+        running.append(1)
+        most.append(len(running))
+        time.sleep(0.05)
+        running.pop()
+
+    yield from asyncio.gather(*[pool.run(work) for _ in range(6)])
+    assert max(most) <= 2
+
+
+@asyncio.coroutine
+def test_gather_runs_concurrently(pool):
+    start = time.perf_counter()
+    results = yield from pool.gather(pool.run(lambda db: time.sleep(0.1) or 1),
+                                     pool.run(lambda db: time.sleep(0.1) or 2))
+    assert results == [1, 2]
+    assert time.perf_counter() - start < 0.2
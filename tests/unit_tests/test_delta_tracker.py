@@ -0,0 +1,62 @@
+from src.delta_tracker import DeltaTracker
+
+
+def test_first_update_is_full():
+    tracker = DeltaTracker()
+    update = tracker.update(('game_info', 1), {"uid": 1, "num_players": 1})
+    assert update.prev is None
+    assert update.full() == {"uid": 1, "num_players": 1, "seq": update.seq}
+
+
+def test_delta_carries_only_changes():
+    tracker = DeltaTracker()
+    first = tracker.update(('game_info', 1), {"uid": 1, "num_players": 1, "title": "x"})
+    tracker.update(('game_info', 2), {"uid": 2})
+    update = tracker.update(('game_info', 1), {"uid": 1, "num_players": 2})
+
+    assert update.prev == first.seq
+    assert update.seq > first.seq + 1
+    assert update.delta() == {"command": "delta", "kind": "game_info", "key": 1,
+                              "seq": update.seq, "prev": first.seq,
+                              "changed": {"num_players": 2}, "removed": ["title"]}
+
+
+def test_unchanged_state_keeps_its_number():
+    tracker = DeltaTracker()
+    first = tracker.update(('player_info', 'Dostya'), {"login": "Dostya"})
+    update = tracker.update(('player_info', 'Dostya'), {"login": "Dostya"})
+    assert not update.modified
+    assert update.seq == first.seq
+    assert tracker.snapshot(('player_info', 'Dostya')).seq == first.seq
+    assert tracker.seq == first.seq
+
+
+def test_forget():
+    tracker = DeltaTracker()
+    tracker.update(('game_info', 1), {"uid": 1})
+    tracker.forget(('game_info', 1))
+    assert ('game_info', 1) not in tracker
+    assert tracker.update(('game_info', 1), {"uid": 1}).prev is None
+
+
+def test_changed_since():
+    tracker = DeltaTracker()
+    tracker.update(('game_info', 1), {"uid": 1})
+    seq = tracker.seq
+    tracker.update(('game_info', 2), {"uid": 2})
+    tracker.update(('game_info', 1), {"uid": 1, "num_players": 2})
+    tracker.forget(('game_info', 2))
+
+    assert tracker.changed_since(tracker.epoch, seq) == [('game_info', 1), ('game_info', 2)]
+    assert tracker.changed_since(tracker.epoch, tracker.seq) == []
+    assert tracker.changed_since(tracker.epoch + 1, seq) is None
+    assert tracker.changed_since(tracker.epoch, tracker.seq + 1) is None
+
+
+def test_changed_since_out_of_history():
+    tracker = DeltaTracker(history=2)
+    for uid in range(4):
+        tracker.update(('game_info', uid), {"uid": uid})
+
+    assert tracker.changed_since(tracker.epoch, 1) is None
+    assert tracker.changed_since(tracker.epoch, 2) == [('game_info', 2), ('game_info', 3)]
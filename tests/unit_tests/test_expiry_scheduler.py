@@ -0,0 +1,76 @@
+from src.expiry_scheduler import ExpiryScheduler
+
+
+def test_only_due_keys_are_reviewed():
+    reviewed = []
+
+    def review(key, now):
+        reviewed.append(key)
+        return None
+
+    scheduler = ExpiryScheduler(review)
+    scheduler.schedule('a', 10)
+    scheduler.schedule('b', 20)
+    scheduler.schedule(3, 30)
+
+    assert scheduler.run(now=5) == []
+    assert scheduler.run(now=20) == ['a', 'b']
+    assert reviewed == ['a', 'b']
+    assert 3 in scheduler
+    assert len(scheduler) == 1
+
+
+def test_review_reschedules():
+    scheduler = ExpiryScheduler(lambda key, now: now + 10 if now < 30 else None)
+    scheduler.schedule('game', 10)
+
+    assert scheduler.run(now=10) == []
+    assert scheduler.deadline('game') == 20
+    assert scheduler.run(now=25) == []
+    assert scheduler.deadline('game') == 35
+    assert scheduler.run(now=40) == ['game']
+    assert 'game' not in scheduler
+
+
+def test_earlier_deadline_wins():
+    scheduler = ExpiryScheduler(lambda key, now: None)
+    scheduler.schedule('game', 100)
+    scheduler.schedule('game', 5)
+    scheduler.schedule('game', 50)
+
+    assert scheduler.deadline('game') == 5
+    assert scheduler.run(now=5) == ['game']
+    # the entry left behind for 100 is skipped
+    assert scheduler.run(now=100) == []
+
+
+def test_discard():
+    scheduler = ExpiryScheduler(lambda key, now: None)
+    scheduler.schedule('game', 5)
+    scheduler.discard('game')
+
+    assert scheduler.run(now=10) == []
+    assert len(scheduler) == 0
+
+
+def test_past_deadline_is_not_reviewed_twice_in_one_run():
+    reviews = []
+
+    def review(key, now):
+        reviews.append(key)
+        return 0
+
+    scheduler = ExpiryScheduler(review)
+    scheduler.schedule('game', 5)
+
+    assert scheduler.run(now=10) == []
+    assert reviews == ['game']
+
+
+def test_stale_entries_are_compacted():
+    scheduler = ExpiryScheduler(lambda key, now: None)
+    for deadline in range(1000, 0, -1):
+        scheduler.schedule('game', deadline)
+
+    assert len(scheduler._heap) <= 2 * len(scheduler) + 64
+    assert scheduler.run(now=1) == ['game']
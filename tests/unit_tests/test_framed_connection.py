@@ -0,0 +1,167 @@
+import asyncio
+import json
+from unittest import mock
+
+import pytest
+
+from src import metrics
+from src.framed_connection import FramedConnection
+from src.protocol.lobby import LEGACY, LegacyStream, HEADER
+
+
+class EchoConnection(FramedConnection):
+    def __init__(self, socket, **kwargs):
+        super().__init__(socket, prefix='test', **kwargs)
+        self.received = []
+
+    def handleAction(self, action, stream):
+        if action == "PING":
+            self.received.append({"command": "PING"})
+        else:
+            FramedConnection.handleAction(self, action, stream)
+
+    def command_echo(self, message):
+        self.received.append(message)
+        self.sendJSON(message)
+
+    def command_fail(self, message):
+        raise RuntimeError("failing on purpose")
+
+    @asyncio.coroutine
+    def command_slow(self, message):
+        yield from asyncio.sleep(0.01)
+        self.received.append(message)
+
+
+@pytest.fixture
+def socket():
+    socket = mock.Mock()
+    socket.write = mock.Mock(side_effect=len)
+    return socket
+
+
+@pytest.fixture
+def connection(socket):
+    metrics.counters.clear()
+    return EchoConnection(socket)
+
+
+def written_messages(socket):
+    messages = []
+    for (data,), _ in socket.write.call_args_list:
+        stream = LegacyStream(memoryview(data)[HEADER.size:])
+        messages.append(json.loads(stream.readQString()))
+    return messages
+
+
+def test_commands_are_dispatched(connection, socket):
+    data = LEGACY.pack_message({"command": "echo", "n": 1}) + LEGACY.pack_message({"command": "echo", "n": 2})
+    connection.receiveData(data)
+
+    assert [m["n"] for m in connection.received] == [1, 2]
+    assert written_messages(socket) == connection.received
+
+
+def test_frame_split_across_reads(connection):
+    data = LEGACY.pack_message({"command": "echo"})
+    connection.receiveData(data[:3])
+    connection.receiveData(data[3:10])
+    assert connection.received == []
+    connection.receiveData(data[10:])
+    assert connection.received == [{"command": "echo"}]
+
+
+def test_unknown_and_failing_commands_are_survived(connection):
+    connection.receiveData(LEGACY.pack_message({"command": "nope"})
+                           + LEGACY.pack('not json')
+                           + LEGACY.pack_message({"command": "fail"})
+                           + LEGACY.pack_message({"command": "echo"}))
+    assert connection.received == [{"command": "echo"}]
+
+
+@asyncio.coroutine
+def test_coroutine_commands_keep_order(socket, loop):
+    connection = EchoConnection(socket, loop=loop)
+    connection.receiveData(LEGACY.pack_message({"command": "slow", "n": 1})
+                           + LEGACY.pack_message({"command": "echo", "n": 2})
+                           + LEGACY.pack_message({"command": "slow", "n": 3}))
+    assert connection.received == []
+
+    while connection.commandTask is not None:
+        yield from connection.commandTask
+    assert [m["n"] for m in connection.received] == [1, 2, 3]
+
+
+@asyncio.coroutine
+def test_legacy_actions_wait_for_coroutine_commands(socket, loop):
+    connection = EchoConnection(socket, loop=loop)
+    connection.receiveData(LEGACY.pack_message({"command": "slow"})
+                           + LEGACY.pack("PING")
+                           + LEGACY.pack_message({"command": "echo"}))
+    assert connection.received == []
+
+    while connection.commandTask is not None:
+        yield from connection.commandTask
+    assert connection.received == [{"command": "slow"}, {"command": "PING"}, {"command": "echo"}]
+
+
+@asyncio.coroutine
+def test_malformed_frame_behind_coroutine_command_aborts(socket, loop):
+    connection = EchoConnection(socket, loop=loop)
+    # a QString claiming more bytes than the frame holds
+    connection.receiveData(LEGACY.pack_message({"command": "slow"})
+                           + HEADER.pack(4) + HEADER.pack(100)
+                           + LEGACY.pack_message({"command": "echo"}))
+    assert len(connection.commandBacklog) == 2
+
+    yield from connection.commandTask
+    assert connection.received == [{"command": "slow"}]
+    assert not connection.commandBacklog
+    socket.abort.assert_called_once_with()
+
+
+def test_send_reply(connection, socket):
+    connection.sendReply("SEND_FILE_PATH", "bin", "file.exe", 3)
+    socket.write.assert_called_once_with(LEGACY.pack("SEND_FILE_PATH", "bin", "file.exe", 3))
+
+
+def test_metrics(connection):
+    data = LEGACY.pack_message({"command": "echo"})
+    connection.receiveData(data)
+
+    assert metrics.counters['test.bytes_in'] == len(data)
+    assert metrics.counters['test.frames_in'] == 1
+    assert metrics.counters['test.bytes_out'] == len(data)
+    assert metrics.counters['test.writes'] == 1
+
+
+def test_oversized_frame_aborts(connection, socket):
+    connection.reader.max_size = 16
+    connection.receiveData(LEGACY.pack_message({"command": "echo", "padding": "x" * 32}))
+
+    socket.abort.assert_called_once_with()
+    assert connection.received == []
+    connection.sendJSON({"command": "echo"})
+    socket.write.assert_not_called()
+
+
+def test_idle_client_is_dropped(socket):
+    metrics.counters.clear()
+    connection = EchoConnection(socket, idle_timeout=30, loop=mock.Mock())
+
+    connection.lastRead -= 10
+    connection.checkIdle()
+    socket.abort.assert_not_called()
+
+    connection.lastRead -= 30
+    connection.checkIdle()
+    socket.abort.assert_called_once_with()
+    assert metrics.counters['test.idle_disconnects'] == 1
+
+
+def test_disconnection_closes_socket(connection, socket):
+    connection.disconnection()
+
+    assert connection.noSocket
+    socket.readyRead.disconnect.assert_called_once_with(connection.readData)
+    socket.close.assert_called_once_with()
@@ -10,9 +10,7 @@ from src.gameconnection import GameConnection, GameConnectionState
 
 
 @pytest.fixture()
-def game(db):
-    mock_parent = mock.Mock()
-    mock_parent.db = db
+def game(mock_parent):
     return Game(42, mock_parent)
 
 
@@ -20,11 +18,9 @@ def test_initialization(game):
     assert game.state == GameState.INITIALIZING
 
 
-def test_instance_logging(db):
+def test_instance_logging(mock_parent):
     logger = logging.getLogger('{}.5'.format(Game.__qualname__))
     logger.info = mock.Mock()
-    mock_parent = mock.Mock()
-    mock_parent.db = db
     game = Game(5, mock_parent)
     logger.info.assert_called_with("{} created".format(game))
 
@@ -127,61 +123,69 @@ def test_game_launch_freezes_players(game: Game, players):
     assert game.players == {players.hosting, players.joining}
 
 
+def test_launch_records_player_stats_with_tuple_ratings(game: Game, players):
+    def fetch_rows(db, sql, *params):
+        if 'global_rating' in sql:
+            return [('global', players.hosting.id, 1600.0, 100.0, 5),
+                    ('global', players.joining.id, 1400.0, 90.0, 3)]
+        return []
+
+    game.state = GameState.LOBBY
+    add_connected_players(game, [players.hosting, players.joining])
+    for team, player in enumerate([players.hosting, players.joining], 1):
+        game.set_player_option(player.id, 'Team', team)
+        game.set_player_option(player.id, 'Faction', 1)
+        game.set_player_option(player.id, 'Color', team)
+    with patch('src.db_pool.fetch_rows', side_effect=fetch_rows), \
+            patch('src.db_pool.execute'), \
+            patch('src.games.game.execute_batch') as execute_batch:
+        game.launch()
+
+    (_, sql, *columns), _ = execute_batch.call_args
+    assert 'game_player_stats' in sql
+    assert sorted(zip(*columns)) == [
+        (game.id, players.hosting.id, 1, 1, 1, 0, 1600.0, 100.0),
+        (game.id, players.joining.id, 1, 2, 2, 1, 1400.0, 90.0),
+    ]
+
+
 def test_update_ratings(game: Game, players):
-    with patch('src.games.game.QSqlQuery') as query:
-        game.state = GameState.LOBBY
-        add_connected_player(game, players.hosting)
-        query().size.return_value = 1
-        query().value.side_effect = [2000, 125]
-        game.update_ratings()
-        assert players.hosting.global_rating == (2000, 125)
-
-
-def test_persist_rating_change_stats_by_game(game: Game, players):
-    with patch('src.games.game.QSqlQuery') as query:
-        game_stats_query = mock.Mock()
-        rating_query = mock.Mock()
-        query.side_effect = [game_stats_query, rating_query]
-        game.persist_rating_change_stats([
-            {players.hosting: Rating(1500, 250)},
-            {players.joining: Rating(1250, 125)}
-        ])
-        game_stats_query.prepare.assert_any_call(mock.ANY)
-        rating_query.prepare.assert_any_call(mock.ANY)
-        # Yeeaaaahhhh....
-        (((new_means,), _),
-         ((new_deviations,), _),
-         ((game_ids,), _),
-         ((player_ids,), _)) = game_stats_query.addBindValue.call_args_list
-        assert 1500 in new_means
-        assert 1250 in new_means
-        assert 250 in new_deviations
-        assert 125 in new_deviations
-        assert game.id in game_ids
-        assert players.hosting.id in player_ids
-        assert players.joining.id in player_ids
-
-
-def test_persist_rating_change_stats_by_player(game: Game, players):
-    with patch('src.games.game.QSqlQuery') as query:
-        game_stats_query = mock.Mock()
-        rating_query = mock.Mock()
-        query.side_effect = [game_stats_query, rating_query]
-        game.persist_rating_change_stats([
-            {players.hosting: Rating(1500, 250)},
-            {players.joining: Rating(1250, 125)}
-        ])
-        rating_query.prepare.assert_any_call(mock.ANY)
-        # Yeeaaaahhhh....
-        (((new_means,), _),
-         ((new_deviations,), _),
-         ((player_ids,), _)) = rating_query.addBindValue.call_args_list
-        assert 1500 in new_means
-        assert 1250 in new_means
-        assert 250 in new_deviations
-        assert 125 in new_deviations
-        assert players.hosting.id in player_ids
-        assert players.joining.id in player_ids
+    game.state = GameState.LOBBY
+    add_connected_player(game, players.hosting)
+    with patch('src.db_pool.fetch_rows', return_value=[('global', players.hosting.id, 2000, 125, 10)]) as fetch_rows:
+        game.db_pool.spawn(game.update_ratings())
+    assert players.hosting.global_rating == (2000, 125)
+    assert fetch_rows.call_count == 1
+    # the rating store only keeps the players online
+    assert game.ratings.get(players.hosting.id) is None
+
+
+def test_update_ratings_of_online_players_come_from_the_store(game: Game, players):
+    game.state = GameState.LOBBY
+    add_connected_player(game, players.hosting)
+    with patch('src.db_pool.fetch_rows', return_value=[('global', players.hosting.id, 2000, 125, 10)]):
+        game.db_pool.spawn(game.ratings.load(game.db_pool, [players.hosting.id]))
+    with patch('src.db_pool.fetch_rows') as fetch_rows:
+        game.db_pool.spawn(game.update_ratings())
+    assert players.hosting.global_rating == (2000, 125)
+    assert not fetch_rows.called
+
+
+def test_outcome_is_a_snapshot_of_the_results(game: Game, players):
+    game.state = GameState.LOBBY
+    add_connected_players(game, [players.hosting, players.joining])
+    game.set_player_option(players.hosting.id, 'Team', 1)
+    game.set_player_option(players.joining.id, 'Team', 2)
+    game.launch()
+    game.add_result(players.hosting, 0, 'victory', 1)
+    players.hosting.global_rating = Rating(1500, 250)
+    players.joining.global_rating = Rating(1500, 250)
+
+    outcome = game.outcome('global')
+    assert outcome.game_id == game.id
+    assert sorted(outcome.scores) == [(players.hosting.id, 1), (players.joining.id, -1)]
+    assert outcome.teams == (((players.hosting.id, 1500, 250),), ((players.joining.id, 1500, 250),))
+    assert game.outcome().teams == ()
 
 
 def test_game_teams_represents_active_teams(game: Game, players):
@@ -236,8 +240,11 @@ def test_compute_rating_balanced_teamgame(game: Game, create_player):
     for player, _, team in players:
         game.set_player_option(player.id, 'Team', team)
         game.set_player_option(player.id, 'Army', player.id - 1)
+    ratings = {player.id: player.global_rating for player, _, _ in players}
     game.launch()
     for player, result, _ in players:
+        # launching took them from the rating store, which doesn't know these players
+        player.global_rating = ratings[player.id]
         game.add_result(player, player.id - 1, 'score', result)
     result = game.compute_rating()
     for team in result:
@@ -247,8 +254,60 @@ def test_compute_rating_balanced_teamgame(game: Game, create_player):
 
 
 def test_on_game_end_calls_rate_game(game):
-    game.rate_game = mock.Mock()
+    game.rate_game = mock.Mock(return_value=None)
     game.state = GameState.LIVE
-    game.on_game_end()
+    with patch('src.db_pool.QSqlQuery'):
+        game.on_game_end()
     assert game.state == GameState.ENDED
     game.rate_game.assert_any_call()
+
+
+def test_game_end_stores_scores_and_new_ratings(game: Game, players):
+    game.state = GameState.LOBBY
+    add_connected_players(game, [players.hosting, players.joining])
+    game.set_player_option(players.hosting.id, 'Team', 1)
+    game.set_player_option(players.joining.id, 'Team', 2)
+    game.rate_game = mock.Mock(return_value='global')
+    receiver = mock.Mock()
+    game.post_game.subscribe(receiver, ['GameRecorded'])
+    with patch('src.db_pool.fetch_rows', return_value=[]), \
+            patch('src.db_pool.execute'), \
+            patch('src.games.game.execute_batch'):
+        game.launch()
+    game.add_result(players.hosting, 0, 'victory', 1)
+
+    with patch('src.post_game.PostGameQueue.write') as write:
+        game.on_game_end()
+
+    (_, outcome, new_ratings), _ = write.call_args
+    assert sorted(outcome.scores) == [(players.hosting.id, 1), (players.joining.id, -1)]
+    assert len(outcome.teams) == 2
+    assert set(new_ratings) == {players.hosting.id, players.joining.id}
+    assert new_ratings[players.hosting.id][0] > new_ratings[players.joining.id][0]
+    receiver.handle_GameRecorded.assert_called_once_with([outcome, new_ratings])
+
+
+def test_game_info_frame_is_cached_until_the_game_changes(game):
+    framing = mock.Mock()
+    framing.name = 'v2'
+    framing.pack_message = mock.Mock(side_effect=lambda message: message['mapname'].encode())
+    game.parent.getGamemodVersion = mock.Mock(return_value={})
+
+    assert game.game_info_frame(framing) == b'scmp_007'
+    assert game.game_info_frame(framing) == b'scmp_007'
+    assert framing.pack_message.call_count == 1
+
+    version = game.version
+    game.setGameMap('SCMP_015')
+    assert game.version > version
+    assert game.game_info_frame(framing) == b'scmp_015'
+    assert framing.pack_message.call_count == 2
+
+
+def test_mods_options_and_state_bump_version(game):
+    version = game.version
+    game.mods = {'some-uid': 'Some mod'}
+    game.options = [True, False]
+    game.state = GameState.LOBBY
+    assert game.version == version + 3
+    assert game.lobbyState == 'open'
@@ -0,0 +1,44 @@
+import asyncio
+from unittest import mock
+
+from src.game_broadcaster import GameListBroadcaster
+
+
+class DirtyGames():
+    def __init__(self):
+        self.dirty_games = set()
+
+    def mark_dirty(self, game_id):
+        self.dirty_games.add(game_id)
+
+    def pop_dirty(self):
+        dirty, self.dirty_games = self.dirty_games, set()
+        return dirty
+
+
+def test_flushes_after_max_latency(loop):
+    games, send = DirtyGames(), mock.Mock()
+    broadcaster = GameListBroadcaster(games, send, loop=loop, max_latency=0.01)
+    for game_id in [1, 2, 1]:
+        games.mark_dirty(game_id)
+        broadcaster.handle_DirtyGame([game_id])
+    assert send.call_count == 0
+    loop.run_until_complete(asyncio.sleep(0.05))
+    send.assert_called_once_with({1, 2})
+
+
+def test_flushes_early_when_too_many_pending(loop):
+    games, send = DirtyGames(), mock.Mock()
+    broadcaster = GameListBroadcaster(games, send, loop=loop, max_latency=10, max_pending=3)
+    for game_id in range(3):
+        games.mark_dirty(game_id)
+        broadcaster.handle_DirtyGame([game_id])
+    send.assert_called_once_with({0, 1, 2})
+    loop.run_until_complete(asyncio.sleep(0))
+    assert send.call_count == 1
+
+
+def test_flush_without_dirty_games_sends_nothing(loop):
+    send = mock.Mock()
+    GameListBroadcaster(DirtyGames(), send, loop=loop).flush()
+    assert send.call_count == 0
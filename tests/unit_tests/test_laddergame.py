@@ -1,4 +1,3 @@
-from unittest import mock
 import pytest
 
 from src.games import ladder1V1Game
@@ -7,9 +6,7 @@ from src.games.game import GameState
 from .test_game import add_connected_players
 
 @pytest.fixture()
-def laddergame(db):
-    mock_parent = mock.Mock()
-    mock_parent.db = db
+def laddergame(mock_parent):
     return ladder1V1Game(1, mock_parent)
 
 
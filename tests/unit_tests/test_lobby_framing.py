@@ -0,0 +1,140 @@
+import json
+import struct
+import zlib
+
+import pytest
+
+from src.protocol.lobby import LEGACY, V2, V2_ZLIB, COMPRESSED, FrameReader, LegacyStream, StreamDeflater, \
+    FramingError
+
+
+def test_legacy_matches_qdatastream():
+    # QDataStream Qt_4_2: uint32 block size, QString as uint32 byte count + UTF-16BE
+    assert LEGACY.pack("PING") == b'\x00\x00\x00\x0c' + b'\x00\x00\x00\x08' + 'PING'.encode('utf-16-be')
+    assert LEGACY.pack("ACK", 7)[-4:] == struct.pack('!i', 7)
+
+
+def test_legacy_writes_bools_as_ints():
+    assert LEGACY.pack("FLAG", True) == LEGACY.pack("FLAG", 1)
+    assert LEGACY.pack("FLAG", False) == LEGACY.pack("FLAG", 0)
+
+
+@pytest.mark.parametrize('arg', [1.5, ['a.exe'], None])
+def test_legacy_rejects_other_types(arg):
+    with pytest.raises(ValueError):
+        LEGACY.pack("ACTION", arg)
+
+
+def test_v2_roundtrip_in_pieces():
+    message = {"command": "game_info", "title": "Tëst"}
+    frames = V2.pack_message(message) * 2
+    reader = FrameReader()
+    received = []
+    for i in range(len(frames)):
+        reader.feed(frames[i:i + 1])
+        received.extend(reader.frames())
+    assert [json.loads(str(m, "utf-8")) for m in received] == [message, message]
+    assert len(reader) == 0
+
+
+def test_v2_is_smaller():
+    message = {"command": "player_info", "login": "Dostya", "rating_mean": 1500.0}
+    assert len(V2.pack_message(message)) < len(LEGACY.pack_message(message))
+
+
+def test_rejects_oversized_frames():
+    reader = FrameReader(max_size=10)
+    reader.feed(struct.pack('!I', 11))
+    with pytest.raises(FramingError):
+        list(reader.frames())
+
+
+def test_legacy_stream_reads_packed_fields():
+    reader = FrameReader()
+    reader.feed(LEGACY.pack("UPLOAD_MAP", "login", "session", 3))
+    body, = reader.frames()
+    stream = LegacyStream(body)
+    assert stream.readQString() == "UPLOAD_MAP"
+    assert stream.readQString() == "login"
+    assert stream.readQString() == "session"
+    assert stream.readInt32() == 3
+    assert stream.atEnd()
+    with pytest.raises(FramingError):
+        stream.readRawData(1)
+
+
+@pytest.mark.parametrize('data', [b'\x00a\x00', b'\xdc\x00'])
+def test_legacy_stream_rejects_invalid_qstrings(data):
+    # odd length, lone low surrogate
+    stream = LegacyStream(struct.pack('!I', len(data)) + data)
+    with pytest.raises(FramingError):
+        stream.readQString()
+
+
+def test_batch_is_compressed_above_threshold():
+    players = [{"command": "player_info", "login": "player{}".format(i)} for i in range(100)]
+    frame = V2_ZLIB.pack_batch(players)
+    assert struct.unpack('!I', frame[:4])[0] & COMPRESSED
+    assert len(frame) < len(V2.pack_batch(players))
+
+    reader = FrameReader(compressed=True)
+    reader.feed(frame)
+    body, = reader.frames()
+    assert json.loads(str(body, "utf-8")) == {"command": "batch", "messages": players}
+
+
+def test_rejects_compressed_frames_without_zlib():
+    reader = FrameReader()
+    reader.feed(V2_ZLIB.pack_message({"command": "notice", "text": "a" * 2000}))
+    assert not reader.next_size() & COMPRESSED
+    with pytest.raises(FramingError):
+        list(reader.frames())
+
+
+def test_small_frames_are_not_compressed():
+    assert V2_ZLIB.pack_message({"command": "pong"}) == V2.pack_message({"command": "pong"})
+
+
+def test_rejects_compressed_frames_inflating_past_max_size():
+    reader = FrameReader(max_size=100, compressed=True)
+    reader.feed(V2_ZLIB.pack_message({"command": "notice", "text": "a" * 2000}))
+    with pytest.raises(FramingError):
+        list(reader.frames())
+
+
+def test_stream_deflater_output_decodes_per_write():
+    from collections import Counter
+    counters = Counter()
+    deflater = StreamDeflater(counters=counters, prefix='test')
+    inflater = zlib.decompressobj()
+    frames = [V2.pack_message({"command": "game_info", "uid": uid, "state": "open"}) for uid in range(3)]
+    for frame in frames:
+        assert inflater.decompress(deflater.compress(frame)) == frame
+    assert deflater.ratio < 1
+    assert counters['test.bytes_in'] == sum(len(frame) for frame in frames)
+    assert counters['test.bytes_out'] == deflater.bytes_out
+
+
+def test_frames_are_not_copied():
+    data = V2.pack_message({"command": "ping"}) + V2.pack_message({"command": "pong"})
+    reader = FrameReader()
+    reader.feed(data)
+    first, second = reader.frames()
+    assert isinstance(first, memoryview)
+    assert first.obj is data
+    assert json.loads(str(second, "utf-8")) == {"command": "pong"}
+
+
+def test_frame_split_over_many_reads():
+    frame = LEGACY.pack("UPLOAD_MAP", "x" * 5000)
+    reader = FrameReader()
+    head, tail = frame[:-10], frame[-10:]
+    for start in range(0, len(head), 1000):
+        reader.feed(head[start:start + 1000])
+        assert list(reader.frames()) == []
+    reader.feed(tail)
+    body, = reader.frames()
+    stream = LegacyStream(body)
+    assert stream.readQString() == "UPLOAD_MAP"
+    assert stream.readQString() == "x" * 5000
+    assert len(reader) == 0
@@ -0,0 +1,20 @@
+from unittest import mock
+
+import pytest
+
+from src.lobby_server import BaseLobbyServer
+
+
+@pytest.fixture
+def lobby_server():
+    return BaseLobbyServer(mock.Mock(), mock.Mock(), mock.Mock(), loop=mock.Mock())
+
+
+def test_closed_sessions_are_bounded(lobby_server):
+    lobby_server.closedSessionsLimit = 2
+    lobby_server.rememberSession(1, 'a')
+    lobby_server.rememberSession(2, 'b')
+    lobby_server.rememberSession(1, 'c')
+    lobby_server.rememberSession(3, 'd')
+
+    assert dict(lobby_server.closedSessions) == {1: 'c', 3: 'd'}
@@ -2,8 +2,11 @@ from PySide import QtNetwork
 import pytest
 import mock
 
+from src.counter_aggregator import MOD_DOWNLOADS
 from src.games_service import GamesService
 from src.lobbyconnection import LobbyConnection, PlayersOnline
+from src.protocol.lobby import HEADER, V2
+from src.players import Player
 from src.FaLobbyServer import FALobbyServer
 
 
@@ -119,8 +122,9 @@ def test_mod_vault_like_invalid_uid(mock_config, mock_query, fa_server_thread):
 @mock.patch('src.lobbyconnection.QSqlQuery')
 def test_mod_vault_download(mock_query, fa_server_thread):
     fa_server_thread.command_modvault({'type': 'download',
-                                    'uid': None})
-    mock_query.return_value.prepare.assert_called_with("UPDATE `table_mod` SET downloads=downloads+1 WHERE uid = ?")
+                                    'uid': 'a valid one'})
+    assert mock_query.mock_calls == []
+    assert fa_server_thread.parent.games.counters.pending(MOD_DOWNLOADS, 'a valid one') == 1
 
 
 def test_mod_vault_addcomment(fa_server_thread):
@@ -255,3 +259,85 @@ def test_avatar_select_no_avatar(mock_query, fa_server_thread):
     with pytest.raises(KeyError):
         fa_server_thread.command_avatar({'action': 'select'})
 
+
+# Login
+@mock.patch('src.lobbyconnection.Config', {'global': {'content_url': 'http://content/'}})
+def test_load_league_top_of_league(fa_server_thread):
+    fa_server_thread.uid = 42
+    fa_server_thread.season = 'ladder_season_5'
+    top = [(300, 42), (200, 1), (100, 2), (50, 3)]
+    with mock.patch('src.db_pool.fetch_rows', side_effect=[[(300, 2, 'Major', 400)], top, top]):
+        results = []
+
+        def load():
+            results.append((yield from fa_server_thread.loadLeague(fa_server_thread.parent.db_pool)))
+
+        fa_server_thread.parent.db_pool.spawn(load())
+
+    score, league, division, avatar = results[0]
+    assert (league, division) == (2, 'Major')
+    assert avatar == {"url": "http://content/avatars/league1.png", "tooltip": "First in my League!"}
+
+
+@mock.patch('src.lobbyconnection.Config', {'global': {'content_url': 'http://content/'}})
+def test_load_league_below_the_top(fa_server_thread):
+    fa_server_thread.uid = 42
+    fa_server_thread.season = 'ladder_season_5'
+    top = [(900, 1), (800, 2), (700, 3), (600, 4)]
+    with mock.patch('src.db_pool.fetch_rows', side_effect=[[(300, 2, 'Major', 400)], top, top]):
+        results = []
+
+        def load():
+            results.append((yield from fa_server_thread.loadLeague(fa_server_thread.parent.db_pool)))
+
+        fa_server_thread.parent.db_pool.spawn(load())
+
+    assert results[0] == (300, 2, 'Major', None)
+
+
+def test_players_that_logged_out_are_gone_on_resync_and_resume(fa_server_thread):
+    lobby_server = fa_server_thread.parent
+    player = Player(login='Dragonfire', session=1, ip='127.0.0.1', uuid=42)
+    lobby_server.listUsers.addUser(player)
+    key = ("player_info", 'Dragonfire')
+    lobby_server.deltas.update(key, {"command": "player_info", "login": 'Dragonfire'})
+    epoch, seq = lobby_server.deltas.epoch, lobby_server.deltas.seq
+
+    assert lobby_server.removePlayer(player)
+
+    fa_server_thread.sendJSONBatch = mock.Mock()
+    fa_server_thread.command_resync({"command": "resync"})
+    fa_server_thread.sendJSONBatch.assert_called_once_with([])
+
+    fa_server_thread.sendJSONBatch.reset_mock()
+    fa_server_thread.sendMissedUpdates(lobby_server.deltas.changed_since(epoch, seq))
+    fa_server_thread.sendJSONBatch.assert_called_once_with(
+        [{"command": "player_info", "login": 'Dragonfire', "state": "offline"}])
+
+
+def test_v2_frame_with_invalid_utf8_aborts(fa_server_thread, connected_socket):
+    fa_server_thread.initTimer = None
+    fa_server_thread.framing = V2
+    data = b'{"command":"\xff"}'
+    fa_server_thread.receiveData(HEADER.pack(len(data)) + data)
+
+    connected_socket.abort.assert_called_with()
+
+
+@pytest.mark.parametrize('batches', [True, False])
+def test_send_game_list(fa_server_thread, batches):
+    game = mock.Mock(uuid=1, lobbyState='open')
+    game.to_dict.return_value = {"command": "game_info", "uid": 1}
+    game.game_info_frame.return_value = b'frame'
+    container = mock.Mock(listable=True, games={1: game})
+    fa_server_thread.parent.games.gamesContainer = {'faf': container}
+    fa_server_thread.batches = batches
+    fa_server_thread.sendJSONBatch = mock.Mock()
+    fa_server_thread.sendArray = mock.Mock()
+
+    fa_server_thread.sendGameList()
+
+    if batches:
+        fa_server_thread.sendJSONBatch.assert_called_once_with([{"command": "game_info", "uid": 1}])
+    else:
+        fa_server_thread.sendArray.assert_called_once_with(b'frame')
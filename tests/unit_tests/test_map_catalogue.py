@@ -0,0 +1,54 @@
+from unittest import mock
+
+from src.db_pool import DatabasePool
+from src.map_catalogue import MapCatalogue, MapInfo
+
+MAPS = [(3, 'Setons Clutch', 'maps/setons_clutch.v0002.zip', 1),
+        (1, 'Setons Clutch', 'maps/SETONS_CLUTCH.zip', 1),
+        (2, 'Thermopylae', 'maps/thermo.zip', 0)]
+COOP = [(7, 'maps/scca_coop_e01.v0011.zip')]
+
+
+def loaded():
+    catalogue = MapCatalogue()
+    catalogue.index(MAPS, COOP)
+    return catalogue
+
+
+def test_find_oldest_version_by_name():
+    catalogue = loaded()
+    assert catalogue.find('setons_clutch') == MapInfo(1, 'Setons Clutch', 'maps/SETONS_CLUTCH.zip', True)
+    assert [info.id for info in catalogue.versions('Setons_Clutch')] == [1, 3]
+    assert catalogue.get(2).ranked is False
+    assert catalogue.find('unknown') is None
+
+
+def test_find_versioned_name():
+    catalogue = loaded()
+    assert catalogue.find('Setons_Clutch.v0002').id == 3
+    assert [info.id for info in catalogue.versions('setons_clutch.v0002')] == [3]
+    assert catalogue.find('setons_clutch.v0003') is None
+
+
+def test_coop_mission():
+    catalogue = loaded()
+    assert catalogue.coop_mission('scca_coop_e01') == 7
+    assert catalogue.coop_mission('SCCA_Coop_E01.v0011') == 7
+    assert catalogue.coop_mission('setons_clutch') is None
+
+
+def test_uploaded_map_is_added():
+    catalogue = loaded()
+    catalogue.add(9, 'Canis', 'maps/canis.zip', ranked=False)
+    assert catalogue.find('canis').id == 9
+    assert len(catalogue) == 4
+
+
+def test_lookup_goes_to_the_database_once_for_unknown_maps():
+    catalogue = loaded()
+    pool = DatabasePool(mock.Mock())
+    with mock.patch('src.db_pool.fetch_rows', side_effect=[[(5, 'Canis', 'maps/canis.zip', 1)], []]) as fetch:
+        for mapname in ['setons_clutch', 'setons_clutch.v0002', 'canis', 'canis', 'nowhere', 'nowhere']:
+            pool.spawn(catalogue.lookup(pool, mapname))
+    assert fetch.call_count == 2
+    assert catalogue.find('canis').id == 5
@@ -0,0 +1,57 @@
+from unittest import mock
+
+from src.db_pool import DatabasePool
+from src.mod_cache import ModCache, ModInfo
+
+BLACKOPS = 'e7846e9b-23a4-4b95-ae3a-fb69b289a585'
+
+
+def resolve(cache, uids, rows):
+    pool = DatabasePool(mock.Mock())
+    results = []
+
+    def run():
+        results.append((yield from cache.resolve(pool, uids)))
+
+    with mock.patch('src.db_pool.fetch_rows', return_value=rows) as fetch:
+        pool.spawn(run())
+    return results[0], fetch
+
+
+def test_unknown_uids_are_read_in_one_query():
+    cache = ModCache()
+    mods, fetch = resolve(cache, [BLACKOPS, 'nope', BLACKOPS], [(BLACKOPS.upper(), 'BlackOps', 0, 12)])
+
+    assert mods == {BLACKOPS: ModInfo(BLACKOPS.upper(), 'BlackOps', False, 12), 'nope': None}
+    # padded to one of the IN list lengths
+    fetch.assert_called_once_with(mock.ANY, mock.ANY, BLACKOPS, *['nope'] * 7)
+    assert (cache.hits, cache.misses) == (0, 2)
+
+
+def test_known_uids_need_no_query():
+    cache = ModCache()
+    resolve(cache, [BLACKOPS, 'nope'], [(BLACKOPS, 'BlackOps', 1, 12)])
+    mods, fetch = resolve(cache, ['nope', BLACKOPS], [])
+
+    assert mods[BLACKOPS].ranked
+    assert mods['nope'] is None
+    fetch.assert_not_called()
+
+
+def test_invalidate_and_expiry():
+    cache = ModCache(ttl=60)
+    cache.store('a', None, now=0)
+    cache.store('b', None, now=0)
+    cache.invalidate('a')
+
+    assert cache.cached('a', now=1) == (False, None)
+    assert cache.cached('b', now=1) == (True, None)
+    assert cache.cached('b', now=60) == (False, None)
+
+
+def test_least_recently_used_is_dropped():
+    cache = ModCache(size=2)
+    for uid in ['a', 'b', 'a', 'c']:
+        cache.store(uid, None)
+    assert len(cache) == 2
+    assert cache.cached('b') == (False, None)
@@ -0,0 +1,33 @@
+from src.outbound_queue import OutboundQueue
+
+
+def test_fifo():
+    queue = OutboundQueue()
+    queue.push(b'a')
+    queue.push(b'bb')
+    assert len(queue) == 2
+    assert queue.size == 3
+    assert queue.pop() == b'a'
+    assert queue.pop() == b'bb'
+    assert queue.size == 0
+
+
+def test_superseded_frames_are_replaced():
+    queue = OutboundQueue()
+    queue.push(b'game 1 v1', key=('game_info', 1))
+    queue.push(b'chat')
+    queue.push(b'game 1 v2!', key=('game_info', 1))
+    assert len(queue) == 2
+    assert queue.coalesced == 1
+    assert queue.size == len(b'chat') + len(b'game 1 v2!')
+    assert queue.pop() == b'chat'
+    assert queue.pop() == b'game 1 v2!'
+
+
+def test_clear():
+    queue = OutboundQueue()
+    queue.push(b'abc', key='x')
+    queue.clear()
+    assert len(queue) == 0
+    assert queue.size == 0
+    assert 'x' not in queue
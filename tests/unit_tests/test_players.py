@@ -1,6 +1,6 @@
 from trueskill import Rating
 from src.abc.faction import Faction
-from src.players import Player
+from src.players import Player, PlayersOnline
 
 
 def test_ratings():
@@ -32,3 +32,52 @@ def test_equality_by_id():
     p2 = Player('RandomSheeo', 42)
     assert p == p2
     assert p.__hash__() == p2.__hash__()
+
+
+def make_player(login, id, session, ip='127.0.0.1'):
+    p = Player(login, session=session, ip=ip, uuid=id)
+    p.lobbyThread = None
+    return p
+
+
+def test_players_online_lookups():
+    online = PlayersOnline()
+    p = make_player('Sheeo', 42, 1234)
+    online.addUser(p)
+    assert online.findByName('Sheeo') is p
+    assert online.findById(42) is p
+    assert online.findBySession(1234) is p
+    assert online.findByIp('127.0.0.1') is None
+    p.wantToConnectToGame = True
+    assert online.findByIp('127.0.0.1') is p
+    assert list(online) == [p]
+
+
+def test_find_by_ip_gives_the_first_one_signed_in():
+    online = PlayersOnline()
+    players = [make_player(login, id, id) for id, login in enumerate(['Zed', 'Alpha', 'Mid', 'Beta'], 1)]
+    for p in players:
+        p.wantToConnectToGame = True
+        online.addUser(p)
+    assert online.findByIp('127.0.0.1') is players[0]
+
+    online.removeUser(players[0])
+    assert online.findByIp('127.0.0.1') is players[1]
+
+
+def test_players_online_replaces_same_login():
+    online = PlayersOnline()
+    old = make_player('Sheeo', 42, 1)
+    new = make_player('Sheeo', 42, 2, ip='10.0.0.1')
+    online.addUser(old)
+    online.addUser(new)
+    assert len(online) == 1
+    assert online.findByName('Sheeo') is new
+    assert online.findBySession(1) is None
+
+    # the old connection going away must not remove the new one
+    assert online.removeUser(old) == 0
+    assert online.removeUser(new) == 1
+    assert len(online) == 0
+    assert online.findByName('Sheeo') == 0
+    assert online.findById(42) is None
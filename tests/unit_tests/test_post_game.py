@@ -0,0 +1,85 @@
+from unittest import mock
+
+import pytest
+
+from src.db_pool import DatabasePool, QueryError, QueryTimeout
+from src.post_game import GameOutcome, PostGameQueue
+
+OUTCOME = GameOutcome(game_id=42, rating='global', scores=((1, 1), (3, 0)),
+                      teams=(((1, 1500, 250),), ((3, 1500, 250),)), ranks=((1,), (0,)), ended=0)
+
+
+@pytest.fixture
+def post_game():
+    return PostGameQueue(DatabasePool(mock.Mock()))
+
+
+def test_write_stores_everything_in_one_transaction(post_game):
+    db = post_game.db_pool.db
+    with mock.patch('src.post_game.execute') as execute, \
+            mock.patch('src.post_game.execute_batch') as execute_batch:
+        PostGameQueue.write(db, OUTCOME, {1: (1600, 200), 3: (1400, 200)})
+
+    db.transaction.assert_called_once_with()
+    execute.assert_called_once_with(db, mock.ANY, 42)
+    (_, _, scores, game_ids, player_ids), _ = execute_batch.call_args_list[0]
+    assert list(zip(game_ids, player_ids, scores)) == [(42, 1, 1), (42, 3, 0)]
+    (_, sql, means, deviations, player_ids), _ = execute_batch.call_args_list[2]
+    assert 'global_rating' in sql
+    assert dict(zip(player_ids, zip(means, deviations))) == {1: (1600, 200), 3: (1400, 200)}
+    db.commit.assert_called_once_with()
+
+
+def test_write_updates_the_rows_inserted_at_launch(post_game):
+    db = post_game.db_pool.db
+    with mock.patch('src.post_game.execute'), \
+            mock.patch('src.post_game.execute_batch') as execute_batch:
+        PostGameQueue.write(db, OUTCOME, {1: (1600, 200), 3: (1400, 200)})
+
+    for (_, sql, *_), _ in execute_batch.call_args_list:
+        assert not sql.lstrip().upper().startswith('INSERT')
+    (_, sql, *_), _ = execute_batch.call_args_list[0]
+    assert 'UPDATE game_player_stats SET score = ?' in sql
+    assert 'WHERE gameId = ? AND playerId = ?' in sql
+
+
+def test_failed_write_is_rolled_back(post_game):
+    db = post_game.db_pool.db
+    with mock.patch('src.post_game.execute', side_effect=QueryError("gone")):
+        with pytest.raises(QueryError):
+            PostGameQueue.write(db, OUTCOME, {})
+
+    db.rollback.assert_called_once_with()
+    assert not db.commit.called
+
+
+def test_process_notifies_once_stored(post_game):
+    receiver = mock.Mock()
+    post_game.subscribe(receiver, ['GameRecorded'])
+    with mock.patch('src.post_game.rate', return_value={1: (1600, 200)}), \
+            mock.patch.object(PostGameQueue, 'write') as write:
+        post_game.db_pool.spawn(post_game.process(OUTCOME))
+
+    write.assert_called_once_with(post_game.db_pool.db, OUTCOME, {1: (1600, 200)})
+    receiver.handle_GameRecorded.assert_called_once_with([OUTCOME, {1: (1600, 200)}])
+    assert post_game.depth == 0
+
+
+def test_failed_writes_are_retried(post_game):
+    with mock.patch('src.post_game.rate', return_value={}), \
+            mock.patch.object(PostGameQueue, 'write', side_effect=[QueryError("deadlock"), None]) as write:
+        post_game.db_pool.spawn(post_game.process(OUTCOME))
+
+    assert write.call_count == 2
+
+
+def test_timed_out_write_is_not_retried(post_game):
+    receiver = mock.Mock()
+    post_game.subscribe(receiver, ['GameRecorded'])
+    with mock.patch('src.post_game.rate', return_value={}), \
+            mock.patch.object(PostGameQueue, 'write', side_effect=QueryTimeout("slow")) as write:
+        post_game.db_pool.spawn(post_game.process(OUTCOME))
+
+    assert write.call_count == 1
+    assert not receiver.handle_GameRecorded.called
+    assert post_game.depth == 0
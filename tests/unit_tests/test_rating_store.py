@@ -0,0 +1,75 @@
+from unittest import mock
+
+import pytest
+
+from src.db_pool import DatabasePool
+from src.post_game import GameOutcome
+from src.rating_store import RatingStore
+
+
+@pytest.fixture
+def players():
+    return mock.Mock()
+
+
+@pytest.fixture
+def store(players):
+    return RatingStore(players)
+
+
+@pytest.fixture
+def db_pool():
+    return DatabasePool(mock.Mock())
+
+
+def test_load_reads_both_ratings_at_once(store, db_pool):
+    rows = [('global', 1, 1600, 100, 12), ('ladder1v1', 1, 1400, 90, 3), ('global', 2, 1500, 200, 1)]
+    with mock.patch('src.db_pool.fetch_rows', return_value=rows) as fetch_rows:
+        db_pool.spawn(store.load(db_pool, [1, 2, 3]))
+
+    ids = [1, 2, 3] + [3] * 5
+    fetch_rows.assert_called_once_with(db_pool.db, mock.ANY, *(ids + ids))
+    assert store.get(1) == ((1600, 100), (1400, 90), 12)
+    assert store.get(2).global_rating == (1500, 200)
+    # no rating yet
+    assert store.get(3) == RatingStore.default()
+
+
+def test_read_takes_what_it_has_and_keeps_nothing(store, db_pool):
+    with mock.patch('src.db_pool.fetch_rows', return_value=[('global', 1, 1600, 100, 12)]):
+        db_pool.spawn(store.load(db_pool, [1]))
+    with mock.patch('src.db_pool.fetch_rows', return_value=[('global', 2, 1500, 200, 1)]) as fetch_rows:
+        results = []
+
+        def read():
+            results.append((yield from store.read(db_pool, [1, 2])))
+
+        db_pool.spawn(read())
+
+    fetch_rows.assert_called_once_with(db_pool.db, mock.ANY, 2, 2)
+    assert results[0][1].global_rating == (1600, 100)
+    assert results[0][2].global_rating == (1500, 200)
+    # offline
+    assert store.get(2) is None
+
+
+def test_rated_game_updates_online_players(store, db_pool, players):
+    with mock.patch('src.db_pool.fetch_rows', return_value=[('ladder1v1', 1, 1400, 90, 3)]):
+        db_pool.spawn(store.load(db_pool, [1]))
+    player = mock.Mock(id=1)
+    players.findById.return_value = player
+    outcome = GameOutcome(42, 'ladder1v1', (), (), (), 0)
+
+    store.handle_GameRecorded([outcome, {1: (1450, 85), 2: (1350, 85)}])
+
+    assert store.get(1).ladder_rating == (1450, 85)
+    assert player.ladder_rating == (1450, 85)
+    # not online, the database has it
+    assert store.get(2) is None
+
+
+def test_forget(store, db_pool):
+    with mock.patch('src.db_pool.fetch_rows', return_value=[]):
+        db_pool.spawn(store.load(db_pool, [1]))
+    store.forget(1)
+    assert len(store) == 0
@@ -0,0 +1,100 @@
+import asyncio
+import time
+from unittest import mock
+
+import pytest
+
+from src.resolver import ReverseResolver
+
+
+def lookup_returning(host, delay=0):
+    calls = []
+
+    def getnameinfo(address, flags):
+        calls.append(address)
+        time.sleep(delay)
+        if host is None:
+            raise OSError("no PTR record")
+        return host, '0'
+
+    getnameinfo.calls = calls
+    return getnameinfo
+
+
+@pytest.fixture
+def resolver(loop):
+    resolver = ReverseResolver(loop=loop, timeout=0.1, ttl=60, negative_ttl=10, size=2)
+    yield resolver
+    resolver.close()
+
+
+@pytest.fixture
+def getnameinfo(monkeypatch):
+    def patch(host, delay=0):
+        lookup = lookup_returning(host, delay)
+        monkeypatch.setattr('src.resolver.socket.getnameinfo', lookup)
+        return lookup
+    return patch
+
+
+@asyncio.coroutine
+def test_result_is_cached(resolver, getnameinfo):
+    lookup = getnameinfo('host.example.com')
+
+    assert (yield from resolver.resolve('1.2.3.4')) == 'host.example.com'
+    assert (yield from resolver.resolve('1.2.3.4')) == 'host.example.com'
+    assert lookup.calls == [('1.2.3.4', 0)]
+    assert resolver.cached('1.2.3.4') == (True, 'host.example.com')
+
+
+@asyncio.coroutine
+def test_concurrent_lookups_are_shared(resolver, getnameinfo):
+    lookup = getnameinfo('host.example.com', delay=0.01)
+
+    results = yield from asyncio.gather(resolver.resolve('1.2.3.4'), resolver.resolve('1.2.3.4'))
+    assert results == ['host.example.com'] * 2
+    assert len(lookup.calls) == 1
+
+
+@asyncio.coroutine
+def test_slow_lookup_times_out(resolver, getnameinfo):
+    getnameinfo('host.example.com', delay=0.3)
+
+    assert (yield from resolver.resolve('1.2.3.4')) is None
+    assert resolver.cached('1.2.3.4') == (True, None)
+
+
+@asyncio.coroutine
+def test_timed_out_lookups_hold_their_slot_until_their_thread_returns(resolver, getnameinfo, loop):
+    resolver.max_pending = 1
+    getnameinfo('host.example.com', delay=0.3)
+
+    assert (yield from resolver.resolve('1.2.3.4')) is None
+    assert resolver.stuck == 1
+    # dropped, the thread of the first lookup is still blocked
+    assert (yield from resolver.resolve('5.6.7.8')) is None
+    assert resolver.cached('5.6.7.8') == (False, None)
+
+    yield from asyncio.sleep(0.4, loop=loop)
+    assert resolver.stuck == 0
+    getnameinfo('other.example.com')
+    assert (yield from resolver.resolve('5.6.7.8')) == 'other.example.com'
+
+
+@asyncio.coroutine
+def test_failure_is_cached_briefly(resolver, getnameinfo):
+    getnameinfo(None)
+
+    assert (yield from resolver.resolve('1.2.3.4')) is None
+    with mock.patch('src.resolver.time.time', return_value=resolver._cache['1.2.3.4'][0]):
+        assert resolver.cached('1.2.3.4') == (False, None)
+
+
+@asyncio.coroutine
+def test_cache_is_bounded(resolver, getnameinfo):
+    getnameinfo('host.example.com')
+
+    for ip in ['1.1.1.1', '2.2.2.2', '3.3.3.3']:
+        yield from resolver.resolve(ip)
+    assert len(resolver) == 2
+    assert resolver.cached('1.1.1.1') == (False, None)
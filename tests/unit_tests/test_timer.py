@@ -0,0 +1,36 @@
+import asyncio
+
+from src.timer import Timer
+
+
+@asyncio.coroutine
+def test_timer_repeats_until_stopped(loop):
+    fired = []
+    timer = Timer(lambda: fired.append(loop.time()), loop=loop)
+    timer.start(10)
+    assert timer.isActive()
+
+    yield from asyncio.sleep(0.035)
+    timer.stop()
+    count = len(fired)
+    yield from asyncio.sleep(0.02)
+
+    assert count >= 2
+    assert len(fired) == count
+    assert not timer.isActive()
+
+
+@asyncio.coroutine
+def test_timer_can_be_stopped_from_its_callback(loop):
+    fired = []
+
+    def callback():
+        fired.append(True)
+        timer.stop()
+
+    timer = Timer(callback, loop=loop)
+    timer.start(5)
+    yield from asyncio.sleep(0.03)
+
+    assert fired == [True]
+    assert not timer.isActive()
@@ -0,0 +1,120 @@
+"""
+Compares bytes on the wire and CPU time per message for the lobby framings.
+
+    python -m tools.bench_lobby_framing [iterations]
+
+The QDataStream numbers are only printed when PySide is installed.
+"""
+import json
+import sys
+import time
+
+from src.protocol.lobby import LEGACY, V2, V2_ZLIB, FrameReader, LegacyStream, StreamDeflater
+
+MESSAGES = {
+    'game_info': {"command": "game_info", "uid": 1234567, "title": "4v4 Setons clutch, no noobs",
+                  "state": "open", "featured_mod": "faf",
+                  "featured_mod_versions": {"1": 3634, "2": 3634, "3": 3634},
+                  "sim_mods": {"e7846e9b-23a4-4b95-ae3a-fb69b289a585": "BlackOps Unleashed"},
+                  "mapname": "scmp_015", "host": "Zock", "num_players": 6, "game_type": "faa",
+                  "game_time": 0, "max_players": 8,
+                  "teams": {"1": ["Zock", "Dostya", "Rhiza"], "2": ["Brackman", "Hall", "Kael"]},
+                  "options": [True, True, False, True, True]},
+    'player_info': {"command": "player_info", "login": "Dostya", "rating_mean": 1523.45,
+                    "rating_deviation": 85.12, "ladder_rating_mean": 1411.3, "ladder_rating_deviation": 102.6,
+                    "number_of_games": 1337, "avatar": None, "league": None, "clan": "SCD", "country": "RU"},
+    'notice': {"command": "notice", "style": "info", "text": "Game launched"},
+}
+
+
+def qdatastream_pack(data_string):
+    from PySide.QtCore import QByteArray, QDataStream, QIODevice
+    reply = QByteArray()
+    stream = QDataStream(reply, QIODevice.WriteOnly)
+    stream.setVersion(QDataStream.Qt_4_2)
+    stream.writeUInt32(0)
+    stream.writeQString(data_string)
+    stream.device().seek(0)
+    stream.writeUInt32(reply.size() - 4)
+    return reply
+
+
+def per_message(fn, iterations):
+    start = time.process_time()
+    for _ in range(iterations):
+        fn()
+    return (time.process_time() - start) / iterations * 1e6
+
+
+def bench(name, message, iterations):
+    data_string = json.dumps(message)
+    v2_frame = V2.pack_message(message)
+
+    legacy_frame = LEGACY.pack_message(message)
+
+    def decode_legacy():
+        reader = FrameReader()
+        reader.feed(legacy_frame)
+        for body in reader.frames():
+            json.loads(LegacyStream(body).readQString())
+
+    def decode_v2():
+        reader = FrameReader()
+        reader.feed(v2_frame)
+        for body in reader.frames():
+            json.loads(str(body, "utf-8"))
+
+    rows = [
+        ('legacy', len(LEGACY.pack_message(message)), per_message(lambda: LEGACY.pack_message(message), iterations)),
+        ('v2', len(v2_frame), per_message(lambda: V2.pack_message(message), iterations)),
+    ]
+    try:
+        rows.insert(0, ('qdatastream', qdatastream_pack(data_string).size(),
+                        per_message(lambda: qdatastream_pack(json.dumps(message)), iterations)))
+    except ImportError:
+        pass
+
+    print(name)
+    for framing, size, encode_us in rows:
+        print("  {:<12} {:>6} bytes  {:>7.2f} us/encode".format(framing, size, encode_us))
+    for framing, decode in (('legacy', decode_legacy), ('v2', decode_v2)):
+        print("  {:<12} {:>6}        {:>7.2f} us/decode".format(framing, '', per_message(decode, iterations)))
+
+
+def bench_login(players, iterations):
+    """
+    The player list a client gets on login, one frame per player or batched
+    """
+    messages = [dict(MESSAGES['player_info'], login="player{}".format(i)) for i in range(players)]
+
+    def batched(framing):
+        return b''.join(framing.pack_batch(messages[start:start + 500])
+                        for start in range(0, len(messages), 500))
+
+    def deflated():
+        # one write per message, on a single stream
+        deflater = StreamDeflater()
+        return b''.join(deflater.compress(V2.pack_message(message)) for message in messages)
+
+    rows = [
+        ('legacy', lambda: b''.join(LEGACY.pack_message(message) for message in messages)),
+        ('v2', lambda: b''.join(V2.pack_message(message) for message in messages)),
+        ('v2 batch', lambda: batched(V2)),
+        ('v2+zlib batch', lambda: batched(V2_ZLIB)),
+        ('v2 deflate', deflated),
+        ('v2 batch deflate', lambda: StreamDeflater().compress(batched(V2))),
+    ]
+    print("login with {} players online".format(players))
+    for name, encode in rows:
+        print("  {:<16} {:>8} bytes  {:>8.2f} ms".format(name, len(encode()),
+                                                       per_message(encode, iterations) / 1000))
+
+
+def main(iterations=20000):
+    for name, message in sorted(MESSAGES.items()):
+        bench(name, message, iterations)
+    bench_login(3000, max(1, iterations // 1000))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,124 @@
+"""
+Lists the queries whose SQL text is built at runtime.
+
+    python -m tools.query_audit [path ...]
+
+A query built with %, + or format gets a new text every time, so it can't
+be kept in a StatementCache, the database can't reuse its plan either, and
+values pasted into it are an injection waiting to happen. Values should be
+bound parameters instead. Table names can't be bound, those queries are
+listed too and have to be judged one by one.
+
+Looks at the SQL passed to QSqlQuery's prepare and exec_, to the
+fetch, fetch_one and execute of the database pool, and to the functions
+of src.db_pool taking a connection. Exits with 1 if it found any.
+"""
+import ast
+import os
+import sys
+
+QUERY_METHODS = {'prepare', 'exec_', 'fetch', 'fetch_one', 'execute'}
+# called with the connection first, then the SQL
+QUERY_FUNCTIONS = {'fetch_rows', 'execute', 'execute_batch'}
+DEFAULT_PATHS = ['src', 'server.py', 'serverUpdater.py', 'replayServer.py', 'tournamentServer.py']
+
+
+# string literals are ast.Str up to Python 3.7, ast.Constant after
+_CONSTANT = getattr(ast, 'Constant', ())
+_FSTRING = getattr(ast, 'JoinedStr', ())
+
+
+def _is_text(node):
+    if _CONSTANT and isinstance(node, _CONSTANT):
+        return isinstance(node.value, str)
+    return isinstance(node, ast.Str)
+
+
+def is_dynamic(node):
+    """
+    Whether an expression builds its text at runtime, rather than being a literal
+    """
+    if _is_text(node):
+        return False
+    if isinstance(node, ast.BinOp):
+        return isinstance(node.op, (ast.Add, ast.Mod)) and (_is_text(node.left) or _is_text(node.right)
+                                                             or is_dynamic(node.left) or is_dynamic(node.right))
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute):
+        return node.func.attr == 'format'
+    return isinstance(node, _FSTRING)
+
+
+class QueryVisitor(ast.NodeVisitor):
+    def __init__(self, path):
+        self.path = path
+        self.scope = []
+        self.found = []
+
+    def _visit_scope(self, node):
+        self.scope.append(node.name)
+        self.generic_visit(node)
+        self.scope.pop()
+
+    visit_FunctionDef = visit_ClassDef = _visit_scope
+
+    def visit_Call(self, node):
+        sql, method = None, None
+        if isinstance(node.func, ast.Attribute) and node.func.attr in QUERY_METHODS and node.args:
+            sql, method = node.args[0], node.func.attr
+        elif isinstance(node.func, ast.Name) and node.func.id in QUERY_FUNCTIONS and len(node.args) > 1:
+            sql, method = node.args[1], node.func.id
+        if sql is not None:
+            # a query kept in a variable, like queryStr, is followed to its assignment
+            if isinstance(sql, ast.Name):
+                sql = self.assignments.get(sql.id, sql)
+            if is_dynamic(sql):
+                self.found.append((self.path, node.lineno, '.'.join(self.scope) or '<module>', method))
+        self.generic_visit(node)
+
+    def audit(self, tree):
+        self.assignments = {}
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+                self.assignments[node.targets[0].id] = node.value
+        self.visit(tree)
+        return self.found
+
+
+def audit_file(path):
+    """
+    :return: list of (path, line, function, method) of the dynamic queries
+    """
+    with open(path, encoding='utf-8') as f:
+        source = f.read()
+    try:
+        tree = ast.parse(source, path)
+    except SyntaxError as ex:
+        print("{}: can't parse: {}".format(path, ex), file=sys.stderr)
+        return []
+    return QueryVisitor(path).audit(tree)
+
+
+def python_files(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.endswith('.py'):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+
+def main(paths):
+    found = []
+    for path in python_files(paths or DEFAULT_PATHS):
+        found.extend(audit_file(path))
+    for path, line, function, method in found:
+        print("{}:{}: {} builds the SQL for {}()".format(path, line, function, method))
+    print("{} dynamic queries".format(len(found)))
+    return 1 if found else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
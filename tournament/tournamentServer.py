@@ -171,7 +171,6 @@ class tournamentServer(QtNetwork.QTcpServer):
                 
     def incomingConnection(self, socketId):
         
-        reload(tournamentServerThread)
         #self.logger.debug("Incoming tourney Connection")
         self.updaters.append(tournamentServerThread.tournamentServerThread(socketId, self))    
     
@@ -180,5 +179,4 @@ class tournamentServer(QtNetwork.QTcpServer):
     def removeUpdater(self, updater):
         if updater in self.updaters:
             self.updaters.remove(updater)
-            updater.deleteLater()
     
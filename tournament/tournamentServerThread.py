@@ -19,24 +19,25 @@
 
 import operator
 import logging
-import json
 
-from PySide.QtCore import QObject
-from PySide.QtCore import QByteArray, QDataStream, QIODevice, QFile, QCoreApplication
-from PySide import QtCore, QtNetwork
+from PySide import QtNetwork
 from PySide.QtSql import *
 
 import challonge
 from passwords import CHALLONGE_KEY, CHALLONGE_USER
+from src.framed_connection import FramedConnection
+from src.timer import Timer
 
 
-class tournamentServerThread(QObject):
+class tournamentServerThread(FramedConnection):
     """
     FA server thread spawned upon every incoming connection to
     prevent collisions.
     """
     def __init__(self, socketId, parent=None):
-        super(tournamentServerThread, self).__init__(parent)
+        socket = QtNetwork.QTcpSocket()
+        socket.setSocketDescriptor(socketId)
+        FramedConnection.__init__(self, socket, parent, prefix='tournament')
 
         self.log = logging.getLogger(__name__)
 
@@ -44,24 +45,12 @@ class tournamentServerThread(QObject):
         self.app = None
         
         challonge.set_credentials(CHALLONGE_USER, CHALLONGE_KEY)
-        
-        self.socket = QtNetwork.QTcpSocket(self)
-        self.socket.setSocketDescriptor(socketId)
-        self.parent = parent
+
+        self.pingTimer = Timer(self.ping)
         
         if self.socket.state() == 3 and self.socket.isValid() :
-            
-            self.nextBlockSize = 0
-    
-            self.blockSize = 0   
-
-            self.socket.readyRead.connect(self.readDatas)
-            self.socket.disconnected.connect(self.disconnection)
-
             self.parent.db.open()   
-            self.pingTimer = QtCore.QTimer(self)
             self.pingTimer.start(31000)
-            self.pingTimer.timeout.connect(self.ping)
             
     def ping(self) :
         self.sendJSON(dict(command="ping"))
@@ -120,116 +109,7 @@ class tournamentServerThread(QObject):
         self.sendJSON(dict(command="tournaments_info", data=self.parent.tournaments))
         
     
-    def handleAction(self, action, stream):
-        self.receiveJSON(action, stream)
-        return 1
-
-
-    def readDatas(self):
-        if self.socket is not None:
-            if self.socket.isValid() :
-                ins = QDataStream(self.socket)
-                ins.setVersion(QDataStream.Qt_4_2)
-                loop = 0
-                while not ins.atEnd():
-                    QCoreApplication.processEvents()
-                    loop += 1
-                    if self.socket is not None:
-                        if self.socket.isValid():
-                            if self.blockSize == 0:
-                                if self.socket.isValid():
-                                    if self.socket.bytesAvailable() < 4:
-                                        return
-                                    self.blockSize = ins.readUInt32()
-                                else:
-                                    return
-                            if not self.socket.isValid():
-                                return  
-                            action = ins.readQString()
-                            self.handleAction(action, ins)
-                            self.blockSize = 0
-                        else: 
-                            return    
-                    else:
-                        return
-                return
-
-
-    def disconnection(self):
-        self.done()
-
-
-    def sendJSON(self, data_dictionary):
-        """
-        Simply dumps a dictionary into a string and feeds it into the QTCPSocket
-        """
-        try:
-            data_string = json.dumps(data_dictionary)
-            self.sendReply(data_string)
-        except:
-            self.log.warning("wrong data")
-            self.socket.abort()
-            return
-
-
-    def receiveJSON(self, data_string, stream):
-        """
-        A fairly pythonic way to process received strings as JSON messages.
-        """
-        try:
-            message = json.loads(data_string)
-
-            cmd = "command_" + message['command']
-            if hasattr(self, cmd):
-                getattr(self, cmd)(message)  
-        except:
-            self.log.warning("command error")
-            self.socket.abort()
-            return
-
-
-    def sendReply(self, action, *args, **kwargs):
-        try:
-            if hasattr(self, "socket"):
-                reply = QByteArray()
-                stream = QDataStream(reply, QIODevice.WriteOnly)
-                stream.setVersion(QDataStream.Qt_4_2)
-                stream.writeUInt32(0)
-                
-                stream.writeQString(action)
-
-                for arg in args :
-                    if type(arg) is LongType :
-                        stream.writeQString(str(arg))
-                    if type(arg) is IntType:
-                        stream.writeInt(int(arg))
-                    elif type(arg) is StringType:
-                        stream.writeQString(arg)
-                    elif isinstance(arg, str):                       
-                        stream.writeQString(arg) 
-                    elif type(arg) is FloatType:
-                        stream.writeFloat(arg)
-                    elif type(arg) is ListType:
-                        stream.writeQString(str(arg))                        
-                    elif type(arg) is QFile :
-                        arg.open(QIODevice.ReadOnly)
-                        fileDatas = QByteArray(arg.readAll())
-                        stream.writeInt32(fileDatas.size())
-                        stream.writeRawData(fileDatas.data())
-                        arg.close()                        
-                #stream << action << options
-                stream.device().seek(0)
-                
-                stream.writeUInt32(reply.size() - 4)
-                if self.socket:
-                    self.socket.write(reply)
-
-
-        except:
-                self.log.exception("Something awful happened when sending reply !")  
-
-
     def done(self):
+        self.pingTimer.stop()
+        self.closeSocket()
         self.parent.removeUpdater(self)
-        if self.socket:
-            self.socket.deleteLater()
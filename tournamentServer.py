@@ -19,8 +19,10 @@
 #-------------------------------------------------------------------------------
 
 
+import asyncio
 from logging import handlers
 
+from quamash import QEventLoop
 from PySide.QtCore import QObject
 
 from passwords import DB_SERVER, DB_PORT, DB_LOGIN, DB_PASSWORD, DB_TABLE
@@ -71,8 +73,10 @@ if __name__ == '__main__':
     try:
         
         app = QtCore.QCoreApplication(sys.argv)
+        loop = QEventLoop(app)
+        asyncio.set_event_loop(loop)
         server = start()
-        app.exec_()
+        loop.run_forever()
     
     except Exception as ex:
         
@@ -21,6 +21,9 @@ import logging
 from PySide.QtCore import SIGNAL, SLOT
 from PySide import QtNetwork
 
+import config
+from src.counter_aggregator import CounterAggregator
+from src.db_pool import DatabasePool
 from . import updateServerThread
 from . import createPatch
 
@@ -32,6 +35,9 @@ class updateServer(QtNetwork.QTcpServer):
         self.parent = parent
         self.threads = []
         self.db = self.parent.db
+        # download counts, written every now and then
+        self.counters = CounterAggregator(DatabasePool(self.db))
+        self.counters.start(config.COUNTER_FLUSH_INTERVAL)
         self.updaters = []
         self.patching = False
 
@@ -39,7 +45,8 @@ class updateServer(QtNetwork.QTcpServer):
         
     def incomingConnection(self, socketId):
         
-        self.updaters.append(updateServerThread.updateServerThread(socketId, self))    
+        self.updaters.append(updateServerThread.updateServerThread(socketId, self,
+                                                                    idle_timeout=config.UPDATER_IDLE_TIMEOUT or None))
 
     def createPatch(self, patches):
 
@@ -60,7 +67,6 @@ class updateServer(QtNetwork.QTcpServer):
     def removeUpdater(self, updater):
         if updater in self.updaters:
             self.updaters.remove(updater)
-            updater.deleteLater()
         
         
     def done(self):
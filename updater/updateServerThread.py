@@ -23,24 +23,27 @@ import logging
 import hashlib
 import json
 
-from PySide.QtCore import QObject
-from PySide.QtCore import QByteArray, QDataStream, QIODevice, QCoreApplication
 from PySide import QtNetwork
 from PySide.QtSql import *
 from configobj import ConfigObj
 
+from src.counter_aggregator import MOD_DOWNLOADS
+from src.framed_connection import FramedConnection
+
 
 config = ConfigObj("/etc/faforever/faforever.conf")
 
-class updateServerThread(QObject):
+class updateServerThread(FramedConnection):
     """
     FA server thread spawned upon every incoming connection to
     prevent collisions.
     """
     
     
-    def __init__(self, socketId, parent=None):
-        super(updateServerThread, self).__init__(parent)
+    def __init__(self, socketId, parent=None, idle_timeout=None):
+        socket = QtNetwork.QTcpSocket()
+        socket.setSocketDescriptor(socketId)
+        FramedConnection.__init__(self, socket, parent, prefix='updater', idle_timeout=idle_timeout)
 
         self.log = logging.getLogger(__name__)
 
@@ -48,23 +51,10 @@ class updateServerThread(QObject):
         self.app = None
         self.tableMod = "updates_faf"
         self.tableModFiles = "updates_faf_files"
-                
-        self.socket = QtNetwork.QTcpSocket(self)
-        self.socket.setSocketDescriptor(socketId)
-        self.parent = parent
 
         self.patchToCreate = []
         
         if self.socket.state() == 3 and self.socket.isValid() :
-            
-            self.nextBlockSize = 0
-    
-            self.blockSize = 0   
-
-            self.socket.readyRead.connect(self.readDatas)
-            self.socket.disconnected.connect(self.disconnection)
-            self.socket.error.connect(self.displayError)
-
             self.parent.db.open()   
               
 
@@ -197,10 +187,7 @@ limit 1   " % (self.tableModFiles, self.tableMod, self.tableMod, self.tableModFi
         
         if action == "ADD_DOWNLOAD_SIM_MOD":
             uid = stream.readQString()
-            query = QSqlQuery(self.parent.db)
-            query.prepare("UPDATE `table_mod` SET downloads=downloads+1 WHERE uid = ?")
-            query.addBindValue(uid)
-            query.exec_()
+            self.parent.counters.incr(MOD_DOWNLOADS, uid)
                         
 
         
@@ -214,7 +201,7 @@ limit 1   " % (self.tableModFiles, self.tableMod, self.tableMod, self.tableModFi
                 self.tableMod = "updates_faf"
                 self.tableModFiles = "updates_faf_files"
                 files = self.getFileListFromDb(self.tableMod , "bin")
-                self.sendReply("LIST_FILES_TO_UP", files)
+                self.sendReply("LIST_FILES_TO_UP", str(files))
 
 
 #            elif app == "balancetesting" :
@@ -225,12 +212,12 @@ limit 1   " % (self.tableModFiles, self.tableMod, self.tableMod, self.tableModFi
                
             elif "gamedata" in app.lower() :
                 files = self.getFileListFromDb(self.tableMod , "gamedata")
-                self.sendReply("LIST_FILES_TO_UP", files) 
+                self.sendReply("LIST_FILES_TO_UP", str(files)) 
             else :
                 self.tableMod = "updates_" + app
                 self.tableModFiles = self.tableMod + "_files"
                 files = self.getFileListFromDb(self.tableMod , "bin")
-                self.sendReply("LIST_FILES_TO_UP", files)
+                self.sendReply("LIST_FILES_TO_UP", str(files))
         
         
         
@@ -478,129 +465,11 @@ limit 1   " % (self.tableModFiles, self.tableMod, self.tableMod, self.tableModFi
 
 
 
-    def readDatas(self):
-
-        #self.readingSocket = True
-        if self.socket is not None:
-            if self.socket.isValid() :
-                ins = QDataStream(self.socket)
-        
-        
-                ins.setVersion(QDataStream.Qt_4_2)
-                loop = 0
-                while not ins.atEnd():
-                    QCoreApplication.processEvents()
-                    loop += 1
-                    if loop > 1000 : break
-                     
-                    
-                    if self.socket is not None:
-                        if self.socket.isValid() :
-         
-                            if self.blockSize == 0:
-                                if self.socket.isValid() :
-                                    if self.socket.bytesAvailable() < 4:
-                        
-                                        return
-                                    self.blockSize = ins.readUInt32()
-                                else :
-        
-                                    return
-                
-                            if self.socket.isValid() :
-                                if self.socket.bytesAvailable() < self.blockSize:
-                                    
-                    
-                                    bytesReceived = str(self.socket.bytesAvailable())
-        
-                                    return
-                        
-                    
-                                bytesReceived = str(self.socket.bytesAvailable())
-        
-                            else :
-        
-                                return  
-                    
-                            
-        
-                            action = ins.readQString()
-                            
-        
-                            self.handleAction(action, ins)
-                                
-        
-                            self.blockSize = 0
-                            
-                        else : 
-        
-                            return    
-        
-                    else :
-                        return
-                return
-
-    def disconnection(self):
-        #self.log.info('client disconnect')
-        self.done()
-
-    def sendReply(self, action, *args, **kwargs) :
-        
-        try :
-            
-            if hasattr(self, "socket"):
-
-                reply = QByteArray()
-                stream = QDataStream(reply, QIODevice.WriteOnly)
-                stream.setVersion(QDataStream.Qt_4_2)
-                stream.writeUInt32(0)
-                
-                stream.writeQString(action)
-
-    
-                for arg in args :
-                    if isinstance(arg, int):
-                        stream.writeInt(int(arg))
-                    elif isinstance(arg, str):                       
-                        stream.writeQString(arg) 
-                    elif isinstance(arg, list):
-                        stream.writeQString(str(arg))                        
-
-                #stream << action << options
-                stream.device().seek(0)
-                
-                stream.writeUInt32(reply.size() - 4)
-
-                
-                self.socket.write(reply)
-
-
-
-#            else :
-#                # no socket !?
-#                self.quit()
-
-        except :
-                self.log.exception("Something awful happened when sending reply !")  
-  
     def done(self) :
-        if self.socket is not None:
-            #self.parent.addSocketToDelete(self.socket)
-            self.socket.readyRead.disconnect(self.readDatas)
-            self.socket.disconnected.disconnect(self.disconnection)
-            self.socket.error.disconnect(self.displayError)
-            self.socket.close()
-            #self.socket.deleteLater()
-            self.socket = None
-        
+        self.closeSocket()
+
         if len(self.patchToCreate) > 0:
             self.parent.createPatch(self.patchToCreate)
 
 
         self.parent.removeUpdater(self)
-        
-        
-        
-    # Display errors from servers
-    def displayError(self, socketError):
-        pass